@@ -0,0 +1,212 @@
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# --- Admission control ---
+# Under overload, AdmissionControlMiddleware sheds the requests that matter
+# least (list polling, search) with a 503 and Retry-After, so that message
+# POSTs and authentication keep working.
+#
+# Every request gets a priority from settings.ADMISSION_PRIORITIES (first
+# matching rule; NORMAL otherwise). The worker tracks its requests in flight
+# and the latency of recent requests; each policy in settings.ADMISSION_POLICIES
+# may then reject a request of a given priority. Load policies have no limit
+# for CRITICAL requests; a TimeWindowPolicy (the former fixed opening hours)
+# rejects every priority unless given a list. CRITICAL requests count as in
+# flight but are left out of the latency samples: some are slow by design
+# (password hashing at sign-in, the admin) and would shed the others. State is per worker process:
+# each worker protects its own capacity.
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+LOW = 'low'
+
+DEFAULT_PRIORITIES = [
+    {'priority': CRITICAL, 'methods': ('POST',), 'path': r'^/api/chats/[^/]+/messages/$'},
+    {'priority': CRITICAL, 'path': r'^/(api/token|api-auth|admin|metrics)/'},
+    # Polling and search
+    {'priority': LOW, 'methods': ('GET', 'HEAD'), 'path': r'^/api/chats/([^/]+/messages/)?$'},
+]
+
+DEFAULT_POLICIES = [
+    {'policy': 'chats.admission.ConcurrencyPolicy', 'limits': {LOW: 32, NORMAL: 64}},
+    {'policy': 'chats.admission.LatencyPolicy', 'limits': {LOW: 0.5, NORMAL: 2.0}},
+]
+
+
+@dataclass(frozen=True)
+class PriorityRule:
+    '''Requests matching `methods` and the `path` regex (all by default) get `priority`'''
+    priority: str
+    methods: tuple = ()
+    path: str = ''
+
+    def __post_init__(self):
+        object.__setattr__(self, 'methods', tuple(method.upper() for method in self.methods))
+        object.__setattr__(self, '_path_re', re.compile(self.path) if self.path else None)
+
+    def matches(self, request):
+        if self.methods and request.method not in self.methods:
+            return False
+        return self._path_re is None or bool(self._path_re.search(request.path))
+
+
+@dataclass(frozen=True)
+class Rejection:
+    status: int
+    detail: str
+    retry_after: int = None
+
+
+class LoadTracker:
+    '''Requests in flight and latency of the requests completed in the last `window` seconds'''
+
+    # Seconds a computed latency quantile is reused (sorting samples on every request is wasteful)
+    REFRESH_INTERVAL = 0.5
+
+    def __init__(self, window=10, max_samples=2_000, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self._samples = deque(maxlen=max_samples)  # (completed at, seconds)
+        self._quantiles = {}  # quantile -> (computed at, value)
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, seconds=None):
+        '''Ends a request; its latency is sampled unless `seconds` is None'''
+        with self.lock:
+            self.in_flight -= 1
+            if seconds is not None:
+                self._samples.append((self.clock(), seconds))
+
+    def latency(self, quantile):
+        '''Latency quantile of recent requests in seconds (0 when idle)'''
+        now = self.clock()
+        computed_at, value = self._quantiles.get(quantile, (None, 0.0))
+        if computed_at is not None and now - computed_at < self.REFRESH_INTERVAL:
+            return value
+        with self.lock:
+            while self._samples and self._samples[0][0] < now - self.window:
+                self._samples.popleft()
+            latencies = sorted(seconds for _, seconds in self._samples)
+        value = latencies[int(quantile * (len(latencies) - 1))] if latencies else 0.0
+        self._quantiles[quantile] = (now, value)
+        return value
+
+
+# --- Policies ---
+# check(priority, tracker) returns a Rejection, or None to let the request in.
+
+class ConcurrencyPolicy:
+    '''Sheds a priority when this worker already has `limits[priority]` requests in flight'''
+
+    def __init__(self, limits, retry_after=1):
+        self.limits = limits
+        self.retry_after = retry_after
+
+    def check(self, priority, tracker):
+        limit = self.limits.get(priority)
+        if limit is not None and tracker.in_flight >= limit:
+            return Rejection(503, 'Server busy, please retry later.', self.retry_after)
+        return None
+
+
+class LatencyPolicy:
+    '''
+    Sheds a priority while the `quantile` latency of recent requests (the
+    tracker's window) exceeds `limits[priority]` seconds. Shedding lowers the
+    latency, which lets the priority back in: the policy settles on the load
+    the worker can serve in time.
+    '''
+
+    def __init__(self, limits, quantile=0.9, retry_after=5):
+        self.limits = limits
+        self.quantile = quantile
+        self.retry_after = retry_after
+
+    def check(self, priority, tracker):
+        limit = self.limits.get(priority)
+        if limit is not None and tracker.latency(self.quantile) > limit:
+            return Rejection(503, 'Server busy, please retry later.', self.retry_after)
+        return None
+
+
+class TimeWindowPolicy:
+    '''
+    Rejects `priorities` (all by default) outside `start`-`end` ("HH:MM", server
+    time), as RestrictAccessByTimeMiddleware does.
+    '''
+
+    def __init__(self, start='06:00', end='21:00', priorities=None):
+        self.start = datetime.strptime(start, '%H:%M').time()
+        self.end = datetime.strptime(end, '%H:%M').time()
+        self.priorities = priorities
+
+    def check(self, priority, tracker):
+        if self.priorities is not None and priority not in self.priorities:
+            return None
+        now = datetime.now().time()
+        if now < self.start or now >= self.end:
+            return Rejection(
+                403,
+                'Access restricted. The messaging service is available only between '
+                f'{self.start:%H:%M} and {self.end:%H:%M}.',
+            )
+        return None
+
+
+def load_priorities():
+    '''Rules from settings.ADMISSION_PRIORITIES (a list of PriorityRule keyword dicts)'''
+    return [
+        PriorityRule(**rule)
+        for rule in getattr(settings, 'ADMISSION_PRIORITIES', DEFAULT_PRIORITIES)
+    ]
+
+
+def load_policies():
+    '''
+    Policies from settings.ADMISSION_POLICIES: dicts with the dotted path of the
+    class under 'policy' and its keyword arguments.
+    '''
+    policies = []
+    for options in getattr(settings, 'ADMISSION_POLICIES', DEFAULT_POLICIES):
+        options = dict(options)
+        policies.append(import_string(options.pop('policy'))(**options))
+    return policies
+
+
+class AdmissionController:
+
+    def __init__(self, priorities=None, policies=None, tracker=None):
+        self.priorities = load_priorities() if priorities is None else priorities
+        self.policies = load_policies() if policies is None else policies
+        self.tracker = tracker or LoadTracker(getattr(settings, 'ADMISSION_LATENCY_WINDOW', 10))
+
+    def priority_of(self, request):
+        for rule in self.priorities:
+            if rule.matches(request):
+                return rule.priority
+        return NORMAL
+
+    def admit(self, priority):
+        '''A Rejection, or None once the request is counted in flight (call finish() after it)'''
+        for policy in self.policies:
+            rejection = policy.check(priority, self.tracker)
+            if rejection is not None:
+                return rejection
+        self.tracker.start()
+        return None
+
+    def finish(self, priority, seconds):
+        # CRITICAL latency (e.g. password hashing) says nothing about the load
+        self.tracker.finish(None if priority == CRITICAL else seconds)
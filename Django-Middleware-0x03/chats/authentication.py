@@ -0,0 +1,198 @@
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject, cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .middleware import DualModeMiddleware
+
+# --- Stateless JWT authentication ---
+# Access tokens carry the claims the API needs to authorize a request (user_id,
+# role, is_active, is_staff), so authenticating a request costs no database
+# query: request.user is a ChatTokenUser built from the token. The User row is only
+# loaded when something reads an attribute that isn't a claim (e.g. email),
+# once per request.
+#
+# Claims are stamped when a token pair is obtained and again on every refresh,
+# so a role change or deactivation reaches clients within one access token
+# lifetime. To cut a user off sooner, set JWT_REVOCATION_CHECK = True: tokens
+# issued before revoke_tokens(user) are then rejected (checked against the cache
+# on each request and on refresh; shared across workers only with a shared cache
+# backend).
+
+# Claims copied from the User onto every token
+USER_CLAIMS = ('role', 'is_active', 'is_staff')
+
+
+def set_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def revocation_key(user_id):
+    return f'chats:auth:revoked:{user_id}'
+
+
+def revoke_tokens(user_id):
+    '''
+    Rejects every token issued to the user until now, refresh tokens included
+    (when JWT_REVOCATION_CHECK is on). The mark outlives the longest-lived token,
+    then expires.
+    '''
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME).total_seconds()
+    cache.set(revocation_key(user_id), int(time.time()), timeout=int(lifetime) + 60)
+
+
+def is_revoked(token):
+    revoked_at = cache.get(revocation_key(token[api_settings.USER_ID_CLAIM]))
+    return revoked_at is not None and token.get('iat', 0) <= revoked_at
+
+
+class ChatTokenUser(TokenUser):
+    '''
+    request.user for token-authenticated requests. role, is_active and
+    is_staff come from the token; any other attribute loads the User row
+    (lazily, once). Pass `user.pk` (not the object) to ORM filters, or
+    `user.user` where a real instance is needed.
+    '''
+
+    @cached_property
+    def id(self):
+        return uuid.UUID(str(self.token[api_settings.USER_ID_CLAIM]))
+
+    @cached_property
+    def role(self):
+        if 'role' in self.token:
+            return self.token['role']
+        return self.user.role  # Token issued before claims were added
+
+    @cached_property
+    def is_active(self):
+        if 'is_active' in self.token:
+            return self.token['is_active']
+        return self.user.is_active
+
+    @cached_property
+    def is_staff(self):
+        if 'is_staff' in self.token:
+            return self.token['is_staff']
+        return self.user.is_staff
+
+    @cached_property
+    def user(self):
+        '''The User row, loaded on first use'''
+        return get_user_model()._default_manager.get(pk=self.pk)
+
+    def __str__(self):
+        return str(self.pk)
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __getattr__(self, attr):
+        # Only reached for attributes not defined above
+        if attr.startswith('_') or attr == 'token':
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.user, attr)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    '''JWT authentication without a User lookup (see ChatTokenUser)'''
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if getattr(settings, 'JWT_REVOCATION_CHECK', False) and is_revoked(validated_token):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return user
+
+
+class ChatTokenObtainPairSerializer(TokenObtainPairSerializer):
+
+    @classmethod
+    def get_token(cls, user):
+        return set_user_claims(super().get_token(user), user)
+
+
+class ChatTokenRefreshSerializer(TokenRefreshSerializer):
+    '''
+    Re-reads the claims, so new access tokens reflect changes to the user, and
+    rejects refresh tokens revoked by revoke_tokens() (with JWT_REVOCATION_CHECK).
+    '''
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if getattr(settings, 'JWT_REVOCATION_CHECK', False) and is_revoked(refresh):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        user = (
+            get_user_model()._default_manager
+            .filter(**{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)})
+            .first()
+        )
+        if user is not None:
+            set_user_claims(refresh, user)
+            attrs = {**attrs, 'refresh': str(refresh)}
+        return super().validate(attrs)
+
+
+class JWTAuthenticationMiddleware(DualModeMiddleware):
+    '''
+    Sets request.user from a Bearer token for middleware that runs before DRF
+    (e.g. RolepermissionMiddleware), without a database query. Requests without
+    a valid token keep the session user; DRF still rejects bad tokens itself.
+    Must come after AuthenticationMiddleware.
+    '''
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.authentication = StatelessJWTAuthentication()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.META.get(api_settings.AUTH_HEADER_NAME):
+            # Not evaluated here: the session user is only loaded if the token is invalid
+            session_user = request.user if hasattr(request, 'user') else AnonymousUser()
+            request.user = SimpleLazyObject(lambda: self.authenticate(request) or session_user)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.META.get(api_settings.AUTH_HEADER_NAME):
+            # Decoded now rather than lazily: request.auser() must not need a thread.
+            # The revocation check reads the cache: off the event loop.
+            if getattr(settings, 'JWT_REVOCATION_CHECK', False):
+                user = await sync_to_async(self.authenticate)(request)
+            else:
+                user = self.authenticate(request)
+            if user is not None:
+                request.user = user
+
+                async def auser():
+                    return user
+
+                request.auser = auser
+        return await self.get_response(request)
+
+    def authenticate(self, request):
+        try:
+            result = self.authentication.authenticate(request)
+        except (AuthenticationFailed, InvalidToken, TokenError):
+            return None
+        return result[0] if result else None
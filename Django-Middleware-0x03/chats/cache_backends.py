@@ -0,0 +1,164 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Cache in a SQLite file shared by every worker process on the node, the default
+# when no Redis is configured. Rate limit counters and token revocation stamps
+# must be seen by all workers: with a per-process cache (LocMemCache) N workers
+# would allow N times the limit.
+#
+# - WAL mode: readers in all workers proceed while one writes.
+# - add() and incr() are atomic across processes (conditional insert, and a
+#   read-modify-write under SQLite's write lock).
+# - Expired rows are purged (and MAX_ENTRIES enforced) every CULL_EVERY writes.
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'chats.cache_backends.SharedSQLiteCache',
+#         'LOCATION': '/var/cache/messaging_app/cache.sqlite3',
+#     }
+# }
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache_entries (
+    cache_key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL
+)
+'''
+
+
+class SharedSQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = str(location)
+        # Seconds a write waits for another worker's write lock
+        self.lock_timeout = float(options.get('LOCK_TIMEOUT', 10))
+        self.cull_every = int(options.get('CULL_EVERY', 200))
+        self._local = threading.local()
+        self._writes = 0
+
+    def _db(self):
+        # One connection per thread, never reused across a fork (preloading servers)
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.lock_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(_SCHEMA)
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _get_row(self, key, now):
+        row = self._db().execute(
+            'SELECT value, expires FROM cache_entries WHERE cache_key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def _maybe_cull(self):
+        self._writes += 1
+        if self._writes % self.cull_every:
+            return
+        db = self._db()
+        db.execute('DELETE FROM cache_entries WHERE expires <= ?', (time.time(),))
+        (count,) = db.execute('SELECT COUNT(*) FROM cache_entries').fetchone()
+        if count > self._max_entries:
+            # Entries that expire first go first; entries that never expire go last
+            db.execute(
+                'DELETE FROM cache_entries WHERE cache_key IN ('
+                '  SELECT cache_key FROM cache_entries'
+                '  ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency if self._cull_frequency else count,),
+            )
+
+    def get(self, key, default=None, version=None):
+        row = self._get_row(self._key(key, version), time.time())
+        return default if row is None else row[0]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._db().execute(
+            'INSERT OR REPLACE INTO cache_entries (cache_key, value, expires) VALUES (?, ?, ?)',
+            (
+                self._key(key, version),
+                pickle.dumps(value, self.pickle_protocol),
+                self.get_backend_timeout(timeout),
+            ),
+        )
+        self._maybe_cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Insert, or take over an expired row; atomic across processes
+        cursor = self._db().execute(
+            'INSERT INTO cache_entries (cache_key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT(cache_key) DO UPDATE SET '
+            '  value = excluded.value, expires = excluded.expires '
+            'WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?',
+            (
+                self._key(key, version),
+                pickle.dumps(value, self.pickle_protocol),
+                self.get_backend_timeout(timeout),
+                time.time(),
+            ),
+        )
+        if cursor.rowcount != 1:
+            return False
+        self._maybe_cull()
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._db().execute(
+            'UPDATE cache_entries SET expires = ? '
+            'WHERE cache_key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), self._key(key, version), time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        cursor = self._db().execute(
+            'DELETE FROM cache_entries WHERE cache_key = ?', (self._key(key, version),)
+        )
+        return cursor.rowcount == 1
+
+    def has_key(self, key, version=None):
+        return self._get_row(self._key(key, version), time.time()) is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        db = self._db()
+        # BEGIN IMMEDIATE takes the write lock first, so read-modify-write is atomic
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._get_row(key, time.time())
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = row[0] + delta
+            db.execute(
+                'UPDATE cache_entries SET value = ? WHERE cache_key = ?',
+                (pickle.dumps(value, self.pickle_protocol), key),
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return value
+
+    def clear(self):
+        self._db().execute('DELETE FROM cache_entries')
+
+    def close(self, **kwargs):
+        # Connections are per thread and reused across requests
+        pass
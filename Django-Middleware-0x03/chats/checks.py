@@ -0,0 +1,40 @@
+import importlib.util
+
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Cache backends that keep their data in the worker process: rate limits and
+# token revocation stored there are not seen by the other workers.
+PER_PROCESS_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    '''The caches holding rate limits and token revocation must be shared by every worker'''
+    aliases = {getattr(settings, 'RATE_LIMIT_CACHE', 'default')}
+    if getattr(settings, 'JWT_REVOCATION_CHECK', False):
+        aliases.add('default')
+
+    errors = []
+    for alias in sorted(aliases):
+        backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+        if backend in PER_PROCESS_CACHE_BACKENDS:
+            errors.append(Error(
+                f"CACHES['{alias}'] ({backend}) is private to each worker process: "
+                'every worker would enforce its own rate limits and revocations.',
+                hint='Use chats.cache_backends.SharedSQLiteCache (one node) or '
+                     'RedisCache (set REDIS_URL).',
+                id='chats.E001',
+            ))
+        elif backend == 'django.core.cache.backends.redis.RedisCache' and (
+            importlib.util.find_spec('redis') is None
+        ):
+            errors.append(Error(
+                f"CACHES['{alias}'] uses RedisCache but the redis package is not installed.",
+                hint='pip install redis',
+                id='chats.E002',
+            ))
+    return errors
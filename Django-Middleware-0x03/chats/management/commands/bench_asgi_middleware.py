@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import tempfile
+import time
+import uuid
+from contextlib import ExitStack
+from unittest import mock
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.authentication import JWTAuthenticationMiddleware
+from chats.metrics import MetricsMiddleware
+from chats.middleware import (
+    AdmissionControlMiddleware,
+    OffensiveLanguageMiddleware,
+    RequestLoggingMiddleware,
+    RestrictAccessByTimeMiddleware,
+    RolepermissionMiddleware,
+)
+from chats.request_log import BatchingJSONLinesHandler
+
+MIDDLEWARE_CLASSES = [
+    MetricsMiddleware,
+    AdmissionControlMiddleware,
+    RestrictAccessByTimeMiddleware,
+    JWTAuthenticationMiddleware,
+    RequestLoggingMiddleware,
+    OffensiveLanguageMiddleware,
+    RolepermissionMiddleware,
+]
+
+
+class AdaptationCounter(logging.Handler):
+    '''Counts the sync/async adapters Django puts around middleware'''
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        if 'adapted for middleware' in record.getMessage():
+            self.count += 1
+
+
+def count_thread_hops(counter):
+    '''Patch counting calls run in a thread from the event loop (sync_to_async)'''
+    call = SyncToAsync.__call__
+
+    def counting_call(self, *args, **kwargs):
+        counter[0] += 1
+        return call(self, *args, **kwargs)
+
+    return mock.patch.object(SyncToAsync, '__call__', counting_call)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the middleware chain under ASGI: per-request time and thread '
+        'hops with the custom middleware sync-only and dual-mode '
+        '(settings.CHATS_ASYNC_MIDDLEWARE), for a chain of the custom middleware '
+        'alone and for settings.MIDDLEWARE. Requests go to the API root view (no '
+        'query), with a Bearer token.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2_000)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 20])
+        parser.add_argument('--chain', choices=('custom', 'settings'), nargs='+',
+                            default=['custom', 'settings'])
+        parser.add_argument('--path', default='/api/')
+
+    def handle(self, *args, **options):
+        token = AccessToken()
+        token['user_id'] = str(uuid.uuid4())
+        token['role'] = 'admin'
+        token['is_active'] = True
+        authorization = f'Bearer {token}'.encode()
+
+        with ExitStack() as stack:
+            # Keep the benchmark out of requests.log and the metrics directory
+            log_file = stack.enter_context(tempfile.NamedTemporaryFile(suffix='.log'))
+            log_handler = BatchingJSONLinesHandler(log_file.name)
+            stack.callback(log_handler.close)
+            request_logger = logging.getLogger('request_logger')
+            stack.enter_context(mock.patch.object(request_logger, 'handlers', [log_handler]))
+            stack.enter_context(override_settings(METRICS_DIR=None))
+            # Measure the same (full) path whatever the time of day
+            stack.enter_context(
+                mock.patch.object(RestrictAccessByTimeMiddleware, 'check', lambda self: None)
+            )
+
+            chains = {
+                'custom': [f'{cls.__module__}.{cls.__qualname__}' for cls in MIDDLEWARE_CLASSES],
+                'settings': settings.MIDDLEWARE,
+            }
+            for chain in options['chain']:
+                self.stdout.write(f'{chain} chain:')
+                for concurrency in options['concurrency']:
+                    for label, async_capable in (('sync-only', False), ('dual-mode', True)):
+                        self.stdout.write('  ' + self.measure(
+                            chains[chain], async_capable, label, options['path'],
+                            authorization, options['requests'], concurrency,
+                        ))
+
+    def measure(self, middleware, async_capable, label, path, authorization, total, concurrency):
+        hops = [0]
+        counter = AdaptationCounter()
+        django_logger = logging.getLogger('django.request')
+        with ExitStack() as stack:
+            stack.enter_context(
+                override_settings(MIDDLEWARE=middleware, CHATS_ASYNC_MIDDLEWARE=async_capable)
+            )
+            stack.enter_context(mock.patch.object(django_logger, 'level', logging.DEBUG))
+            django_logger.addHandler(counter)
+            stack.callback(django_logger.removeHandler, counter)
+            handler = ASGIHandler()
+            stack.enter_context(count_thread_hops(hops))
+            elapsed, statuses = asyncio.run(
+                self.run(handler, path, authorization, total, concurrency, hops)
+            )
+        return (
+            f'{label}, concurrency {concurrency:>3}: '
+            f'{elapsed / total * 1e6:6.0f} us/request, {total / elapsed:5.0f} requests/s, '
+            f'{hops[0] / total:4.1f} thread hops/request, '
+            f'{counter.count} middleware adapters, statuses {statuses}'
+        )
+
+    async def run(self, handler, path, authorization, total, concurrency, hops):
+        statuses = {}
+        remaining = iter(range(total))
+
+        async def client():
+            for _ in remaining:
+                status = await self.request(handler, path, authorization)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        # Warm up (URL resolver, middleware instances, first connection)
+        for _ in range(20):
+            await self.request(handler, path, authorization)
+        hops[0] = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return time.perf_counter() - started, statuses
+
+    @staticmethod
+    async def request(handler, path, authorization):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'authorization', authorization)],
+            'client': ('127.0.0.1', 50000),
+            'server': ('localhost', 80),
+        }
+        body_sent = False
+        disconnected = asyncio.Event()
+        response = {}
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()  # Never: the client stays connected
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+
+        await handler(scope, receive, send)
+        return response['status']
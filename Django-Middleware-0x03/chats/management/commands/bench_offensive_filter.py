@@ -0,0 +1,76 @@
+import random
+import re
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from chats.profanity import compile_terms, normalize
+
+
+def random_word(rng, lengths=(3, 10)):
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(*lengths)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the offensive-language matcher (chats/profanity.py) on synthetic '
+        'blocklists and message bodies, against a regex alternation of the same terms.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--terms', type=int, nargs='+', default=[1_000, 10_000, 50_000])
+        parser.add_argument('--body-chars', type=int, nargs='+', default=[200, 10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--no-regex', action='store_true', help='Skip the regex baseline')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        for term_count in options['terms']:
+            terms = {
+                ' '.join(random_word(rng) for _ in range(rng.choice((1, 1, 1, 2, 3))))
+                for _ in range(term_count)
+            }
+            started = time.perf_counter()
+            matcher = compile_terms(terms)
+            build = time.perf_counter() - started
+
+            regex = None
+            if not options['no_regex']:
+                started = time.perf_counter()
+                regex = re.compile(
+                    r'\b(?:' + '|'.join(map(re.escape, sorted(terms))) + r')\b'
+                )
+                regex_build = time.perf_counter() - started
+
+            self.stdout.write(
+                f'{len(terms)} terms: automaton built in {build * 1000:.0f} ms '
+                f'({matcher.size} states)'
+                + (f', regex compiled in {regex_build * 1000:.0f} ms' if regex else '')
+            )
+            for body_chars in options['body_chars']:
+                # Clean text (words longer than any term word): the whole body is
+                # scanned, the worst case for a filter
+                words = []
+                length = 0
+                while length < body_chars:
+                    word = random_word(rng, (11, 14))
+                    words.append(word)
+                    length += len(word) + 1
+                body = ' '.join(words)[:body_chars]
+                self.stdout.write(f'  {body_chars:>7} chars: ' + self.measure(
+                    lambda: matcher.find(normalize(body)), body_chars, options['repeat'],
+                ) + (
+                    '  | regex ' + self.measure(
+                        lambda: regex.search(body.casefold()), body_chars, options['repeat'],
+                    ) if regex else ''
+                ))
+
+    def measure(self, scan, chars, repeat):
+        scan()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            scan()
+        elapsed = (time.perf_counter() - started) / repeat
+        return f'{elapsed * 1e6:10.0f} us/body, {chars / elapsed / 1e6:6.2f} Mchar/s'
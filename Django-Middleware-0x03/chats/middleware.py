@@ -1,67 +1,118 @@
+import json
 import logging
-from datetime import datetime, time, timedelta
+import time as time_module
+from datetime import datetime, time
 
-from django.contrib.auth.models import AnonymousUser
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
 from django.http import HttpResponseForbidden, JsonResponse
+from django.utils.functional import classproperty
 
-# --- Configuration for Rate Limiting ---
-# Global dictionary to store request times for rate limiting
-# Key: IP Address (str); Value: List of timestamps (datetime objects)
-IP_REQUEST_LOG = {}
-MAX_REQUESTS = 5
-TIME_WINDOW_SECONDS = 60  # 1 minute
+from .admission import AdmissionController
+from .profanity import load_blocklist
+from .ratelimit import SlidingWindowLimiter, load_rules
 
 # Get the custom logger we defined in settings.py
 request_logger = logging.getLogger("request_logger")
 
 
-class RequestLoggingMiddleware:
+# --- Sync and async support ---
+# Every middleware here implements both __call__ (WSGI, and the default under
+# ASGI) and __acall__. Django only runs them in async mode when
+# settings.CHATS_ASYNC_MIDDLEWARE is on: that pays off only when the rest of
+# MIDDLEWARE is natively async too. Django's own middleware (MiddlewareMixin)
+# runs process_request/process_response in a thread in async mode, so with the
+# stack in settings.MIDDLEWARE async mode costs more thread hops than it saves
+# (see `manage.py bench_asgi_middleware`).
+#
+# In async mode request.user must not be touched: with session authentication
+# it loads the User row, a synchronous query. `await request.auser()` is used
+# instead (no query for Bearer requests, see chats/authentication.py). Cache
+# lookups (rate limits, token revocation) are I/O with a shared cache (a file
+# or Redis), so they run in a thread rather than on the event loop.
+
+
+class DualModeMiddleware:
     """
-    Middleware to log information about every incoming request.
-    It runs after the view has executed, ensuring request.user is available.
+    Base for middleware implementing both __call__ and __acall__. __call__
+    must hand off to __acall__ when self.async_mode is set.
     """
 
+    sync_capable = True
+
+    @classproperty
+    def async_capable(cls):
+        return getattr(settings, "CHATS_ASYNC_MIDDLEWARE", False)
+
     def __init__(self, get_response):
-        """
-        One-time configuration and initialization. Stores the get_response callable.
-        """
         self.get_response = get_response
+        # Django passes a coroutine function when the rest of the chain is async
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+async def get_user_async(request):
+    """request.user, without a synchronous query in async mode"""
+    if hasattr(request, "auser"):
+        return await request.auser()
+    return getattr(request, "user", None)
+
+
+class RequestLoggingMiddleware(DualModeMiddleware):
+    """
+    Middleware to log information about every incoming request.
+    It runs after the view has executed, ensuring request.user is available.
+    The record (user, method, path, status, duration) is only queued here; it is
+    written as a JSON line by a background thread (see chats/request_log.py).
+    """
 
     def __call__(self, request):
         """
         The request processing logic happens here. This is run on every request.
         """
+        if self.async_mode:
+            return self.__acall__(request)
+
+        started = time_module.perf_counter()
 
         # Pass the request to the next middleware or the view
         response = self.get_response(request)
 
         # --- Logging Phase (runs after view execution) ---
-
-        # Determine the username (handling AnonymousUser gracefully)
-        user = request.user
-        username = "Anonymous"
-        if user and user.is_authenticated:
-            # Use __str__ or get_username for the User object
-            username = str(user) if hasattr(user, "__str__") else user.get_username()
-        elif user and isinstance(user, AnonymousUser):
-            username = "Anonymous"
-
-        # Log the required information in the specified format
-        log_message = (
-            f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - "
-            f"User: {username} - "
-            f"Path: {request.path} - "
-            f"Method: {request.method}"
-        )
-
-        # Write the log message to the file
-        request_logger.info(log_message)
+        self.log(request, response, getattr(request, "user", None), started)
 
         # Return the response up the stack
         return response
 
+    async def __acall__(self, request):
+        started = time_module.perf_counter()
+        response = await self.get_response(request)
+        self.log(request, response, await get_user_async(request), started)
+        return response
+
+    def log(self, request, response, user, started):
+        duration_ms = (time_module.perf_counter() - started) * 1000
+
+        # Determine the user (None for AnonymousUser); token users log their id
+        # without loading the User row
+        username = str(user) if user is not None and user.is_authenticated else None
+
+        request_logger.info(
+            "request",
+            extra={
+                "request_fields": {
+                    "user": username,
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(duration_ms, 2),
+                }
+            },
+        )
+
 
-class RestrictAccessByTimeMiddleware:
+class RestrictAccessByTimeMiddleware(DualModeMiddleware):
     """
     Middleware to restrict access to the API outside of peak hours (6 AM to 9 PM).
     Denies access with a 403 Forbidden response between 9 PM (21:00) and 6 AM (06:00) UTC.
@@ -72,7 +123,7 @@ class RestrictAccessByTimeMiddleware:
         One-time configuration and initialization. Stores the get_response callable
         and defines the restriction window.
         """
-        self.get_response = get_response
+        super().__init__(get_response)
         # Define the allowed window (UTC hours)
         self.start_hour = time(6, 0, 0)  # 6:00 AM
         self.end_hour = time(21, 0, 0)  # 9:00 PM (21:00)
@@ -81,6 +132,26 @@ class RestrictAccessByTimeMiddleware:
         """
         The request processing logic happens here. This is run on every request.
         """
+        if self.async_mode:
+            return self.__acall__(request)
+
+        denied = self.check()
+        if denied is not None:
+            return denied
+
+        # If time is within the allowed window, proceed to the next middleware or the view.
+        response = self.get_response(request)
+
+        return response
+
+    async def __acall__(self, request):
+        denied = self.check()
+        if denied is not None:
+            return denied
+        return await self.get_response(request)
+
+    def check(self):
+        """A 403 response outside the allowed window, else None."""
         # Get the current time (uses the TIME_ZONE set in settings, default is UTC)
         now = datetime.now().time()
 
@@ -91,21 +162,90 @@ class RestrictAccessByTimeMiddleware:
             return HttpResponseForbidden(
                 "Access restricted. The messaging service is available only between 6:00 AM and 9:00 PM UTC."
             )
+        return None
 
-        # If time is within the allowed window, proceed to the next middleware or the view.
-        response = self.get_response(request)
 
+class AdmissionControlMiddleware(DualModeMiddleware):
+    """
+    Load shedding: rejects low-priority requests with a 503 and Retry-After while
+    this worker is overloaded (too many requests in flight, or slow responses),
+    with the policies in settings.ADMISSION_POLICIES (see chats/admission.py).
+    Placed early, so shed requests cost no session or database work.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.controller = AdmissionController()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        priority = self.controller.priority_of(request)
+        rejection = self.controller.admit(priority)
+        if rejection is not None:
+            return self.reject(rejection)
+
+        started = time_module.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            self.controller.finish(priority, time_module.perf_counter() - started)
+
+    async def __acall__(self, request):
+        priority = self.controller.priority_of(request)
+        rejection = self.controller.admit(priority)
+        if rejection is not None:
+            return self.reject(rejection)
+
+        started = time_module.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.controller.finish(priority, time_module.perf_counter() - started)
+
+    def reject(self, rejection):
+        response = JsonResponse({"detail": rejection.detail}, status=rejection.status)
+        if rejection.retry_after is not None:
+            response["Retry-After"] = str(rejection.retry_after)
         return response
 
 
-class OffensiveLanguageMiddleware:
+class OffensiveLanguageMiddleware(DualModeMiddleware):
     """
-    Middleware that implements rate limiting (5 POST messages per minute per IP).
-    This restricts the number of messages a user can send within a short period to prevent spamming.
+    Middleware that implements rate limiting (by default 5 POST messages per minute).
+    This restricts the number of messages a client can send within a short period to prevent spamming.
+    Clients are counted per authenticated user, or per IP when anonymous, with the
+    rules in settings.RATE_LIMITS and a sliding window shared through the cache
+    (see chats/ratelimit.py).
+
+    POSTed message bodies are then checked against the blocklist in
+    settings.OFFENSIVE_TERMS_FILE (see chats/profanity.py) and rejected with a 400.
     """
 
     def __init__(self, get_response):
-        self.get_response = get_response
+        super().__init__(get_response)
+        self.rules = load_rules()
+        self.limiter = SlidingWindowLimiter()
+        # Compiled once here; rebuilt in the background when the file changes
+        self.blocklist = load_blocklist()
+
+    def get_message_bodies(self, request):
+        """message_body values of a JSON (object or list of objects) or form POST."""
+        if request.content_type == "application/json":
+            try:
+                data = json.loads(request.body or b"null")
+            except ValueError:
+                return []  # Left to the view to reject
+            items = data if isinstance(data, list) else [data]
+            return [
+                item["message_body"]
+                for item in items
+                if isinstance(item, dict) and isinstance(item.get("message_body"), str)
+            ]
+        if request.content_type in ("application/x-www-form-urlencoded", "multipart/form-data"):
+            return request.POST.getlist("message_body")
+        return []
 
     def get_client_ip(self, request):
         """Utility function to extract client IP, handling proxies."""
@@ -119,54 +259,101 @@ class OffensiveLanguageMiddleware:
         return ip
 
     def __call__(self, request):
-        # Rate limiting only applies to POST requests (i.e., sending a new message/chat)
-        if request.method == "POST":
-            ip = self.get_client_ip(request)
-            now = datetime.now()
-
-            # Initialize or clean up the log for this IP
-            if ip not in IP_REQUEST_LOG:
-                IP_REQUEST_LOG[ip] = []
-
-            # 1. Clean up old requests (older than TIME_WINDOW_SECONDS)
-            one_minute_ago = now - timedelta(seconds=TIME_WINDOW_SECONDS)
-            # Filter out timestamps that are outside the window
-            IP_REQUEST_LOG[ip] = [t for t in IP_REQUEST_LOG[ip] if t > one_minute_ago]
-
-            # 2. Check the limit
-            if len(IP_REQUEST_LOG[ip]) >= MAX_REQUESTS:
-                # Limit exceeded: deny the request immediately with HTTP 429
-                return JsonResponse(
-                    {
-                        "detail": f"Rate limit exceeded: Max {MAX_REQUESTS} requests per {TIME_WINDOW_SECONDS} seconds."
-                    },
-                    status=429,
-                )
+        if self.async_mode:
+            return self.__acall__(request)
 
-            # 3. If within the limit, log the current request time
-            IP_REQUEST_LOG[ip].append(now)
+        rejected = self.check(request, lambda: getattr(request, "user", None))
+        if rejected is not None:
+            return rejected
 
         # Proceed to the next middleware or the view
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        if any(rule.matches(request) for rule in self.rules):
+            user = await get_user_async(request)
+            # The limiter's counters are in the (shared) cache: off the event loop
+            rejected = await sync_to_async(self.check)(request, lambda: user)
+        else:
+            rejected = self.check(request, lambda: None)
+        if rejected is not None:
+            return rejected
+        return await self.get_response(request)
 
-class RolepermissionMiddleware:
+    def check(self, request, get_user):
+        """
+        A 429 (rate limit) or 400 (offensive message) response, else None.
+        get_user() is only called when a rate limit rule matches.
+        """
+        rules = [rule for rule in self.rules if rule.matches(request)]
+        if rules:
+            # Authenticated users have their own budget wherever they connect from
+            user = get_user()
+            if user is not None and user.is_authenticated:
+                client = f"user:{user.pk}"
+            else:
+                user = None
+                client = f"ip:{self.get_client_ip(request)}"
+
+            for rule in rules:
+                result = self.limiter.hit(rule, client, rule.limit_for(user))
+                if not result.allowed:
+                    # Limit exceeded: deny the request immediately with HTTP 429
+                    response = JsonResponse(
+                        {
+                            "detail": f"Rate limit exceeded: Max {result.limit} requests per {rule.window} seconds."
+                        },
+                        status=429,
+                    )
+                    response["Retry-After"] = str(result.retry_after)
+                    return response
+
+        if request.method == "POST":
+            for body in self.get_message_bodies(request):
+                if self.blocklist.find(body) is not None:
+                    return JsonResponse(
+                        {"message_body": ["Message contains offensive language."]},
+                        status=400,
+                    )
+        return None
+
+
+class RolepermissionMiddleware(DualModeMiddleware):
     """
     Middleware to restrict access to the entire application based on the user's role.
     Only allows users with the 'admin' or 'moderator' role to proceed.
     """
 
     def __init__(self, get_response):
-        self.get_response = get_response
+        super().__init__(get_response)
         self.allowed_roles = [
             "admin",
             "moderator",
         ]  # Roles permitted to access the chat API
 
     def __call__(self, request):
-        user = request.user
+        if self.async_mode:
+            return self.__acall__(request)
+
+        # For Bearer requests this is the token user (JWTAuthenticationMiddleware):
+        # role is read from the token claims, without loading the User row.
+        denied = self.check(request.user)
+        if denied is not None:
+            return denied
 
+        # If the user is anonymous (to allow login/register) or has an allowed role, proceed.
+        response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        denied = self.check(await get_user_async(request))
+        if denied is not None:
+            return denied
+        return await self.get_response(request)
+
+    def check(self, user):
+        """A 403 response for an authenticated user without an allowed role, else None."""
         # 1. Check if the user is authenticated (must happen after AuthenticationMiddleware)
         if user.is_authenticated:
             # 2. Check if the user's role is in the allowed list
@@ -175,7 +362,4 @@ class RolepermissionMiddleware:
                 return HttpResponseForbidden(
                     f"Access denied. Your role ('{user.role}') is not authorized to access this API."
                 )
-
-        # If the user is anonymous (to allow login/register) or has an allowed role, proceed.
-        response = self.get_response(request)
-        return response
+        return None
@@ -6,8 +6,8 @@ class IsConversationParticipant(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # Allow read permissions (GET, HEAD, OPTIONS) for participants
         if request.method in permissions.SAFE_METHODS:
-            return request.user in obj.participants.all()
+            return obj.participants.filter(pk=request.user.pk).exists()
         
         # Write permissions (PUT, PATCH, DELETE) are only allowed
         #  if the user is a participant
-        return request.user in obj.participants.all()
\ No newline at end of file
+        return obj.participants.filter(pk=request.user.pk).exists()
\ No newline at end of file
@@ -0,0 +1,167 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from django.conf import settings
+
+# --- Offensive-language filter ---
+# Message bodies are checked against a blocklist of whole words/phrases with an
+# Aho-Corasick automaton: one pass over the text, whatever the number of terms.
+#
+# Terms and text go through the same normalization (case folding, diacritics
+# and common character substitutions removed, runs of punctuation/whitespace
+# collapsed to one space), so "B@d-W0rd" matches the term "bad word". Terms are
+# matched on word boundaries: " term " is searched in " text ".
+#
+# The blocklist (settings.OFFENSIVE_TERMS_FILE, one term per line, # comments)
+# is compiled once at startup. When the file changes, a new automaton is built
+# in a background thread and swapped in with one assignment; requests keep
+# using the previous one meanwhile.
+
+# Look-alike substitutions, undone in words that contain a letter ("b4d" but not "455")
+_SUBSTITUTIONS = str.maketrans({
+    '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '@': 'a', '$': 's',
+})
+_WORDS = re.compile(r'\S+')
+_LETTER = re.compile(r'[^\W\d_]')
+_COMBINING_MARKS = re.compile('[\u0300-\u036f]')
+_SEPARATORS = re.compile(r'[\W_]+')
+
+# Seconds between checks of the blocklist file for changes
+RELOAD_INTERVAL = 30
+
+
+def _unmask(match):
+    word = match.group()
+    return word.translate(_SUBSTITUTIONS) if _LETTER.search(word) else word
+
+
+def normalize(text):
+    '''Normalized form of `text`, padded with a space on both sides'''
+    text = _COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text.casefold()))
+    text = _WORDS.sub(_unmask, text)
+    return ' ' + _SEPARATORS.sub(' ', text).strip() + ' '
+
+
+class AhoCorasick:
+    '''
+    Multi-pattern matcher. Building takes time linear in the total length of
+    the patterns; find() runs in time linear in the length of the text.
+    '''
+
+    def __init__(self, patterns):
+        goto = [{}]
+        output = [None]
+        for pattern in patterns:
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append(None)
+                state = next_state
+            output[state] = pattern
+
+        # Failure links, breadth first: the longest proper suffix that is also a prefix
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                if output[next_state] is None:
+                    # A pattern ending at the suffix also ends here
+                    output[next_state] = output[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+        self.size = len(goto)
+
+    def find(self, text):
+        '''The first pattern found in `text` (by end position), or None'''
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+
+def compile_terms(terms):
+    '''Matcher for whole-word terms (normalized like message text)'''
+    patterns = {normalize(term) for term in terms}
+    patterns.discard('  ')
+    patterns.discard(' ')
+    return AhoCorasick(patterns)
+
+
+def read_terms(path):
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            term = line.split('#', 1)[0].strip()
+            if term:
+                yield term
+
+
+class Blocklist:
+    '''Compiled blocklist file, rebuilt in the background when the file changes'''
+
+    def __init__(self, path, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._reload_lock = threading.Lock()
+        self._mtime = self._stat()
+        self._matcher = compile_terms(read_terms(path)) if self._mtime else compile_terms(())
+        self._checked_at = time.monotonic()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def find(self, text):
+        '''The normalized blocklisted term found in `text`, or None'''
+        self._maybe_reload()
+        return self._matcher.find(normalize(text))
+
+    def reload(self):
+        '''Builds the automaton from the current file and swaps it in'''
+        mtime = self._stat()
+        matcher = compile_terms(read_terms(self.path)) if mtime else compile_terms(())
+        self._matcher, self._mtime = matcher, mtime
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        if self._stat() == self._mtime or not self._reload_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._reload_in_background, daemon=True).start()
+
+    def _reload_in_background(self):
+        try:
+            self.reload()
+        finally:
+            self._reload_lock.release()
+
+
+def load_blocklist():
+    return Blocklist(
+        getattr(settings, 'OFFENSIVE_TERMS_FILE', None),
+        getattr(settings, 'OFFENSIVE_TERMS_RELOAD_INTERVAL', RELOAD_INTERVAL),
+    )
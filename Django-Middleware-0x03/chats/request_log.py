@@ -0,0 +1,199 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process writes the log
+    fcntl = None
+
+# --- Non-blocking request log ---
+# The request thread only puts a small tuple on a bounded queue; a background
+# thread drains it in batches, formats JSON lines and writes each batch with a
+# single write(). When the queue is full (the disk can't keep up) records are
+# dropped and counted instead of slowing requests down; the count is written to
+# the log as {"event": "dropped", ...} and kept in `dropped`.
+#
+# Used as a logging handler (see LOGGING in settings): records need the
+# `request_fields` extra set by RequestLoggingMiddleware; other records are
+# written with their message only.
+#
+# Every worker process appends to the same file (O_APPEND, one write() per
+# batch). Before each batch a worker checks that the path still names the file
+# it has open and reopens it otherwise, so a rotation by another worker, or by
+# logrotate, is followed within one batch. Rotation itself happens under an
+# exclusive lock on <filename>.lock, and the size is checked again once the
+# lock is held, so concurrent rotations don't shift the backups twice.
+
+_STOP = object()
+
+
+class BatchingJSONLinesHandler(logging.Handler):
+
+    def __init__(self, filename, max_bytes=10 * 2**20, backup_count=5, queue_size=10_000,
+                 batch_size=500, flush_interval=1.0, level=logging.NOTSET):
+        super().__init__(level)
+        self.filename = os.fspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Records lost to a full queue, since startup / since last reported in the log
+        self.dropped = 0
+        self._dropped_reported = 0
+        self._writer = None
+        self._writer_pid = None
+        self._start_lock = threading.Lock()
+        self._stream = None
+        atexit.register(self.close)
+
+    # --- Request thread ---
+
+    def emit(self, record):
+        fields = getattr(record, 'request_fields', None)
+        if fields is None:
+            fields = {'message': record.getMessage()}
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait((record.created, record.levelname, fields))
+        except queue.Full:
+            self.dropped += 1  # Approximate under races, never blocks
+
+    def _ensure_writer(self):
+        # Started lazily, and again in a forked worker (threads don't survive fork)
+        if self._writer_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._writer_pid != os.getpid():
+                if self._writer_pid is not None:
+                    self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                    self._stream = None
+                self._writer = threading.Thread(
+                    target=self._run, name='request-log-writer', daemon=True
+                )
+                self._writer.start()
+                self._writer_pid = os.getpid()
+
+    # --- Writer thread ---
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._write([])
+                continue
+            batch = [item]
+            while item is not _STOP and len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = batch[-1] is _STOP
+            self._write([entry for entry in batch if entry is not _STOP])
+            if stop:
+                return
+
+    def _write(self, batch):
+        lines = [self.format_entry(*entry) for entry in batch]
+        dropped = self.dropped - self._dropped_reported
+        if dropped:
+            self._dropped_reported += dropped
+            lines.append(json.dumps({
+                'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+                'event': 'dropped',
+                'count': dropped,
+                'total': self._dropped_reported,
+            }, separators=(',', ':')))
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode()
+        try:
+            self._reopen_if_moved()
+            if self._needs_rotation(len(data)):
+                self._rotate(len(data))
+            self._stream.write(data)
+        except OSError as exc:
+            # Nowhere else to report it; requests carry on either way
+            sys.stderr.write(f'Request log write to {self.filename} failed: {exc}\n')
+
+    @staticmethod
+    def format_entry(created, level, fields):
+        return json.dumps(
+            {
+                'ts': datetime.fromtimestamp(created, timezone.utc).isoformat(timespec='milliseconds'),
+                'level': level,
+                **fields,
+            },
+            separators=(',', ':'),
+            default=str,
+        )
+
+    def _reopen_if_moved(self):
+        '''Opens the file at self.filename unless it is the one already open'''
+        if self._stream is not None:
+            try:
+                current = os.stat(self.filename)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(self._stream.fileno())
+            if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                return
+            self._stream.close()
+            self._stream = None
+        # Unbuffered: each batch is a single append
+        self._stream = open(self.filename, 'ab', buffering=0)
+
+    def _needs_rotation(self, incoming):
+        # The file's size, including what other workers appended
+        size = os.fstat(self._stream.fileno()).st_size
+        return bool(self.max_bytes and size and size + incoming > self.max_bytes)
+
+    def _rotate(self, incoming):
+        '''requests.log -> requests.log.1 -> ... -> requests.log.<backup_count>'''
+        with open(f'{self.filename}.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have rotated while this one waited for the lock
+            self._reopen_if_moved()
+            if not self._needs_rotation(incoming):
+                return
+            if self.backup_count > 0:
+                for index in range(self.backup_count - 1, 0, -1):
+                    source = f'{self.filename}.{index}'
+                    if os.path.exists(source):
+                        os.replace(source, f'{self.filename}.{index + 1}')
+                os.replace(self.filename, f'{self.filename}.1')
+            else:
+                os.truncate(self.filename, 0)
+            self._reopen_if_moved()
+            # The lock is released when the file is closed
+
+    # --- Shutdown ---
+
+    def flush(self):
+        '''Waits (briefly) until queued records are written'''
+        if self._writer_pid == os.getpid() and self._writer.is_alive():
+            deadline = time.monotonic() + self.flush_interval * 5
+            while not self.queue.empty() and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+    def close(self):
+        if self._writer_pid == os.getpid() and self._writer.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=self.flush_interval)
+            except queue.Full:
+                pass
+            self._writer.join(timeout=self.flush_interval * 5)
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        super().close()
@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from .authentication import USER_CLAIMS, revoke_tokens
+from .models import User
+
+
+@receiver(pre_save, sender=User)
+def revoke_tokens_on_claim_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    '''
+    Outstanding tokens carry the old claims (role, is_active, is_staff) and stay
+    valid after a password change: revoke them once the change is committed.
+    '''
+    if raw or instance._state.adding:
+        return
+    watched = {*USER_CLAIMS, 'password'}
+    if update_fields is not None and not watched.intersection(update_fields):
+        return  # e.g. last_login on every login
+    previous = User.objects.filter(pk=instance.pk).values(*watched).first()
+    if previous is None:
+        return
+    if any(getattr(instance, field) != value for field, value in previous.items()):
+        transaction.on_commit(lambda: revoke_tokens(instance.pk))
@@ -1,3 +1,737 @@
-from django.test import TestCase
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import metrics
+from .admission import (
+    CRITICAL,
+    LOW,
+    NORMAL,
+    AdmissionController,
+    ConcurrencyPolicy,
+    LatencyPolicy,
+    LoadTracker,
+    PriorityRule,
+    TimeWindowPolicy,
+    load_priorities,
+)
+from .authentication import (
+    ChatTokenObtainPairSerializer,
+    ChatTokenRefreshSerializer,
+    ChatTokenUser,
+    StatelessJWTAuthentication,
+)
+from .cache_backends import SharedSQLiteCache
+from .checks import check_shared_cache
+from .middleware import DualModeMiddleware, OffensiveLanguageMiddleware
+from .models import User
+from .profanity import AhoCorasick, Blocklist, compile_terms, normalize
+from .request_log import BatchingJSONLinesHandler
+from .ratelimit import RateLimitRule, SlidingWindowLimiter
+
+
+class FakeClock:
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def create_user(email='alice@example.com', role=User.Role.ADMIN, **fields):
+    return User.objects.create_user(
+        email, password='password', first_name='Alice', last_name='A', role=role, **fields
+    )
+
+
+def bearer(token):
+    return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+
+# --- Stateless JWT authentication (chats/authentication.py) ---
+
+class StatelessJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = create_user()
+        self.authentication = StatelessJWTAuthentication()
+
+    def authenticate(self, token):
+        request = RequestFactory().get('/api/chats/', **bearer(token))
+        return self.authentication.authenticate(request)
+
+    def access_token(self):
+        return ChatTokenObtainPairSerializer.get_token(self.user).access_token
+
+    def test_user_comes_from_the_claims_without_a_query(self):
+        token = self.access_token()
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate(token)
+            self.assertIsInstance(user, ChatTokenUser)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.role, User.Role.ADMIN)
+            self.assertTrue(user.is_active)
+        # Other attributes load the row, once
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'alice@example.com')
+            self.assertEqual(user.first_name, 'Alice')
+
+    def test_token_endpoint_issues_claims(self):
+        response = self.client.post(
+            '/api/token/', {'email': 'alice@example.com', 'password': 'password'}
+        )
+        self.assertEqual(response.status_code, 200)
+        token = AccessToken(response.json()['access'])
+        self.assertEqual(token['role'], User.Role.ADMIN)
+        self.assertTrue(token['is_active'])
+
+    def test_expired_token_is_rejected(self):
+        token = self.access_token()
+        token.set_exp(lifetime=-timedelta(seconds=1))
+        with self.assertRaises(InvalidToken):
+            self.authenticate(token)
+        self.assertEqual(self.client.get('/api/chats/', **bearer(token)).status_code, 401)
+
+    def test_inactive_claim_is_rejected(self):
+        token = self.access_token()
+        token['is_active'] = False
+        self.assertEqual(self.client.get('/api/chats/', **bearer(token)).status_code, 401)
+
+    @override_settings(JWT_REVOCATION_CHECK=True)
+    def test_claim_change_revokes_outstanding_tokens(self):
+        token = self.access_token()
+        self.assertIsNotNone(self.authenticate(token))
+
+        self.user.role = User.Role.GUEST
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, 'Token has been revoked'):
+            self.authenticate(token)
+
+    @override_settings(JWT_REVOCATION_CHECK=True)
+    def test_password_change_revokes_refresh_tokens(self):
+        refresh = str(ChatTokenObtainPairSerializer.get_token(self.user))
+
+        self.user.set_password('new password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['detail'], 'Token has been revoked')
+
+    @override_settings(JWT_REVOCATION_CHECK=True)
+    def test_unrelated_changes_keep_tokens(self):
+        token = self.access_token()
+        self.user.first_name = 'Alicia'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertIsNotNone(self.authenticate(token))
+
+    def test_refresh_reads_the_current_claims(self):
+        refresh = RefreshToken.for_user(self.user)
+        User.objects.filter(pk=self.user.pk).update(role=User.Role.GUEST)
+        serializer = ChatTokenRefreshSerializer(data={'refresh': str(refresh)})
+        serializer.is_valid(raise_exception=True)
+        self.assertEqual(AccessToken(serializer.validated_data['access'])['role'], User.Role.GUEST)
+
+
+# --- Rate limiting (chats/ratelimit.py) ---
+
+class SlidingWindowLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.clock = FakeClock(now=600.0)  # Start of a window
+        self.limiter = SlidingWindowLimiter(clock=self.clock)
+        self.rule = RateLimitRule(name='test', limit=5, window=60)
+
+    def hit(self, client='ip:1'):
+        return self.limiter.hit(self.rule, client, self.rule.limit)
+
+    def test_allows_the_limit_then_rejects(self):
+        results = [self.hit() for _ in range(6)]
+        self.assertEqual([r.allowed for r in results], [True] * 5 + [False])
+        self.assertEqual([r.remaining for r in results[:5]], [4, 3, 2, 1, 0])
+        # Other clients have their own budget
+        self.assertTrue(self.hit('ip:2').allowed)
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        for _ in range(5):
+            self.hit()
+        # Half way into the next window: 5 * 0.5 + current <= 5
+        self.clock.now += 90
+        self.assertEqual([self.hit().allowed for _ in range(4)], [True, True, False, False])
+
+    def test_rejected_requests_are_not_counted(self):
+        for _ in range(10):
+            self.hit()
+        # Two windows later the counters are gone
+        self.clock.now += 120
+        self.assertEqual(self.hit().remaining, 4)
+
+    def test_retry_after_waits_for_room(self):
+        for _ in range(5):
+            self.hit()
+        # Full in the current window: wait for the next one and for 1/5 of the
+        # 5 requests to decay (5 * (1 - t/60) + 1 <= 5, t = 12)
+        self.clock.now += 30
+        result = self.hit()
+        self.assertFalse(result.allowed)
+        self.assertEqual(result.retry_after, 30 + 12)
+
+        self.clock.now += 42
+        self.assertTrue(self.hit().allowed)
+        self.assertFalse(self.hit().allowed)
+
+    def test_user_limit(self):
+        rule = RateLimitRule(name='test', limit=1, window=60, user_limit=3)
+        user = type('User', (), {'is_authenticated': True})()
+        self.assertEqual(rule.limit_for(user), 3)
+        self.assertEqual(rule.limit_for(None), 1)
+
+
+class RateLimitMiddlewareTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    @override_settings(RATE_LIMITS=[
+        {'name': 'post', 'methods': ('POST',), 'limit': 2, 'window': 60},
+    ])
+    def test_429_with_retry_after(self):
+        for _ in range(2):
+            self.assertNotEqual(self.client.post('/api/chats/', {}).status_code, 429)
+        response = self.client.post('/api/chats/', {})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(
+            response.json(), {'detail': 'Rate limit exceeded: Max 2 requests per 60 seconds.'}
+        )
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # GETs don't match the rule
+        self.assertNotEqual(self.client.get('/api/chats/').status_code, 429)
+
+        # Another address has its own budget
+        response = self.client.post('/api/chats/', {}, REMOTE_ADDR='10.0.0.2')
+        self.assertNotEqual(response.status_code, 429)
+
+
+def _increment(location, times):
+    cache = SharedSQLiteCache(location, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SharedSQLiteCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = SharedSQLiteCache(self.location, {})
+
+    def test_add_incr_and_expiry(self):
+        self.assertTrue(self.cache.add('key', 1, timeout=60))
+        self.assertFalse(self.cache.add('key', 5, timeout=60))
+        self.assertEqual(self.cache.incr('key'), 2)
+        self.assertEqual(self.cache.decr('key'), 1)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+        self.cache.set('expired', 'old', timeout=-1)
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertTrue(self.cache.add('expired', 'new'))
+        self.assertEqual(self.cache.get('expired'), 'new')
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set('counter', 0, timeout=None)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_increment, args=(self.location, 50)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+
+    def test_per_process_cache_is_an_error(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem):
+            [error] = check_shared_cache(None)
+        self.assertEqual(error.id, 'chats.E001')
+        self.assertEqual(check_shared_cache(None), [])
+
+
+# --- Offensive-language filter (chats/profanity.py) ---
+
+class AhoCorasickTests(SimpleTestCase):
+
+    def test_finds_any_pattern_in_one_pass(self):
+        matcher = AhoCorasick(['he', 'she', 'his', 'hers'])
+        self.assertEqual(matcher.find('ushers'), 'she')
+        self.assertEqual(matcher.find('this'), 'his')
+        self.assertIsNone(matcher.find('sip ahoy'))
+
+    def test_pattern_inside_a_longer_partial_match(self):
+        # "abc" is a dead end for "abcd"; its failure link reaches "bc"
+        matcher = AhoCorasick(['abcd', 'bc'])
+        self.assertEqual(matcher.find('xabce'), 'bc')
+        self.assertEqual(matcher.find('abcd'), 'bc')
+        self.assertIsNone(matcher.find('abd'))
+
+    def test_terms_match_whole_words_after_normalization(self):
+        matcher = compile_terms(['bad word', 'idiot'])
+        self.assertEqual(matcher.find(normalize('What a B@d-W0rd!')), ' bad word ')
+        self.assertEqual(matcher.find(normalize('IDIÓT')), ' idiot ')
+        self.assertIsNone(matcher.find(normalize('idiotic badword')))
+        # Numbers alone are left as they are
+        self.assertEqual(normalize('Room 455'), ' room 455 ')
+
+
+class BlocklistReloadTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'blocklist.txt')
+        self.write('# comment\nmoron\n')
+
+    def write(self, content):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        # A distinct mtime even on coarse filesystems
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def test_file_changes_are_picked_up_in_the_background(self):
+        blocklist = Blocklist(self.path, reload_interval=0)
+        self.assertEqual(blocklist.find('you moron'), ' moron ')
+        self.assertIsNone(blocklist.find('you clown'))
+
+        self.write('clown\n')
+        deadline = time.monotonic() + 5
+        while blocklist.find('you clown') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(blocklist.find('you clown'), ' clown ')
+        self.assertIsNone(blocklist.find('you moron'))
+
+    def test_missing_file_blocks_nothing(self):
+        self.assertIsNone(Blocklist(self.path + '.missing').find('moron'))
+
+
+class OffensiveLanguageMiddlewareTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def post_message(self, data, content_type='application/json'):
+        if content_type == 'application/json':
+            data = json.dumps(data)
+        return self.client.post(
+            f'/api/chats/{uuid.uuid4()}/messages/', data, content_type=content_type
+        )
+
+    def test_offensive_message_is_rejected(self):
+        response = self.post_message({'message_body': 'Shut   UP!'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {'message_body': ['Message contains offensive language.']}
+        )
+        # Bulk payloads are checked item by item
+        response = self.post_message([{'message_body': 'hello'}, {'message_body': 'm0r0n'}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_clean_message_reaches_the_view(self):
+        response = self.post_message({'message_body': 'see you at noon'})
+        self.assertNotEqual(response.status_code, 400)
+
+
+# --- Request log (chats/request_log.py) ---
+
+def _log_records(handler, count, **fields):
+    for index in range(count):
+        record = logging.LogRecord('request_logger', logging.INFO, __file__, 0, 'request', None, None)
+        record.request_fields = {'index': index, **fields}
+        handler.handle(record)
+
+
+def _log_from_worker(filename, count):
+    handler = BatchingJSONLinesHandler(filename, max_bytes=2_000, backup_count=1_000, batch_size=7)
+    _log_records(handler, count, pid=os.getpid())
+    handler.close()
+
+
+class BatchingJSONLinesHandlerTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'requests.log')
+
+    def read_lines(self, pattern='requests.log*'):
+        lines = []
+        for path in glob.glob(os.path.join(os.path.dirname(self.filename), pattern)):
+            if not path.endswith('.lock'):
+                with open(path) as file:
+                    lines += [json.loads(line) for line in file]
+        return lines
+
+    def test_records_are_written_as_json_lines_in_batches(self):
+        handler = BatchingJSONLinesHandler(self.filename, batch_size=10)
+        writes = []
+        write_batch = handler._write
+        handler._write = lambda batch: (writes.append(len(batch)), write_batch(batch))
+        _log_records(handler, 25, method='GET')
+        handler.close()
+
+        lines = self.read_lines()
+        self.assertEqual([line['index'] for line in lines], list(range(25)))
+        self.assertEqual(lines[0]['method'], 'GET')
+        self.assertEqual(lines[0]['level'], 'INFO')
+        self.assertIn('ts', lines[0])
+        self.assertLessEqual(max(writes), 10)
+        self.assertEqual(sum(writes), 25)
+
+    def test_flush_waits_for_the_queue(self):
+        handler = BatchingJSONLinesHandler(self.filename, flush_interval=0.05)
+        self.addCleanup(handler.close)
+        _log_records(handler, 3)
+        handler.flush()
+        deadline = time.monotonic() + 5
+        while len(self.read_lines()) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.read_lines()), 3)
+
+    def test_full_queue_drops_and_reports(self):
+        handler = BatchingJSONLinesHandler(self.filename, queue_size=2)
+        # No writer yet: the queue fills up
+        handler._ensure_writer = lambda: None
+        _log_records(handler, 5)
+        self.assertEqual(handler.dropped, 3)
+        del handler._ensure_writer
+        handler._ensure_writer()
+        handler.close()
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[-1]['event'], 'dropped')
+        self.assertEqual(lines[-1]['count'], 3)
+
+    def test_rotation_keeps_backup_count_files(self):
+        handler = BatchingJSONLinesHandler(self.filename, max_bytes=500, backup_count=2, batch_size=1)
+        _log_records(handler, 50)
+        handler.close()
+        names = sorted(os.path.basename(path) for path in glob.glob(self.filename + '*'))
+        self.assertEqual(names, ['requests.log', 'requests.log.1', 'requests.log.2', 'requests.log.lock'])
+        for path in (self.filename, self.filename + '.1', self.filename + '.2'):
+            self.assertLessEqual(os.path.getsize(path), 500)
+        self.assertEqual(self.read_lines('requests.log')[-1]['index'], 49)
+
+    def test_workers_share_the_file_across_rotations(self):
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_log_from_worker, args=(self.filename, 300)) for _ in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        lines = self.read_lines()
+        # Nothing lost or overwritten by concurrent rotations
+        self.assertEqual(len(lines), 900)
+        for worker in workers:
+            indexes = sorted(line['index'] for line in lines if line['pid'] == worker.pid)
+            self.assertEqual(indexes, list(range(300)))
+        # Rotated on size only (a double shift would leave undersized backups)
+        backups = glob.glob(self.filename + '.[0-9]*')
+        self.assertGreater(len(backups), 10)
+
+
+# --- Metrics (chats/metrics.py) ---
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def token_for(self, **fields):
+        user = create_user(**fields)
+        return ChatTokenObtainPairSerializer.get_token(user).access_token
+
+    def test_requests_are_recorded_by_route_pattern_and_method(self):
+        chat_id = uuid.uuid4()
+        self.client.get(f'/api/chats/{chat_id}/messages/')
+        self.client.get(f'/api/chats/{uuid.uuid4()}/messages/')
+        self.client.generic('BREW', '/api/chats/')
+        self.client.get('/no/such/page/')
+
+        responses = self.registry.responses
+        route = 'api/chats/<chat_pk>/messages/'
+        self.assertEqual(responses[(route, 'GET', 401)], 2)
+        self.assertEqual(responses[('api/chats/', 'other', 401)], 1)
+        self.assertEqual(responses[(metrics.UNMATCHED_ROUTE, 'GET', 404)], 1)
+        self.assertEqual(self.registry.latency[(route, 'GET')].count, 2)
+        self.assertEqual(self.registry.in_flight, 0)
+        # Only standard methods and "other" become label values
+        methods = {method for _, method, _ in responses}
+        self.assertLessEqual(methods, {*metrics.STANDARD_METHODS, metrics.OTHER_METHOD})
+
+    def test_prometheus_text_format(self):
+        self.registry.observe('api/chats/', 'GET', 200, 0.02, 3, 0.004)
+        self.registry.observe('api/chats/', 'GET', 200, 0.3, 0, 0.0)
+        self.registry.observe('api/chats/', 'POST', 400, 0.001, 1, 0.001)
+        text = metrics.render(self.registry)
+        lines = text.splitlines()
+
+        self.assertIn('# TYPE http_responses_total counter', lines)
+        self.assertIn('http_responses_total{route="api/chats/",method="GET",status="200"} 2', lines)
+        self.assertIn('http_responses_total{route="api/chats/",method="POST",status="400"} 1', lines)
+        # Cumulative buckets, +Inf equal to the count
+        labels = 'route="api/chats/",method="GET"'
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.01"}} 0', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.025"}} 1', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.5"}} 2', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', lines)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', lines)
+        self.assertIn(f'db_queries_per_request_bucket{{{labels},le="0"}} 1', lines)
+        self.assertIn(f'db_query_seconds_total{{{labels}}} 0.004', lines)
+        self.assertIn('http_requests_in_flight 0', lines)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(metrics._labels(route='a"b\\c\nd'), '{route="a\\"b\\\\c\\nd"}')
+
+    def test_snapshots_of_every_worker_are_merged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.registry.observe('api/chats/', 'GET', 200, 0.02, 1, 0.001)
+        self.registry.in_flight = 1
+        exited_worker = {
+            'pid': 2**22 + 1,  # Above the default pid_max: never alive
+            'in_flight': 5,
+            'responses': [['api/chats/', 'GET', 200, 4]],
+            'routes': [['api/chats/', 'GET', [[0] * 11, 1.0, 4], [[0] * 8, 4, 4], 0.5]],
+        }
+        with open(os.path.join(directory.name, f'{exited_worker["pid"]}.json'), 'w') as file:
+            json.dump(exited_worker, file)
+
+        with override_settings(METRICS_DIR=directory.name):
+            merged = metrics.collect()
+        self.assertEqual(merged.responses[('api/chats/', 'GET', 200)], 5)
+        self.assertEqual(merged.latency[('api/chats/', 'GET')].count, 5)
+        # Requests in flight of exited workers are not counted
+        self.assertEqual(merged.in_flight, 1)
+
+    def test_endpoint_is_limited_to_staff_and_admins(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+        moderator = self.token_for(email='mod@example.com', role=User.Role.MODERATOR)
+        self.assertEqual(self.client.get('/metrics/', **bearer(moderator)).status_code, 403)
+
+        staff = self.token_for(email='staff@example.com', role=User.Role.MODERATOR, is_staff=True)
+        response = self.client.get('/metrics/', **bearer(staff))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('http_responses_total{route="metrics/",method="GET",status="403"} 2',
+                      response.content.decode())
+
+        admin = self.token_for(email='admin@example.com', role=User.Role.ADMIN)
+        self.assertEqual(self.client.get('/metrics/', **bearer(admin)).status_code, 200)
+
+
+# --- Sync and async modes (chats/middleware.py) ---
+
+CUSTOM_MIDDLEWARE = [
+    'chats.metrics.MetricsMiddleware',
+    'chats.middleware.AdmissionControlMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chats.authentication.JWTAuthenticationMiddleware',
+    'chats.middleware.RequestLoggingMiddleware',
+    'chats.middleware.OffensiveLanguageMiddleware',
+    'chats.middleware.RolepermissionMiddleware',
+]
+
+
+class AsyncMiddlewareTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        guest = create_user('guest@example.com', role=User.Role.GUEST)
+        self.token = ChatTokenObtainPairSerializer.get_token(guest).access_token
+
+    def test_sync_only_unless_enabled(self):
+        self.assertFalse(OffensiveLanguageMiddleware.async_capable)
+        self.assertTrue(OffensiveLanguageMiddleware.sync_capable)
+        with override_settings(CHATS_ASYNC_MIDDLEWARE=True):
+            self.assertTrue(OffensiveLanguageMiddleware.async_capable)
+
+    @override_settings(
+        CHATS_ASYNC_MIDDLEWARE=True,
+        MIDDLEWARE=CUSTOM_MIDDLEWARE,
+        JWT_REVOCATION_CHECK=True,
+        RATE_LIMITS=[{'name': 'post', 'methods': ('POST',), 'limit': 1, 'window': 60}],
+    )
+    async def test_async_chain(self):
+        client = AsyncClient()
+        headers = {'Authorization': f'Bearer {self.token}'}
+
+        instances = []
+        init = DualModeMiddleware.__init__
+
+        def recording_init(middleware, get_response):
+            init(middleware, get_response)
+            instances.append(middleware)
+
+        with mock.patch.object(DualModeMiddleware, '__init__', recording_init):
+            response = await client.get('/api/', headers=headers)
+        self.assertEqual(len(instances), 6)
+        self.assertTrue(all(middleware.async_mode for middleware in instances))
+        # The token user's role, from the claims
+        self.assertEqual(response.status_code, 403)
+
+        url = f'/api/chats/{uuid.uuid4()}/messages/'
+        for _ in range(2):
+            response = await client.post(
+                url, {'message_body': 'hi'}, content_type='application/json', headers=headers
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+# --- Admission control (chats/admission.py) ---
+
+class AdmissionControllerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.clock = FakeClock()
+
+    def controller(self, *policies):
+        return AdmissionController(
+            priorities=load_priorities(),
+            policies=list(policies),
+            tracker=LoadTracker(window=10, clock=self.clock),
+        )
+
+    def test_priorities(self):
+        controller = self.controller()
+        conversation = uuid.uuid4()
+        for method, path, priority in [
+            ('post', f'/api/chats/{conversation}/messages/', CRITICAL),
+            ('post', '/api/token/', CRITICAL),
+            ('get', '/admin/', CRITICAL),
+            ('get', '/api/chats/', LOW),
+            ('get', f'/api/chats/{conversation}/messages/', LOW),
+            ('post', '/api/chats/', NORMAL),
+            ('get', '/api/', NORMAL),
+        ]:
+            with self.subTest(method=method, path=path):
+                request = getattr(self.factory, method)(path)
+                self.assertEqual(controller.priority_of(request), priority)
+
+    def test_rule_methods(self):
+        rule = PriorityRule(LOW, methods=('get',), path=r'^/api/')
+        self.assertTrue(rule.matches(self.factory.get('/api/chats/')))
+        self.assertFalse(rule.matches(self.factory.post('/api/chats/')))
+        self.assertFalse(rule.matches(self.factory.get('/admin/')))
+
+    def test_concurrency_sheds_low_first(self):
+        controller = self.controller(ConcurrencyPolicy({LOW: 1, NORMAL: 2}, retry_after=3))
+        self.assertIsNone(controller.admit(LOW))
+
+        rejection = controller.admit(LOW)
+        self.assertEqual((rejection.status, rejection.retry_after), (503, 3))
+        self.assertIsNone(controller.admit(NORMAL))
+
+        self.assertIsNotNone(controller.admit(NORMAL))
+        self.assertIsNotNone(controller.admit(LOW))
+        for _ in range(10):
+            self.assertIsNone(controller.admit(CRITICAL))
+        self.assertEqual(controller.tracker.in_flight, 12)
+
+        for priority in [LOW, NORMAL] + [CRITICAL] * 10:
+            controller.finish(priority, 0.01)
+        self.assertIsNone(controller.admit(LOW))
+
+    def test_latency_sheds_low_first(self):
+        controller = self.controller(LatencyPolicy({LOW: 0.5, NORMAL: 2.0}))
+        for _ in range(10):
+            controller.admit(NORMAL)
+            controller.finish(NORMAL, 1.0)
+        self.clock.now += LoadTracker.REFRESH_INTERVAL
+        self.assertIsNotNone(controller.admit(LOW))
+        self.assertIsNone(controller.admit(NORMAL))
+        self.assertIsNone(controller.admit(CRITICAL))
+
+        # Slow requests leave the window, and low priority is let back in
+        self.clock.now += 11
+        self.assertIsNone(controller.admit(LOW))
+
+    def test_latency_ignores_critical_requests(self):
+        controller = self.controller(LatencyPolicy({LOW: 0.5, NORMAL: 2.0}))
+        for _ in range(10):
+            controller.admit(CRITICAL)
+            controller.finish(CRITICAL, 5.0)  # e.g. password hashing at sign-in
+        controller.admit(NORMAL)
+        controller.finish(NORMAL, 0.1)
+        self.clock.now += LoadTracker.REFRESH_INTERVAL
+        self.assertEqual(controller.tracker.in_flight, 0)
+        self.assertEqual(controller.tracker.latency(0.9), 0.1)
+        self.assertIsNone(controller.admit(LOW))
+
+    def test_time_window(self):
+        policy = TimeWindowPolicy('06:00', '21:00', priorities=[LOW])
+        tracker = LoadTracker(clock=self.clock)
+        with mock.patch('chats.admission.datetime') as clock:
+            clock.strptime = datetime.strptime
+            clock.now.return_value = datetime(2024, 1, 1, 22, 0)
+            rejection = policy.check(LOW, tracker)
+            self.assertEqual(rejection.status, 403)
+            self.assertIsNone(rejection.retry_after)
+            self.assertIsNone(policy.check(CRITICAL, tracker))
+
+            clock.now.return_value = datetime(2024, 1, 1, 12, 0)
+            self.assertIsNone(policy.check(LOW, tracker))
+
+
+@override_settings(
+    ADMISSION_POLICIES=[
+        {'policy': 'chats.admission.ConcurrencyPolicy', 'limits': {LOW: 0}, 'retry_after': 2},
+    ],
+)
+class AdmissionControlMiddlewareTests(TestCase):
+
+    def test_sheds_low_priority(self):
+        response = self.client.get('/api/chats/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response.json(), {'detail': 'Server busy, please retry later.'})
+
+    def test_admits_other_priorities(self):
+        self.assertNotEqual(self.client.get('/api/').status_code, 503)
+        response = self.client.post(
+            f'/api/chats/{uuid.uuid4()}/messages/', {'message_body': 'hi'},
+            content_type='application/json',
+        )
+        self.assertNotEqual(response.status_code, 503)
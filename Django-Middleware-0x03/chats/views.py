@@ -1,9 +1,11 @@
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.response import Response
 from django.db.models import Q
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404
 
-from .models import Conversation, Message
+from . import metrics
+from .models import Conversation, Message, User
 from .serializers import ConversationSerializer, MessageSerializer
 from .permissions import IsConversationParticipant
 
@@ -27,8 +29,9 @@ class ConversationViewSet(viewsets.ModelViewSet):
         where the current authenticated user is a participant.
         """
         user = self.request.user
-        # Filter where the 'participants' ManyToMany field contains the user object.
-        return Conversation.objects.filter(participants=user).order_by('-created_at')
+        # Filter where the 'participants' ManyToMany field contains the user.
+        # By id: request.user is a token-backed user, not a User row (see chats/authentication.py).
+        return Conversation.objects.filter(participants=user.pk).order_by('-created_at')
 
     def perform_create(self, serializer):
         """
@@ -37,10 +40,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
         """
         instance = serializer.save()
         
-        # Explicitly add the creating user to the participants set.
-        if self.request.user not in instance.participants.all():
-            instance.participants.add(self.request.user)
-            instance.save()
+        # Explicitly add the creating user to the participants set (a no-op if already there).
+        instance.participants.add(self.request.user.pk)
 
 
 # --- 2. Message ViewSet (Nested resource: /api/chats/{chat_pk}/messages/) ---
@@ -71,7 +72,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         # Filter messages by the chat ID AND check if the user is a participant 
         # of the chat using double underscore lookups.
         return Message.objects.filter(
-            Q(chat__conversation_id=chat_pk) & Q(chat__participants=user)
+            Q(chat__conversation_id=chat_pk) & Q(chat__participants=user.pk)
         ).select_related('sender', 'chat').order_by('sent_at')
 
     def perform_create(self, serializer):
@@ -83,9 +84,24 @@ class MessageViewSet(viewsets.ModelViewSet):
         # 1. Retrieve the parent conversation instance based on URL and user participation.
         # This acts as a security check: if the user isn't a participant, they cannot post a message.
         conversation = get_object_or_404(
-            Conversation.objects.filter(participants=self.request.user), 
+            Conversation.objects.filter(participants=self.request.user.pk), 
             pk=chat_pk
         )
         
         # 2. Save the message, using the current user as the sender and the found conversation.
-        serializer.save(sender=self.request.user, chat=conversation)
+        serializer.save(sender_id=self.request.user.pk, chat=conversation)
+
+
+# --- 3. Metrics (/metrics/) ---
+def metrics_view(request):
+    """
+    Request metrics of every worker (see chats/metrics.py), in the Prometheus
+    text format. Staff and admin-role users only.
+    """
+    user = request.user
+    if not user.is_authenticated or not (user.is_staff or user.role == User.Role.ADMIN):
+        return HttpResponseForbidden("Metrics are restricted to administrators.")
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -6,6 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    if sys.argv[1:2] == ['test']:
+        # Scratch cache and log files (see test_settings.py)
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.test_settings')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
     try:
         from django.core.management import execute_from_command_line
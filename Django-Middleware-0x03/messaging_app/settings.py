@@ -1,3 +1,5 @@
+import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 
@@ -30,13 +32,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its latency and query counts include every other middleware
+    'chats.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    # NEW: Restrict access must happen BEFORE authentication or any other logic
-    'chats.middleware.RestrictAccessByTimeMiddleware',
+    # Load shedding must happen BEFORE authentication or any other logic
+    # (the former opening hours are a policy there, see ADMISSION_POLICIES)
+    'chats.middleware.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user from the Bearer token's claims (no User query), for the middleware below
+    'chats.authentication.JWTAuthenticationMiddleware',
     
     # CRITICAL: Register your custom middleware here. 
     # Must be after AuthenticationMiddleware to access request.user.
@@ -71,10 +78,46 @@ WSGI_APPLICATION = 'messaging_app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# SQLite connection profile, applied to every new connection. Each value can be
+# overridden from the environment (e.g. SQLITE_MMAP_SIZE=0 to turn mmap off).
+# journal_mode is the exception: it is written into the database file (and
+# leaves -wal/-shm files next to it), so it is opt-in, for the deployed
+# database only: SQLITE_JOURNAL_MODE=WAL lets readers and the writer run
+# without blocking each other.
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE')
+SQLITE_PRAGMAS = {
+    **({'journal_mode': SQLITE_JOURNAL_MODE} if SQLITE_JOURNAL_MODE else {}),
+    # Wait (ms) for a lock instead of failing with "database is locked"
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    # With WAL, NORMAL only fsyncs at checkpoints and is still safe against
+    # corruption; the rollback journal needs FULL for that
+    'synchronous': os.environ.get(
+        'SQLITE_SYNCHRONOUS', 'NORMAL' if (SQLITE_JOURNAL_MODE or '').upper() == 'WAL' else 'FULL'
+    ),
+    # Bytes of the file read through mmap instead of read() calls
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 2**20)),
+    # Page cache per connection; negative values are KiB
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024)),
+    # Sorts and temporary indexes in memory
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(
+                f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()
+            ),
+            # Take the write lock when a transaction starts: a deferred
+            # transaction that reads and then writes can't wait for the lock
+            # (busy_timeout doesn't apply) and fails with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Persistent connections, checked before reuse
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -127,7 +170,8 @@ AUTH_USER_MODEL = 'chats.User'
 REST_FRAMEWORK = {
     # CRITICAL: Set JWT (Bearer Token) as the default method for authentication
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Stateless: request.user is built from the token claims (see chats/authentication.py)
+        'chats.authentication.StatelessJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication', # Used for Browsable API
     ),
     # Set the default permission to only allow authenticated users access
@@ -148,8 +192,89 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),  # Refresh tokens are valid for 7 days
     'ROTATE_REFRESH_TOKENS': True, # Enhances security
     'AUTH_HEADER_TYPES': ('Bearer',), # Standard header type for API tokens
+    'USER_ID_FIELD': 'user_id', # The User primary key (there is no 'id' field)
+    # Tokens carry role and is_active, read by ChatTokenUser instead of loading the User
+    'TOKEN_USER_CLASS': 'chats.authentication.ChatTokenUser',
+    'TOKEN_OBTAIN_SERIALIZER': 'chats.authentication.ChatTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'chats.authentication.ChatTokenRefreshSerializer',
 }
 
+# Reject tokens issued before a user's role, is_active or password changed
+# (one cache read per request)
+JWT_REVOCATION_CHECK = os.environ.get('JWT_REVOCATION_CHECK', 'false').lower() == 'true'
+
+# --- Cache ---
+# Rate limits and token revocation must be shared by every worker (a system
+# check refuses per-process backends): Redis when REDIS_URL is set (needs the
+# redis package), else a SQLite file shared by the workers on this node (see
+# chats/cache_backends.py).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'chats.cache_backends.SharedSQLiteCache',
+            'LOCATION': os.environ.get('CHATS_CACHE_PATH', str(BASE_DIR / 'cache.sqlite3')),
+            'OPTIONS': {'MAX_ENTRIES': 100_000},
+        }
+    }
+
+# --- Rate limiting (chats/ratelimit.py) ---
+# Per client: authenticated user, else IP. `limit` applies per IP, `user_limit`
+# per user (defaults to `limit`); `path` is a regex, `methods` all when empty.
+RATE_LIMIT_CACHE = 'default'
+RATE_LIMITS = [
+    {'name': 'post', 'methods': ('POST',), 'limit': 5, 'window': 60},
+    {'name': 'login', 'methods': ('POST',), 'path': r'^/api/token/$', 'limit': 10, 'window': 300},
+]
+
+# --- ASGI ---
+# Run the custom middleware natively async under ASGI. Off by default: with the
+# Django middleware in MIDDLEWARE it adds thread hops instead of removing them
+# (compare with `manage.py bench_asgi_middleware`); turn it on for a stack
+# that is async end to end.
+CHATS_ASYNC_MIDDLEWARE = os.environ.get('CHATS_ASYNC_MIDDLEWARE', 'false').lower() == 'true'
+
+# --- Admission control (chats/admission.py) ---
+# Priority of a request: first matching rule (`path` regex, `methods`), else 'normal'
+ADMISSION_PRIORITIES = [
+    # Sending messages and signing in are never shed
+    {'priority': 'critical', 'methods': ('POST',), 'path': r'^/api/chats/[^/]+/messages/$'},
+    {'priority': 'critical', 'path': r'^/(api/token|api-auth|admin|metrics)/'},
+    # List polling and search go first
+    {'priority': 'low', 'methods': ('GET', 'HEAD'), 'path': r'^/api/chats/([^/]+/messages/)?$'},
+]
+# Per worker: shed a priority past `limits[priority]` requests in flight, or
+# while the p90 latency of the last ADMISSION_LATENCY_WINDOW seconds (critical
+# requests excluded) exceeds `limits[priority]` seconds.
+ADMISSION_POLICIES = [
+    {'policy': 'chats.admission.ConcurrencyPolicy', 'limits': {'low': 32, 'normal': 64}},
+    {'policy': 'chats.admission.LatencyPolicy', 'limits': {'low': 0.5, 'normal': 2.0}},
+    # Fixed opening hours (the former RestrictAccessByTimeMiddleware):
+    # {'policy': 'chats.admission.TimeWindowPolicy', 'start': '06:00', 'end': '21:00'},
+]
+ADMISSION_LATENCY_WINDOW = 10
+
+# --- Offensive-language filter (chats/profanity.py) ---
+# One term or phrase per line; edits are picked up without a restart
+OFFENSIVE_TERMS_FILE = os.environ.get('OFFENSIVE_TERMS_FILE', str(BASE_DIR / 'chats' / 'blocklist.txt'))
+OFFENSIVE_TERMS_RELOAD_INTERVAL = 30
+
+# --- Metrics (chats/metrics.py, served at /metrics/) ---
+# Each worker writes its counters here every METRICS_FLUSH_INTERVAL seconds; the
+# endpoint merges them. Runtime state, not part of the project: point it at the
+# server's runtime directory (e.g. /run/messaging_app/metrics) and empty it when
+# the server restarts.
+METRICS_DIR = os.environ.get(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'messaging_app_metrics')
+)
+METRICS_FLUSH_INTERVAL = 5
+
 # --- Logging Configuration (NEW) ---
 LOGGING = {
     'version': 1,
@@ -157,9 +282,14 @@ LOGGING = {
     'handlers': {
         'file': {
             'level': 'INFO',
-            # This handler writes to the requests.log file at the project root
-            'class': 'logging.FileHandler',
-            'filename': BASE_DIR / 'requests.log', 
+            # This handler writes JSON lines to the requests.log file at the project root,
+            # from a background thread (see chats/request_log.py)
+            'class': 'chats.request_log.BatchingJSONLinesHandler',
+            'filename': BASE_DIR / 'requests.log',
+            'max_bytes': 10 * 2**20, # Rotated to requests.log.1 ... .5 past 10 MiB
+            'backup_count': 5,
+            'queue_size': 10_000, # Records beyond this are dropped (and counted), never waited for
+            'batch_size': 500,
         },
     },
     'loggers': {
@@ -0,0 +1,33 @@
+'''
+Settings for the test suite (`python manage.py test` picks them up): the
+project settings with scratch files for the cache and the request log.
+'''
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES, LOGGING
+
+_scratch_dir = tempfile.mkdtemp(prefix='chats_tests_')
+
+# The chats app ships no migrations: create its tables directly
+MIGRATION_MODULES = {'chats': None}
+
+CACHES = {
+    **CACHES,
+    'default': {
+        'BACKEND': 'chats.cache_backends.SharedSQLiteCache',
+        'LOCATION': os.path.join(_scratch_dir, 'cache.sqlite3'),
+    },
+}
+
+LOGGING = {
+    **LOGGING,
+    'handlers': {
+        **LOGGING['handlers'],
+        'file': {**LOGGING['handlers']['file'], 'filename': os.path.join(_scratch_dir, 'requests.log')},
+    },
+}
+
+# Metrics stay in memory (the /metrics/ endpoint renders this process only)
+METRICS_DIR = None
@@ -5,6 +5,8 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView
 )
 
+from chats.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -15,6 +17,9 @@ urlpatterns = [
     # DRF Login/Logout for Browsable API (Resolves 'api-auth' check)
     path('api-auth/', include('rest_framework.urls')),
 
+    # Prometheus scrape endpoint (admin only), see chats/metrics.py
+    path('metrics/', metrics_view, name='metrics'),
+
     # API Endpoints (delegated to the chats app)
     # This path is what creates the required '/api/' prefix.
     # The include() function delegates all the routes defined in chats/urls.py
@@ -1,25 +1,218 @@
-from django.contrib import admin
+import hashlib
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
 from .models import Message, Notification, MessageHistory
+from .search import TERM_RE, matching_history_ids, matching_message_ids
+
+# The changelists below are sized for tables with millions of rows:
+# - related objects shown in list_display are joined (list_select_related)
+#   instead of fetched one query per row,
+# - user filters are autocomplete boxes, not a sidebar listing every user,
+# - the total row count is cached (and estimated on PostgreSQL) rather than
+#   recomputed with a COUNT(*) on every page view,
+# - searching message content goes through a full-text index (messaging.search)
+#   instead of LIKE '%term%' scans.
+
+# Seconds a changelist row count is reused
+COUNT_CACHE_TIMEOUT = 60
+
+# Above this many rows an unfiltered count is estimated from planner statistics
+COUNT_ESTIMATE_THRESHOLD = 100_000
+
+
+class CachedCountPaginator(Paginator):
+    '''
+    Paginator whose count is cached per query for COUNT_CACHE_TIMEOUT seconds.
+    On PostgreSQL, unfiltered counts of big tables use the planner's estimate.
+    '''
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        try:
+            sql, params = query.sql_with_params()
+        except EmptyResultSet:  # e.g. queryset.none()
+            return 0
+        key = 'messaging:admin:count:' + hashlib.md5(
+            (query.model._meta.label + sql + repr(params)).encode()
+        ).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self._estimate() or self.object_list.count()
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    def _estimate(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql' or query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [query.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < COUNT_ESTIMATE_THRESHOLD:
+            return None
+        return row[0]
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = CachedCountPaginator
+    # "N results (M total)" would need a second, unfiltered COUNT(*)
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    '''
+    List filter rendered as an autocomplete box over a foreign key, so choosing
+    a user doesn't require loading every user into the sidebar.
+    Subclasses set title and field_name; the URL parameter is <field_name>__id__exact.
+    '''
+    template = 'admin/messaging/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.parameter_name = f'{self.field_name}__id__exact'
+        super().__init__(request, params, model, model_admin)
+        field = model._meta.get_field(self.field_name)
+        widget = AutocompleteSelect(field, model_admin.admin_site)
+        widget.attrs['data-filter-parameter'] = self.parameter_name
+        form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=widget,
+            required=False,
+        )
+        # The chosen object, or None when the parameter is missing or invalid
+        try:
+            self.selected = form_field.to_python(self.value())
+        except ValidationError:
+            self.selected = None
+        self.rendered_widget = form_field.widget.render(
+            name=self.parameter_name,
+            value=self.selected.pk if self.selected is not None else None,
+            attrs={'id': f'id_filter_{self.field_name}'},
+        )
+        self.media = widget.media + forms.Media(js=['messaging/autocomplete_filter.js'])
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        if self.selected is None:
+            return queryset.none()
+        return queryset.filter(**{f'{self.field_name}_id': self.selected.pk})
+
+
+class SenderFilter(AutocompleteFilter):
+    title = 'sender'
+    field_name = 'sender'
+
+
+class ReceiverFilter(AutocompleteFilter):
+    title = 'receiver'
+    field_name = 'receiver'
+
+
+class UserFilter(AutocompleteFilter):
+    title = 'user'
+    field_name = 'user'
+
+
+class FilterMediaMixin:
+    '''Adds the JS/CSS of autocomplete filters to the changelist page'''
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        context = getattr(response, 'context_data', None)
+        if context and 'cl' in context:
+            for spec in context['cl'].filter_specs:
+                if isinstance(spec, AutocompleteFilter):
+                    context['media'] += spec.media
+        return response
+
+
+class IndexedSearchMixin:
+    '''
+    Search that only uses indexes: message content (`content_search_path`
+    leads to the Message) and previous contents (`history_search_path` to the
+    MessageHistory, if set) are looked up in the full-text indexes, and each of
+    `exact_search_fields` by equality (usernames are unique, so indexed;
+    emails are not, but the user table is small next to the messages).
+    Without the full-text indexes contents are not searched at all, rather than
+    falling back to a table scan, and the page shows a warning.
+    '''
+    content_search_path = 'pk'
+    history_search_path = None
+    exact_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        matches = queryset.none()
+        for field in self.exact_search_fields:
+            matches |= queryset.filter(**{field: search_term})
+
+        searches = [(self.content_search_path, matching_message_ids)]
+        if self.history_search_path is not None:
+            searches.append((self.history_search_path, matching_history_ids))
+        missing_index = False
+        for path, matching_ids in searches:
+            ids = matching_ids(search_term, using=queryset.db)
+            if ids is not None:
+                matches |= queryset.filter(**{f'{path}__in': ids})
+            elif TERM_RE.search(search_term):
+                missing_index = True
+        if missing_index:
+            messages.warning(
+                request,
+                'The full-text search index is missing, so message contents were not '
+                'searched. Run "manage.py rebuild_message_search" to create it.',
+            )
+        return matches, False
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
-    list_display = ("sender", "content_preview", "timestamp")
-    list_filter = ("sender", "reciever", "timestamp")
-    search_fields = ("content", "sender__email", "reciever__email")
+class MessageAdmin(FilterMediaMixin, IndexedSearchMixin, ScalableAdmin):
+    list_display = ("sender", "receiver", "content_preview", "timestamp")
+    list_select_related = ("sender", "receiver")
+    list_filter = (SenderFilter, ReceiverFilter, "timestamp")
+    # Needed by autocomplete (parent_message); the search itself is IndexedSearchMixin's
+    search_fields = ("content",)
+    exact_search_fields = ("sender__username", "receiver__username", "sender__email", "receiver__email")
+    autocomplete_fields = ("sender", "receiver", "parent_message")
     ordering = ("-timestamp",)
 
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
-    
+
     content_preview.short_description = 'content'
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(FilterMediaMixin, IndexedSearchMixin, ScalableAdmin):
     list_display = ('user', 'message_sender', 'is_read', 'created_at')
-    list_filter = ('is_read', 'created_at', 'user')
-    search_fields = ('user__email', 'message__content')
+    list_select_related = ('user', 'message__sender')
+    list_filter = ('is_read', 'created_at', UserFilter)
+    search_fields = ('message__content',)
+    content_search_path = 'message'
+    exact_search_fields = ('user__username', 'user__email')
+    autocomplete_fields = ('user', 'message')
     ordering = ('-created_at',)
 
     def message_sender(self, obj):
@@ -27,12 +220,16 @@ class NotificationAdmin(admin.ModelAdmin):
     message_sender.short_description = 'Message Sender'
 
 @admin.register(MessageHistory) # Register the history model separately
-class MessageHistoryAdmin(admin.ModelAdmin):
+class MessageHistoryAdmin(IndexedSearchMixin, ScalableAdmin):
     list_display = ('message', 'old_content_preview', 'edited_at')
+    list_select_related = ('message__sender', 'message__receiver')
     list_filter = ('edited_at',)
     search_fields = ('message__content', 'old_content')
+    content_search_path = 'message'
+    history_search_path = 'pk'
+    autocomplete_fields = ('message', 'edited_by')
     ordering = ('-edited_at',)
 
     def old_content_preview(self, obj):
         return obj.old_content[:50] + '...' if len(obj.old_content) > 50 else obj.old_content
-    old_content_preview.short_description = 'Previous Content'
\ No newline at end of file
+    old_content_preview.short_description = 'Previous Content'
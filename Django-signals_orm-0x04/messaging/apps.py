@@ -1,4 +1,12 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def create_search_indexes(sender, using, **kwargs):
+    '''Creates the full-text indexes of messaging.search after migrate'''
+    from messaging.search import create_missing_indexes
+    create_missing_indexes(connections[using])
 
 
 class MessagingConfig(AppConfig):
@@ -11,4 +19,5 @@ class MessagingConfig(AppConfig):
         This method is called when django starts up.
         It's required to import the signals file and connect the recievers
         '''
-        import messaging.signals
\ No newline at end of file
+        import messaging.signals
+        post_migrate.connect(create_search_indexes, sender=self)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from messaging.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Creates (if needed) and rebuilds the full-text indexes over message contents.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            self.stderr.write('The message search indexes require SQLite FTS5.')
+            return
+        rebuild_index(connection)
+        self.stdout.write(self.style.SUCCESS('Message search indexes rebuilt'))
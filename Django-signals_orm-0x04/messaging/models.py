@@ -50,7 +50,7 @@ class Message(models.Model):
         ordering = ['-timestamp']
 
     def __str__(self):
-        return f'Message from {self.sender} to {self.receiver} {self.timestamp.strftime('%H:%M')}'
+        return f'Message from {self.sender} to {self.receiver} {self.timestamp.strftime("%H:%M")}'
 
 class Notification(models.Model):
     '''
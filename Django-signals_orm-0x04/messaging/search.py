@@ -0,0 +1,133 @@
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+# Full-text indexes (SQLite FTS5), used by the admin search boxes instead of
+# LIKE '%term%' scans: messaging_message.content and the previous versions in
+# messaging_messagehistory.old_content.
+#
+# External-content tables: the text stays in the model's table and triggers keep
+# the index in sync on INSERT, UPDATE of the column and DELETE. They are created
+# (and filled) after `migrate` (see apps.py); `manage.py rebuild_message_search`
+# re-reads every row, e.g. after a VACUUM, which may renumber rowids.
+
+
+class FullTextIndex:
+    def __init__(self, name, table, column):
+        self.name = name
+        self.table = table
+        self.column = column
+
+    @property
+    def create_sql(self):
+        name, table, column = self.name, self.table, self.column
+        return [
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+                {column},
+                content='{table}',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {name}(rowid, {column}) VALUES (new.id, new.{column});
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {name}({name}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {column} ON {table} BEGIN
+                INSERT INTO {name}({name}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                INSERT INTO {name}(rowid, {column}) VALUES (new.id, new.{column});
+            END
+            """,
+        ]
+
+    def rebuild(self, connection):
+        '''Creates the index and triggers if needed and re-reads every row'''
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            for statement in self.create_sql:
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {self.name}({self.name}) VALUES ('rebuild')")
+        _indexed_databases.add((connection.settings_dict['NAME'], self.name))
+
+    def available(self, connection):
+        '''True when the index exists; only introspects the database until it does'''
+        if connection.vendor != 'sqlite':
+            return False
+        key = (connection.settings_dict['NAME'], self.name)
+        if key not in _indexed_databases:
+            if self.name not in connection.introspection.table_names(include_views=True):
+                return False
+            _indexed_databases.add(key)
+        return True
+
+    def matching_ids(self, text, using='default'):
+        '''
+        Subquery of the ids of the rows whose column matches `text`, for
+        filter(pk__in=...). None when there is nothing to search for or no index.
+        '''
+        match = build_match_query(text)
+        if match is None or not self.available(connections[using]):
+            return None
+        return RawSQL(f'SELECT rowid FROM {self.name} WHERE {self.name} MATCH %s', [match])
+
+
+# (database NAME, index) pairs where the index was found
+_indexed_databases = set()
+
+MESSAGE_INDEX = FullTextIndex('messaging_message_fts', 'messaging_message', 'content')
+HISTORY_INDEX = FullTextIndex(
+    'messaging_messagehistory_fts', 'messaging_messagehistory', 'old_content'
+)
+INDEXES = (MESSAGE_INDEX, HISTORY_INDEX)
+
+# Words (letters/digits, including non-ASCII) pulled out of the search box
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def rebuild_index(connection):
+    for index in INDEXES:
+        index.rebuild(connection)
+
+
+def create_missing_indexes(connection):
+    '''
+    Creates and fills the indexes that don't exist yet, once their table does.
+    Returns the indexes created.
+    '''
+    if connection.vendor != 'sqlite':
+        return []
+    tables = connection.introspection.table_names(include_views=True)
+    missing = [index for index in INDEXES if index.table in tables and index.name not in tables]
+    for index in missing:
+        index.rebuild(connection)
+    return missing
+
+
+def build_match_query(text):
+    '''Quoted, ANDed terms (the last one a prefix) so user input can't break MATCH syntax'''
+    terms = TERM_RE.findall(text or '')
+    if not terms:
+        return None
+    quoted = ['"{}"'.format(term.replace('"', '""')) for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def matching_message_ids(text, using='default'):
+    '''Subquery of the ids of messages whose content matches `text` (or None)'''
+    return MESSAGE_INDEX.matching_ids(text, using)
+
+
+def matching_history_ids(text, using='default'):
+    '''Subquery of the ids of MessageHistory rows whose old_content matches `text` (or None)'''
+    return HISTORY_INDEX.matching_ids(text, using)
@@ -0,0 +1,16 @@
+'use strict';
+// Applies an autocomplete list filter (messaging.admin.AutocompleteFilter) as
+// soon as a value is picked or cleared, keeping the other changelist parameters.
+(function($) {
+    $(document).on('change', 'select[data-filter-parameter]', function() {
+        const url = new URL(window.location.href);
+        const parameter = this.dataset.filterParameter;
+        if (this.value) {
+            url.searchParams.set(parameter, this.value);
+        } else {
+            url.searchParams.delete(parameter);
+        }
+        url.searchParams.delete('p');
+        window.location.href = url.toString();
+    });
+})(django.jQuery);
@@ -1,3 +1,185 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from . import metrics
+from .admin import CachedCountPaginator
+from .models import Message, MessageHistory
+from .search import INDEXES, MESSAGE_INDEX, create_missing_indexes
+
+User = get_user_model()
+
+
+class AdminFullTextSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.lunch = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content='Lunch at noon?'
+        )
+        self.dinner = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content='Dinner later'
+        )
+
+    def search(self, model, text):
+        response = self.client.get(f'/admin/messaging/{model}/', {'q': text})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_index_is_created_by_migrate(self):
+        tables = connection.introspection.table_names(include_views=True)
+        for index in INDEXES:
+            self.assertIn(index.name, tables)
+        self.assertEqual(create_missing_indexes(connection), [])
+
+    def test_message_search_follows_writes(self):
+        self.assertEqual(self.search('message', 'lunch'), [self.lunch])
+        self.assertEqual(self.search('message', 'noo'), [self.lunch])
+
+        # update() skips the pre_save history signal
+        Message.objects.filter(pk=self.lunch.pk).update(content='Breakfast at eight?')
+        self.assertEqual(self.search('message', 'lunch'), [])
+        self.assertEqual(self.search('message', 'breakfast'), [self.lunch])
+
+        self.lunch.delete()
+        self.assertEqual(self.search('message', 'breakfast'), [])
+
+    def test_missing_index_is_reported(self):
+        with mock.patch.object(MESSAGE_INDEX, 'available', return_value=False):
+            response = self.client.get('/admin/messaging/message/', {'q': 'lunch'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+        [warning] = response.context['messages']
+        self.assertIn('rebuild_message_search', str(warning))
+
+    def test_exact_username_search(self):
+        carol = User.objects.create_user('carol', 'carol@example.com', 'password')
+        message = Message.objects.create(sender=carol, receiver=self.alice, content='Hi')
+        self.assertEqual(self.search('message', 'carol'), [message])
+
+    def test_exact_email_search(self):
+        self.assertEqual(self.search('message', 'alice@example.com'), [self.dinner, self.lunch])
+        self.assertEqual(self.search('notification', 'bob@example.com'),
+                         list(self.bob.notifications.order_by('-created_at')))
+
+    def test_history_search_matches_old_content(self):
+        history = MessageHistory.objects.create(
+            message=self.dinner, old_content='Dinner later', edited_by=self.bob
+        )
+        Message.objects.filter(pk=self.dinner.pk).update(content='Supper later')
+
+        self.assertEqual(self.search('messagehistory', 'dinner'), [history])
+        # The current content of the message
+        self.assertEqual(self.search('messagehistory', 'supper'), [history])
+
+    def test_notification_search_uses_message_content(self):
+        [result] = self.search('notification', 'lunch')
+        self.assertEqual(result.message, self.lunch)
+
+
+class ScalableChangelistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def create_messages(self, count, sender=None):
+        sender = sender or self.alice
+        receiver = self.bob if sender == self.alice else self.alice
+        # Without the notification and history signals
+        return Message.objects.bulk_create(
+            Message(sender=sender, receiver=receiver, content=f'message {i}') for i in range(count)
+        )
+
+    def changelist(self, model='message', **params):
+        response = self.client.get(f'/admin/messaging/{model}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_count_is_cached(self):
+        self.create_messages(3)
+        self.assertEqual(self.changelist().result_count, 3)
+        self.create_messages(2)
+        # Reused until COUNT_CACHE_TIMEOUT
+        self.assertEqual(self.changelist().result_count, 3)
+        # Each filter has its own count
+        self.assertEqual(self.changelist(sender__id__exact=self.alice.pk).result_count, 5)
+
+    def test_count_is_not_estimated_on_sqlite(self):
+        self.create_messages(3)
+        paginator = CachedCountPaginator(Message.objects.order_by('pk'), 2)
+        self.assertIsNone(paginator._estimate())
+        self.assertEqual(paginator.count, 3)
+
+    def test_autocomplete_filter(self):
+        [sent] = self.create_messages(1, sender=self.bob)
+        self.create_messages(2)
+        changelist = self.changelist(sender__id__exact=self.bob.pk)
+        self.assertEqual(list(changelist.result_list), [sent])
+        [spec] = [spec for spec in changelist.filter_specs if spec.title == 'sender']
+        self.assertEqual(spec.selected, self.bob)
+        self.assertIn(f'value="{self.bob.pk}" selected', spec.rendered_widget)
+
+    def test_autocomplete_filter_rejects_invalid_values(self):
+        self.create_messages(2)
+        for value in ('abc', '999999'):
+            with self.subTest(value=value):
+                changelist = self.changelist(sender__id__exact=value)
+                self.assertEqual(list(changelist.result_list), [])
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.create_messages(2)
+        with CaptureQueriesContext(connection) as few:
+            self.changelist()
+        cache.clear()
+        self.create_messages(40, sender=self.bob)
+        with CaptureQueriesContext(connection) as many:
+            self.changelist()
+        self.assertEqual(len(many), len(few))
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_requests_are_recorded_by_route_pattern(self):
+        self.client.force_login(self.staff)
+        self.client.get('/admin/messaging/message/')
+        self.client.get('/admin/messaging/message/')
+        self.client.get('/no/such/page/')
+
+        route = 'admin/messaging/message/'
+        self.assertEqual(self.registry.responses[(route, 'GET', 200)], 2)
+        self.assertEqual(self.registry.responses[(metrics.UNMATCHED_ROUTE, 'GET', 404)], 1)
+        self.assertEqual(self.registry.latency[(route, 'GET')].count, 2)
+        self.assertGreater(self.registry.query_counts[(route, 'GET')].sum, 0)
+        self.assertEqual(self.registry.in_flight, 0)
+
+    def test_endpoint_is_limited_to_staff(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
 
-# Create your tests here.
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('http_responses_total{route="metrics/",method="GET",status="403"} 1',
+                      response.content.decode())
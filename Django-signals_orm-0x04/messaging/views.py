@@ -3,6 +3,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
 import logging
 from django.db.models import Q
+from . import metrics
 from .models import Message
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
@@ -117,4 +118,17 @@ def get_unread_message(request):
     return JsonResponse(
         {'unread_inbox': unread_data},
         status = 200
-    )
\ No newline at end of file
+    )
+
+
+def metrics_view(request):
+    '''
+    Request metrics of every worker (see messaging/metrics.py), in the
+    Prometheus text format. Staff only.
+    '''
+    if not request.user.is_staff:
+        return HttpResponseForbidden('Metrics are restricted to staff.')
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the time spent in the other middleware is measured (messaging/metrics.py)
+    'messaging.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,10 +76,46 @@ WSGI_APPLICATION = 'messaging_app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite connection profile, applied to every new connection. Each value can be
+# overridden from the environment (e.g. SQLITE_MMAP_SIZE=0 to turn mmap off).
+# journal_mode is the exception: it is written into the database file (and
+# leaves -wal/-shm files next to it), so it is opt-in, for the deployed
+# database only: SQLITE_JOURNAL_MODE=WAL lets readers and the writer run
+# without blocking each other.
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE')
+SQLITE_PRAGMAS = {
+    **({'journal_mode': SQLITE_JOURNAL_MODE} if SQLITE_JOURNAL_MODE else {}),
+    # Wait (ms) for a lock instead of failing with "database is locked"
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    # With WAL, NORMAL only fsyncs at checkpoints and is still safe against
+    # corruption; the rollback journal needs FULL for that
+    'synchronous': os.environ.get(
+        'SQLITE_SYNCHRONOUS', 'NORMAL' if (SQLITE_JOURNAL_MODE or '').upper() == 'WAL' else 'FULL'
+    ),
+    # Bytes of the file read through mmap instead of read() calls
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 2**20)),
+    # Page cache per connection; negative values are KiB
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024)),
+    # Sorts and temporary indexes in memory
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(
+                f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()
+            ),
+            # Take the write lock when a transaction starts: a deferred
+            # transaction that reads and then writes can't wait for the lock
+            # (busy_timeout doesn't apply) and fails with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Persistent connections, checked before reuse
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -120,3 +160,12 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# --- Metrics (messaging/metrics.py, served at /metrics/) ---
+# Each worker writes its counters here every METRICS_FLUSH_INTERVAL seconds; the
+# endpoint merges them. Runtime state, not part of the project: point it at the
+# server's runtime directory and empty it when the server restarts.
+METRICS_DIR = os.environ.get(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'messaging_signals_metrics')
+)
+METRICS_FLUSH_INTERVAL = 5
@@ -0,0 +1,17 @@
+"""
+Settings for the test suite (`python manage.py test` picks them up): the
+project settings with the messaging app installed.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS
+
+INSTALLED_APPS = [*INSTALLED_APPS, 'messaging']
+
+# The admin, for the changelist tests
+ROOT_URLCONF = 'messaging_app.test_urls'
+
+# The app ships no migrations: create its tables directly
+MIGRATION_MODULES = {'messaging': None}
+
+# Metrics stay in the test process (see messaging/metrics.py)
+METRICS_DIR = None
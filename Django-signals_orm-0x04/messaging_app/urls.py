@@ -1,5 +1,5 @@
 from django.urls import path
-from ..messaging.views import delete_user_account, get_unread_message
+from messaging.views import delete_user_account, get_unread_message, metrics_view
 
 urlpatterns = [
     path(
@@ -11,5 +11,7 @@ urlpatterns = [
         'user/unread-messages/',
         get_unread_message,
         name = 'get_unread_message'
-    )
+    ),
+    # Prometheus scrape endpoint (staff only), see messaging/metrics.py
+    path('metrics/', metrics_view, name='metrics'),
 ]
\ No newline at end of file
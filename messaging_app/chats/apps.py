@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        '''
+        Connects the signal receivers in chats/signals.py once the app registry is ready
+        '''
+        import chats.signals
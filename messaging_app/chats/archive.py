@@ -0,0 +1,146 @@
+import copy
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import ArchivedMessage, Conversation, Message
+from .pagination import Cursor, filter_by_cursor
+
+# Cold-message archival.
+#
+# Messages older than ARCHIVE_AFTER are moved, oldest first and in batches, from
+# chats_message into chats_archivedmessage, keeping the hot table and its indexes
+# sized to recent traffic. Because messages move in (sent_at, message_id) order,
+# every archived message of a conversation sorts before every hot one, and
+# Conversation.archived_until marks the seam: a page that stays on the recent
+# side of it never touches the archive. The default (cursor-less) listing of a
+# conversation with archived messages starts at the seam, with a "previous"
+# link into the archive, so it only reads the archive to fill a short page.
+#
+# Archived messages leave the full-text index with the hot rows (the FTS triggers
+# fire on delete), so search covers the hot window only.
+
+# Messages sent longer ago than this are archived
+ARCHIVE_AFTER = timedelta(days=getattr(settings, 'CHATS_ARCHIVE_AFTER_DAYS', 180))
+
+# Messages moved per transaction
+ARCHIVE_BATCH_SIZE = 500
+
+ARCHIVED_FIELDS = ('message_id', 'sender_id', 'chat_id', 'message_body', 'sent_at')
+
+
+def archive_messages(older_than=ARCHIVE_AFTER, batch_size=ARCHIVE_BATCH_SIZE):
+    '''
+    Moves messages sent before now - older_than into the archive.
+    Each batch is copied, deleted and recorded on its conversations in one short
+    transaction, so writers are never blocked for long, and read from the head of
+    Index(sent_at, message_id). Returns the number of messages moved.
+    '''
+    cutoff = timezone.now() - older_than
+    # Every statement on the primary, reads included (never a lagging replica)
+    using = router.db_for_write(Message)
+    moved = 0
+    while True:
+        with transaction.atomic(using=using):
+            rows = list(
+                Message.objects.using(using).filter(sent_at__lt=cutoff)
+                .order_by('sent_at', 'message_id')
+                .values(*ARCHIVED_FIELDS)[:batch_size]
+            )
+            if not rows:
+                return moved
+
+            ArchivedMessage.objects.using(using).bulk_create(ArchivedMessage(**row) for row in rows)
+            # Plain DELETE, the path Message.delete() takes when nothing listens:
+            # the rows still exist (archived), so there is nothing to invalidate.
+            Message.objects.using(using).filter(
+                pk__in=[row['message_id'] for row in rows]
+            )._raw_delete(using)
+
+            # Rows are in ascending order, the last one per conversation is its newest
+            newest = {row['chat_id']: row['sent_at'] for row in rows}
+            Conversation.objects.using(using).filter(pk__in=newest).update(
+                archived_until=Case(
+                    *[When(pk=chat_id, then=Value(sent_at)) for chat_id, sent_at in newest.items()],
+                    output_field=DateTimeField(),
+                )
+            )
+        moved += len(rows)
+
+
+class ArchiveReadThrough:
+    '''
+    Sliceable message source spanning the hot table and the archive of one
+    conversation, for MessageCursorPagination. The archive is only queried when
+    the page reaches past `archived_until`; otherwise this is a plain hot query.
+
+    hot and archive are querysets over the same columns (e.g. .values() rows).
+    After a slice without cursor, has_previous tells whether archived messages
+    precede the rows returned.
+    '''
+
+    def __init__(self, hot, archive, archived_until):
+        self.hot = hot
+        self.archive = archive
+        self.archived_until = archived_until
+        self.cursor = None
+        self.ordering = ('sent_at', 'message_id')
+        self.has_previous = False
+
+    def filter_by_cursor(self, cursor, ordering):
+        clone = copy.copy(self)
+        clone.cursor = cursor
+        clone.ordering = ordering
+        return clone
+
+    def _fetch(self, queryset, limit):
+        if limit <= 0:
+            return []
+        return list(filter_by_cursor(queryset, self.cursor, self.ordering)[:limit])
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.start or item.step or item.stop is None:
+            raise TypeError('ArchiveReadThrough only supports [:limit]')
+        limit = item.stop
+        cursor = self.cursor
+
+        if cursor is None:
+            # From the seam: the oldest hot rows, after the newest archived ones
+            # when there are too few hot rows to fill the page. The paginator
+            # asks for one row more than a page; there is none after the last hot row.
+            rows = self._fetch(self.hot, limit)
+            wanted = limit - 1 - len(rows)
+            archived = []
+            if wanted > 0:
+                tail = Cursor(reverse=True, sent_at=self.archived_until, message_id=None)
+                archived = list(filter_by_cursor(self.archive, tail, self.ordering)[:wanted + 1])
+            self.has_previous = wanted <= 0 or len(archived) > wanted
+            return archived[:wanted][::-1] + rows
+
+        if cursor.reverse:
+            # Newer to older: hot rows first, then continue into the archive
+            rows = []
+            if cursor.sent_at >= self.archived_until:
+                rows = self._fetch(self.hot, limit)
+            return rows + self._fetch(self.archive, limit - len(rows))
+
+        # Older to newer: archived rows first when the page starts inside the archive
+        rows = []
+        if cursor.sent_at <= self.archived_until:
+            rows = self._fetch(self.archive, limit)
+        return rows + self._fetch(self.hot, limit - len(rows))
+
+
+def with_archive(hot, archive, conversation_id):
+    '''Wraps `hot` in an ArchiveReadThrough when the conversation has archived messages'''
+    archived_until = (
+        Conversation.objects.filter(pk=conversation_id)
+        .values_list('archived_until', flat=True)
+        .first()
+    )
+    if archived_until is None:
+        return hot
+    return ArchiveReadThrough(hot, archive, archived_until)
@@ -0,0 +1,314 @@
+import math
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Two-tier cache: a small in-process LRU (L1) in front of a SQLite file (L2)
+# shared by every worker process on the node.
+#
+# - L1 answers hot keys without I/O. Other workers' writes aren't seen by it, so
+#   entries live at most L1_TIMEOUT seconds, and keys starting with one of
+#   L1_EXCLUDE_PREFIXES (e.g. invalidation counters) always go to L2.
+# - L2 runs in WAL mode, so readers in all workers proceed while one writes;
+#   add() and incr() are atomic across processes.
+# - get_or_set() protects expensive values from stampedes: concurrent misses on
+#   the same key are coalesced into one computation (per-key lock in the
+#   process, add()-based lock across processes), and values are recomputed by
+#   one caller shortly before they expire, with a probability that grows as the
+#   expiry nears and with how long the value took to compute ("XFetch").
+#
+# CACHES = {
+#     "default": {
+#         "BACKEND": "chats.cache_backends.TieredCache",
+#         "LOCATION": "/var/cache/messaging_app/cache.sqlite3",
+#         "OPTIONS": {"L1_MAX_ENTRIES": 1000, "L1_TIMEOUT": 2},
+#     }
+# }
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache_entries (
+    cache_key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    delta REAL NOT NULL DEFAULT 0
+)
+'''
+
+# Number of lock stripes used to coalesce concurrent misses within a process
+_LOCK_STRIPES = 64
+
+
+class TieredCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = str(location)
+        self.l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self.l1_timeout = float(options.get('L1_TIMEOUT', 2))
+        self.l1_exclude_prefixes = tuple(
+            self.make_key(prefix) for prefix in options.get('L1_EXCLUDE_PREFIXES', ())
+        )
+        # Seconds a caller waits for another worker's computation before doing it itself
+        self.lock_timeout = float(options.get('LOCK_TIMEOUT', 10))
+        # XFetch aggressiveness: > 1 refreshes earlier, 0 disables early refresh
+        self.early_refresh_beta = float(options.get('EARLY_REFRESH_BETA', 1.0))
+        # Expired rows are purged (and MAX_ENTRIES enforced) every CULL_EVERY writes
+        self.cull_every = int(options.get('CULL_EVERY', 200))
+
+        self._l1 = OrderedDict()
+        self._l1_lock = threading.Lock()
+        self._compute_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        self._local = threading.local()
+        self._writes = 0
+
+    # --- L2 (SQLite) ---
+
+    def _db(self):
+        # One connection per thread, never reused across a fork (preloading servers)
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.lock_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(_SCHEMA)
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def _l2_get(self, key, now):
+        row = self._db().execute(
+            'SELECT value, expires, delta FROM cache_entries WHERE cache_key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return pickle.loads(row[0]), row[1], row[2]
+
+    def _l2_set(self, key, value, expires, delta=0.0):
+        self._db().execute(
+            'INSERT OR REPLACE INTO cache_entries (cache_key, value, expires, delta) '
+            'VALUES (?, ?, ?, ?)',
+            (key, pickle.dumps(value, self.pickle_protocol), expires, delta),
+        )
+        self._maybe_cull()
+
+    def _maybe_cull(self):
+        self._writes += 1
+        if self._writes % self.cull_every:
+            return
+        db = self._db()
+        db.execute('DELETE FROM cache_entries WHERE expires <= ?', (time.time(),))
+        (count,) = db.execute('SELECT COUNT(*) FROM cache_entries').fetchone()
+        if count > self._max_entries:
+            # Entries that expire first go first; entries that never expire go last
+            db.execute(
+                'DELETE FROM cache_entries WHERE cache_key IN ('
+                '  SELECT cache_key FROM cache_entries'
+                '  ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency if self._cull_frequency else count,),
+            )
+
+    # --- L1 (in-process LRU) ---
+
+    def _l1_enabled(self, key):
+        return self.l1_max_entries > 0 and not key.startswith(self.l1_exclude_prefixes)
+
+    def _l1_get(self, key, now):
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            value, expires, delta, l1_expires = entry
+            if l1_expires <= now or (expires is not None and expires <= now):
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return value, expires, delta
+
+    def _l1_set(self, key, value, expires, delta, now):
+        if not self._l1_enabled(key):
+            return
+        l1_expires = now + self.l1_timeout
+        if expires is not None:
+            l1_expires = min(l1_expires, expires)
+        with self._l1_lock:
+            self._l1[key] = (value, expires, delta, l1_expires)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key):
+        with self._l1_lock:
+            self._l1.pop(key, None)
+
+    # --- Both tiers ---
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _get_entry(self, key, now):
+        '''(value, expires, delta) from L1, else L2 (filling L1), else None'''
+        if self._l1_enabled(key):
+            entry = self._l1_get(key, now)
+            if entry is not None:
+                return entry
+        entry = self._l2_get(key, now)
+        if entry is not None:
+            self._l1_set(key, *entry, now)
+        return entry
+
+    def _store(self, key, value, expires, delta=0.0):
+        self._l2_set(key, value, expires, delta)
+        self._l1_set(key, value, expires, delta, time.time())
+
+    def get(self, key, default=None, version=None):
+        entry = self._get_entry(self._key(key, version), time.time())
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(self._key(key, version), value, self.get_backend_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expires = self.get_backend_timeout(timeout)
+        # Insert, or take over an expired row; atomic across processes
+        cursor = self._db().execute(
+            'INSERT INTO cache_entries (cache_key, value, expires, delta) VALUES (?, ?, ?, 0) '
+            'ON CONFLICT(cache_key) DO UPDATE SET '
+            '  value = excluded.value, expires = excluded.expires, delta = 0 '
+            'WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?',
+            (key, pickle.dumps(value, self.pickle_protocol), expires, time.time()),
+        )
+        if cursor.rowcount != 1:
+            return False
+        self._l1_set(key, value, expires, 0.0, time.time())
+        self._maybe_cull()
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._l1_delete(key)
+        cursor = self._db().execute(
+            'UPDATE cache_entries SET expires = ? '
+            'WHERE cache_key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self._l1_delete(key)
+        cursor = self._db().execute('DELETE FROM cache_entries WHERE cache_key = ?', (key,))
+        return cursor.rowcount == 1
+
+    def has_key(self, key, version=None):
+        return self._get_entry(self._key(key, version), time.time()) is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        db = self._db()
+        # BEGIN IMMEDIATE takes the write lock first, so read-modify-write is atomic
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            entry = self._l2_get(key, time.time())
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            value, expires, _ = entry
+            value += delta
+            db.execute(
+                'UPDATE cache_entries SET value = ? WHERE cache_key = ?',
+                (pickle.dumps(value, self.pickle_protocol), key),
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        self._l1_set(key, value, expires, 0.0, time.time())
+        return value
+
+    def clear(self):
+        with self._l1_lock:
+            self._l1.clear()
+        self._db().execute('DELETE FROM cache_entries')
+
+    def close(self, **kwargs):
+        # Connections are per thread and reused across requests
+        pass
+
+    # --- Stampede protection ---
+
+    def _refresh_early(self, expires, delta, now):
+        '''XFetch: True with a probability rising as expiry nears, scaled by compute time'''
+        if expires is None or not delta or not self.early_refresh_beta:
+            return False
+        return now - delta * self.early_refresh_beta * math.log(random.random() or 1e-12) >= expires
+
+    def _compute(self, key, default, expires_in):
+        started = time.time()
+        value = default() if callable(default) else default
+        finished = time.time()
+        if value is not None:
+            expires = None if expires_in is None else finished + expires_in
+            self._store(key, value, expires, finished - started)
+        return value
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expires = self.get_backend_timeout(timeout)
+        expires_in = None if expires is None else expires - time.time()
+        lock_key = key + ':lock'
+
+        now = time.time()
+        entry = self._get_entry(key, now)
+        if entry is not None:
+            value, entry_expires, delta = entry
+            # Early refresh by whoever wins the lock; everyone else keeps the value
+            if self._refresh_early(entry_expires, delta, now) and self._lock(lock_key):
+                try:
+                    return self._compute(key, default, expires_in)
+                finally:
+                    self._unlock(lock_key)
+            return value
+
+        # Miss: one computation per key, in this process and across workers
+        with self._compute_locks[hash(key) % _LOCK_STRIPES]:
+            entry = self._get_entry(key, time.time())
+            if entry is not None:
+                return entry[0]
+            if self._lock(lock_key):
+                try:
+                    return self._compute(key, default, expires_in)
+                finally:
+                    self._unlock(lock_key)
+
+            # Another worker is computing it, wait for its result
+            deadline = time.time() + self.lock_timeout
+            pause = 0.005
+            while time.time() < deadline:
+                time.sleep(pause)
+                pause = min(pause * 2, 0.1)
+                entry = self._l2_get(key, time.time())
+                if entry is not None:
+                    self._l1_set(key, *entry, time.time())
+                    return entry[0]
+            return self._compute(key, default, expires_in)
+
+    def _lock(self, lock_key):
+        cursor = self._db().execute(
+            'INSERT INTO cache_entries (cache_key, value, expires, delta) VALUES (?, ?, ?, 0) '
+            'ON CONFLICT(cache_key) DO UPDATE SET expires = excluded.expires '
+            'WHERE cache_entries.expires <= ?',
+            (lock_key, pickle.dumps(True), time.time() + self.lock_timeout, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def _unlock(self, lock_key):
+        self._db().execute('DELETE FROM cache_entries WHERE cache_key = ?', (lock_key,))
@@ -0,0 +1,66 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+# Message list pages are cached under a per-conversation version number that is
+# bumped whenever a message is created, edited or deleted. A write makes every
+# cached page of that conversation unreachable at once (no key scans, no
+# deletes); the old entries just expire. The timeout only bounds how long
+# unreachable pages stay in memory.
+MESSAGE_LIST_CACHE_TIMEOUT = 300
+
+
+def message_version_key(conversation_id):
+    return f'chats:messages:version:{conversation_id}'
+
+
+def _new_version():
+    # Versions start from the clock rather than 1, so a counter lost to eviction
+    # or a restart never comes back with a number old pages were cached under.
+    return time.time_ns()
+
+
+def get_message_version(conversation_id):
+    key = message_version_key(conversation_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _incr_version(conversation_id):
+    key = message_version_key(conversation_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def bump_message_version(conversation_id):
+    '''
+    Invalidates the cached message lists of a conversation.
+
+    Bumped right away, so the writer's next read is fresh, and again on commit:
+    a concurrent reader may have cached pre-commit rows under the intermediate
+    version.
+    '''
+    _incr_version(conversation_id)
+    transaction.on_commit(lambda: _incr_version(conversation_id))
+
+
+def message_list_cache_key(request, conversation_id):
+    '''
+    Key of one message list response: user, conversation version and the full
+    request URL (host and scheme included, since pagination links are absolute).
+    Query parameters are sorted so equivalent URLs share an entry.
+    '''
+    query = sorted(
+        (name, value) for name, values in request.GET.lists() for value in values
+    )
+    url = request.build_absolute_uri(request.path) + '?' + repr(query)
+    digest = hashlib.md5(url.encode()).hexdigest()
+    version = get_message_version(conversation_id)
+    return f'chats:messages:list:{conversation_id}:{version}:{request.user.pk}:{digest}'
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+# Primary key generation.
+#
+# UUIDv4 keys are random, so every INSERT lands on a random leaf of the primary
+# key B-tree: pages split all over the index, stay half full and must all be in
+# cache to keep writes fast. UUIDv7 (RFC 9562) keys start with a millisecond
+# timestamp, so new rows are appended to the right edge of the index like an
+# auto-increment key, while staying globally unique and unguessable.
+#
+# settings.CHATS_UUID_VERSION picks the generator (7 by default, 4 for the old
+# behaviour). Both kinds coexist in the same column, so switching needs no
+# rewrite of existing rows; see the rekey_messages command to also make
+# existing messages time ordered.
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+# 12-bit sub-millisecond counter (RFC 9562 "method 1"). It starts at a random
+# value no higher than this each millisecond, leaving room for at least 2048
+# ids per millisecond before borrowing from the next one.
+_COUNTER_SEED_MAX = 0x7FF
+
+
+def uuid7(timestamp_ms=None):
+    '''
+    Returns a UUIDv7. Ids generated by this process are strictly increasing.
+    Pass timestamp_ms to build an id for a past instant (no ordering guarantee
+    within that millisecond).
+    '''
+    global _last_ms, _counter
+    random_bits = int.from_bytes(os.urandom(10), 'big')
+    if timestamp_ms is None:
+        with _lock:
+            timestamp_ms = time.time_ns() // 1_000_000
+            if timestamp_ms > _last_ms:
+                _counter = (random_bits >> 64) & _COUNTER_SEED_MAX
+            else:
+                # Same millisecond (or the clock went back): keep counting from the last id
+                timestamp_ms = _last_ms
+                _counter += 1
+                if _counter > 0xFFF:
+                    timestamp_ms += 1
+                    _counter = 0
+            _last_ms = timestamp_ms
+            sequence = _counter
+    else:
+        sequence = (random_bits >> 64) & 0xFFF
+
+    value = (
+        (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | sequence << 64
+        | 0b10 << 62
+        | random_bits & 0x3FFF_FFFF_FFFF_FFFF
+    )
+    return uuid.UUID(int=value)
+
+
+def uuid7_timestamp_ms(value):
+    '''Milliseconds since the epoch encoded in a UUIDv7'''
+    return value.int >> 80
+
+
+def new_id():
+    '''Default for the UUID primary keys of User, Conversation and Message'''
+    if getattr(settings, 'CHATS_UUID_VERSION', 7) == 4:
+        return uuid.uuid4()
+    return uuid7()
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from chats.archive import ARCHIVE_AFTER, ARCHIVE_BATCH_SIZE, archive_messages
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves messages older than --older-than-days from the messages table into '
+        'the archive table, in batches. Safe to run while the site is up.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER.days)
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        moved = archive_messages(
+            older_than=timedelta(days=options['older_than_days']),
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} messages'))
@@ -0,0 +1,78 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from chats.models import Conversation, Message, User
+from chats.serializers import MessageSerializer, MessageValuesSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks MessageSerializer against the .values() read path on a generated '
+        'conversation. Everything runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            queryset = self.create_fixture(options['messages'])
+            self.run(queryset, options['repeat'])
+            transaction.set_rollback(True)
+
+    def create_fixture(self, count):
+        users = User.objects.bulk_create(
+            User(email=f'bench-{i}@example.com', first_name='Bench', last_name=str(i))
+            for i in range(10)
+        )
+        conversation = Conversation.objects.create(title='Benchmark')
+        conversation.participants.set(users)
+        start = timezone.now() - timedelta(days=1)
+        Message.objects.bulk_create(
+            (
+                Message(
+                    sender=users[i % len(users)],
+                    chat=conversation,
+                    message_body=f'Benchmark message number {i}',
+                    sent_at=start + timedelta(milliseconds=i),
+                )
+                for i in range(count)
+            ),
+            batch_size=500,
+        )
+        return Message.objects.filter(chat=conversation).order_by('sent_at', 'message_id')
+
+    def run(self, queryset, repeat):
+        renderer = JSONRenderer()
+        fast = MessageValuesSerializer()
+
+        def model_serializer():
+            return MessageSerializer(queryset.select_related('sender'), many=True).data
+
+        def values_serializer():
+            return fast.serialize(fast.values(queryset))
+
+        if renderer.render(model_serializer()) != renderer.render(values_serializer()):
+            self.stderr.write(self.style.ERROR('Outputs differ, aborting benchmark'))
+            return
+
+        results = {}
+        for name, func in (('MessageSerializer', model_serializer), ('MessageValuesSerializer', values_serializer)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started)
+            results[name] = min(timings)
+            self.stdout.write(f'{name:<24} best of {repeat}: {results[name] * 1000:8.1f} ms')
+
+        speedup = results['MessageSerializer'] / results['MessageValuesSerializer']
+        self.stdout.write(self.style.SUCCESS(
+            f'{queryset.count()} messages, identical JSON, {speedup:.1f}x faster'
+        ))
@@ -0,0 +1,182 @@
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+from django.db.utils import load_backend
+from django.utils import timezone
+
+# Profiles compared: Django's SQLite defaults (rollback journal, synchronous=FULL,
+# deferred transactions, 5s lock timeout) and the one in settings.DATABASES,
+# with --journal-mode (WAL by default; opt-in for the project database).
+DEFAULT_PROFILE = {'OPTIONS': {}}
+
+SCHEMA = [
+    'CREATE TABLE bench_conversation ('
+    ' conversation_id char(32) NOT NULL PRIMARY KEY,'
+    ' message_count integer NOT NULL,'
+    ' last_message_at datetime NULL)',
+    'CREATE TABLE bench_message ('
+    ' message_id char(32) NOT NULL PRIMARY KEY,'
+    ' chat_id char(32) NOT NULL REFERENCES bench_conversation (conversation_id),'
+    ' message_body text NOT NULL,'
+    ' sent_at datetime NOT NULL)',
+    'CREATE INDEX bench_message_chat_sent ON bench_message (chat_id, sent_at)',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks concurrent reads and writes on a scratch SQLite database with '
+        "Django's default connection settings and with the profile configured in "
+        'settings.DATABASES (WAL, busy_timeout, ...). Nothing touches the project database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--conversations', type=int, default=100)
+        parser.add_argument('--messages', type=int, default=50_000, help='Seeded before the run')
+        parser.add_argument('--journal-mode', default='WAL',
+                            help='Journal mode of the tuned scratch database')
+
+    def handle(self, *args, **options):
+        tuned = dict(settings.DATABASES['default'])
+        tuned_options = dict(tuned.get('OPTIONS', {}))
+        journal_mode = options['journal_mode']
+        tuned_options['init_command'] = ';'.join(filter(None, (
+            f'PRAGMA journal_mode={journal_mode}',
+            tuned_options.get('init_command'),
+            # As settings.py does when SQLITE_JOURNAL_MODE=WAL
+            'PRAGMA synchronous=NORMAL'
+            if journal_mode.upper() == 'WAL' and 'SQLITE_SYNCHRONOUS' not in os.environ else '',
+        )))
+        tuned['OPTIONS'] = tuned_options
+        with tempfile.TemporaryDirectory() as directory:
+            for name, profile in (('default', DEFAULT_PROFILE), ('tuned', tuned)):
+                path = os.path.join(directory, f'{name}.sqlite3')
+                self.run(name, self.settings_dict(profile, path), options)
+
+    def settings_dict(self, profile, path):
+        settings_dict = dict(connections['default'].settings_dict)
+        settings_dict.update(
+            NAME=path,
+            OPTIONS=dict(profile.get('OPTIONS', {})),
+            CONN_MAX_AGE=0,
+            CONN_HEALTH_CHECKS=False,
+        )
+        return settings_dict
+
+    def connect(self, alias, settings_dict):
+        '''Installs a connection to the scratch database as `alias` in this thread'''
+        backend = load_backend(settings_dict['ENGINE'])
+        connections[alias] = backend.DatabaseWrapper(settings_dict, alias)
+        return connections[alias]
+
+    def run(self, name, settings_dict, options):
+        alias = f'bench_{name}'
+        conversations = [uuid.uuid4().hex for _ in range(options['conversations'])]
+        connection = self.connect(alias, settings_dict)
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.executemany(
+                'INSERT INTO bench_conversation VALUES (%s, 0, NULL)',
+                [(conversation,) for conversation in conversations],
+            )
+            now = timezone.now()
+            cursor.executemany(
+                'INSERT INTO bench_message VALUES (%s, %s, %s, %s)',
+                [
+                    (uuid.uuid4().hex, random.choice(conversations), 'Seed message', now)
+                    for _ in range(options['messages'])
+                ],
+            )
+        connection.close()
+
+        stop = threading.Event()
+        results = {'reads': [], 'writes': [], 'errors': 0}
+        results_lock = threading.Lock()
+
+        def worker(operation, kind):
+            self.connect(alias, settings_dict)
+            latencies, errors = [], 0
+            try:
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    try:
+                        operation(random.choice(conversations))
+                    except DatabaseError:
+                        errors += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connections[alias].close()
+            with results_lock:
+                results[kind].extend(latencies)
+                results['errors'] += errors
+
+        def read(conversation):
+            # A message list page, as the message list endpoint runs it
+            with connections[alias].cursor() as cursor:
+                cursor.execute(
+                    'SELECT message_id, message_body, sent_at FROM bench_message '
+                    'WHERE chat_id = %s ORDER BY sent_at DESC, message_id DESC LIMIT 20',
+                    [conversation],
+                )
+                cursor.fetchall()
+
+        def write(conversation):
+            # A message post: read the conversation, insert, update its summary
+            with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                cursor.execute(
+                    'SELECT message_count FROM bench_conversation WHERE conversation_id = %s',
+                    [conversation],
+                )
+                count = cursor.fetchone()[0]
+                now = timezone.now()
+                cursor.execute(
+                    'INSERT INTO bench_message VALUES (%s, %s, %s, %s)',
+                    [uuid.uuid4().hex, conversation, 'Benchmark message', now],
+                )
+                cursor.execute(
+                    'UPDATE bench_conversation SET message_count = %s, last_message_at = %s '
+                    'WHERE conversation_id = %s',
+                    [count + 1, now, conversation],
+                )
+
+        threads = [
+            threading.Thread(target=worker, args=(read, 'reads'))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=(write, 'writes'))
+            for _ in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        seconds = options['seconds']
+        self.stdout.write(
+            f'{name:>7}: {len(results["reads"]) / seconds:9.0f} reads/s '
+            f'(p99 {self.p99(results["reads"]):7.1f} ms), '
+            f'{len(results["writes"]) / seconds:7.0f} writes/s '
+            f'(p99 {self.p99(results["writes"]):7.1f} ms), '
+            f'{results["errors"]} failed (database is locked)'
+        )
+
+    @staticmethod
+    def p99(latencies):
+        if not latencies:
+            return float('nan')
+        latencies.sort()
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
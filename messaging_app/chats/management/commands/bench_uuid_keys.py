@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chats.ids import uuid7
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks insert rate and primary key index size of UUIDv4 against UUIDv7 '
+        'keys on a scratch SQLite database with the chats_message layout (UUIDs are '
+        'stored as char(32) like Django does). Nothing touches the project database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--cache-mb', type=int, default=2,
+            help='SQLite page cache; random keys suffer once the index outgrows it',
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, generate in (('uuid4', uuid.uuid4), ('uuid7', uuid7)):
+                path = os.path.join(directory, f'{name}.sqlite3')
+                self.run(name, generate, path, options)
+
+    def run(self, name, generate, path, options):
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(f'PRAGMA cache_size=-{options["cache_mb"] * 1024}')
+        connection.execute(
+            'CREATE TABLE chats_message ('
+            ' message_id char(32) NOT NULL PRIMARY KEY,'
+            ' chat_id char(32) NOT NULL,'
+            ' message_body text NOT NULL,'
+            ' sent_at datetime NOT NULL)'
+        )
+        chat_id = uuid.uuid4().hex
+        sent_at = timezone.now().isoformat()
+        rows, batch_size = options['rows'], options['batch_size']
+
+        elapsed = 0.0
+        last_tenth_elapsed, last_tenth_rows = 0.0, 0
+        for start in range(0, rows, batch_size):
+            count = min(batch_size, rows - start)
+            # Ids are generated outside the timed section: only the database is measured
+            batch = [(generate().hex, chat_id, 'Benchmark message', sent_at) for _ in range(count)]
+            started = time.perf_counter()
+            connection.execute('BEGIN')
+            connection.executemany('INSERT INTO chats_message VALUES (?, ?, ?, ?)', batch)
+            connection.execute('COMMIT')
+            batch_elapsed = time.perf_counter() - started
+            elapsed += batch_elapsed
+            if start >= rows * 0.9:
+                last_tenth_elapsed += batch_elapsed
+                last_tenth_rows += count
+
+        index_bytes, fill = self.index_size(connection)
+        connection.close()
+        fill = f', pages {fill:.0%} full' if fill is not None else ''
+        self.stdout.write(
+            f'{name}: {rows / elapsed:10.0f} rows/s overall, '
+            f'{last_tenth_rows / max(last_tenth_elapsed, 1e-9):10.0f} rows/s over the last 10%, '
+            f'primary key index {index_bytes / 2**20:7.1f} MiB{fill}'
+        )
+
+    def index_size(self, connection):
+        '''
+        (bytes, fill ratio) of the primary key index from dbstat, or the database
+        file size and None when SQLite was built without dbstat.
+        '''
+        try:
+            size, unused = connection.execute(
+                'SELECT SUM(pgsize), SUM(unused) FROM dbstat '
+                "WHERE name = 'sqlite_autoindex_chats_message_1'"
+            ).fetchone()
+            return size, 1 - unused / size
+        except sqlite3.OperationalError:
+            page_size, = connection.execute('PRAGMA page_size').fetchone()
+            page_count, = connection.execute('PRAGMA page_count').fetchone()
+            return page_size * page_count, None
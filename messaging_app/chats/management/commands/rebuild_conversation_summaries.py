@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from chats.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes last_message_at, message_count and the last message preview '
+        'of conversations from the messages table, repairing any drift.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'conversation_ids',
+            nargs='*',
+            help='Only rebuild these conversations (default: all)',
+        )
+
+    def handle(self, *args, **options):
+        queryset = Conversation.objects.all()
+        if options['conversation_ids']:
+            queryset = queryset.filter(pk__in=options['conversation_ids'])
+
+        updated = queryset.refresh_summary()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {updated} conversation summaries'))
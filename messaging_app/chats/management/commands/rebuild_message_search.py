@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from chats.search import FTS_TABLE, rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the message full-text index (SQLite FTS5) and its sync triggers if '
+        'missing, then rebuilds it from chats_message. Run it on an existing '
+        'db.sqlite3 or after a VACUUM.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias to rebuild the index on',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'Full-text index is only available on SQLite, search falls back to icontains'
+            ))
+            return
+
+        rebuild_index(connection)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {FTS_TABLE}'))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, UUIDField, Value, When
+
+from chats.caching import bump_message_version
+from chats.ids import uuid7
+from chats.models import ArchivedMessage, Message
+from chats.pagination import Cursor, filter_by_cursor
+
+
+class Command(BaseCommand):
+    help = (
+        'Gives existing messages (hot and archived) time-ordered UUIDv7 ids built '
+        'from their sent_at, so old rows sort like new ones. Optional: UUIDv4 and '
+        'UUIDv7 ids work side by side. Clients holding old message ids (URLs, cursors) '
+        'will see them change, run it in a maintenance window. Users and '
+        'conversations keep their ids: they are referenced by tokens, URLs and '
+        'foreign keys across tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in (Message, ArchivedMessage):
+            rekeyed = self.rekey(model, options['batch_size'])
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {rekeyed} rekeyed')
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def rekey(self, model, batch_size):
+        rekeyed = 0
+        cursor = None
+        while True:
+            rows = list(
+                filter_by_cursor(model.objects.all(), cursor)
+                .values_list('message_id', 'sent_at', 'chat_id')[:batch_size]
+            )
+            if not rows:
+                return rekeyed
+            # Keyset on the old ids: rows rekeyed in this batch may come around
+            # again (already version 7, skipped), none can be skipped
+            last_id, last_sent_at, _ = rows[-1]
+            cursor = Cursor(reverse=False, sent_at=last_sent_at, message_id=last_id)
+
+            new_ids = {
+                message_id: uuid7(int(sent_at.timestamp() * 1000))
+                for message_id, sent_at, _ in rows
+                if message_id.version != 7
+            }
+            if not new_ids:
+                continue
+            with transaction.atomic():
+                model.objects.filter(pk__in=new_ids).update(
+                    message_id=Case(
+                        *[When(pk=old, then=Value(new)) for old, new in new_ids.items()],
+                        output_field=UUIDField(),
+                    )
+                )
+                # Cached message lists hold the old ids
+                for chat_id in {chat_id for message_id, _, chat_id in rows if message_id in new_ids}:
+                    bump_message_version(chat_id)
+            rekeyed += len(new_ids)
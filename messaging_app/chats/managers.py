@@ -0,0 +1,182 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import models
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Substr
+from django.utils import timezone
+
+# Number of characters of the last message kept on the conversation for the inbox
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+
+
+# Watermark used for participants who never marked anything read
+NEVER_READ = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def message_preview(body):
+    return body[:LAST_MESSAGE_PREVIEW_LENGTH]
+
+
+class ConversationQuerySet(models.QuerySet):
+    '''Query helpers for the Conversation model'''
+
+    def with_list_summary(self):
+        '''
+        Loads everything the inbox (conversation list) needs in one query.
+        Message count and the last message are denormalized columns maintained on
+        write (see record_messages); the participant count is a correlated subquery
+        and participants are prefetched with one extra query for the whole page.
+
+        The participant count isn't a Count() over a join because the list is already
+        filtered on participants=user, which would collapse a joined count to 1.
+        '''
+        from .models import User
+
+        through = self.model.participants.through
+        participant_count = (
+            through.objects.filter(conversation=OuterRef('pk'))
+            .order_by()
+            .values('conversation')
+            .annotate(total=Count('*'))
+            .values('total')
+        )
+
+        return self.annotate(
+            num_participants=Coalesce(
+                Subquery(participant_count, output_field=IntegerField()), 0
+            ),
+        ).select_related('last_message_sender').prefetch_related(
+            Prefetch(
+                'participants',
+                queryset=User.objects.only(
+                    'user_id', 'email', 'first_name', 'last_name', 'role'
+                ),
+            )
+        )
+
+    def with_unread_count(self, user):
+        '''
+        Annotates `unread_count`: messages from other participants sent after the
+        user's read watermark. Each count is a range scan of Index(chat, sent_at)
+        starting at the watermark, so it costs what is unread, not the history.
+        Archived messages are never counted as unread.
+        '''
+        from .models import ConversationReadState, Message
+
+        last_read_at = ConversationReadState.objects.filter(
+            conversation=OuterRef(OuterRef('pk')), user=user
+        ).values('last_read_at')[:1]
+        unread = (
+            Message.objects.filter(
+                chat=OuterRef('pk'),
+                sent_at__gt=Coalesce(Subquery(last_read_at), Value(NEVER_READ)),
+            )
+            .exclude(sender=user)
+            .order_by()
+            .values('chat')
+            .annotate(total=Count('*'))
+            .values('total')
+        )
+        return self.annotate(
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+        )
+
+    def order_by_activity(self):
+        '''
+        Most recently active conversations first, then conversations without
+        messages (whatever the database's default NULL order), newest first.
+        Served by the last_message_at index (DESC already sorts NULLs last on SQLite).
+        '''
+        return self.order_by(F('last_message_at').desc(nulls_last=True), '-created_at')
+
+    def touch(self):
+        '''Marks conversations as changed (see Conversation.updated_at)'''
+        return self.update(updated_at=timezone.now())
+
+    def record_messages(self, messages):
+        '''
+        Folds newly created messages into the activity summary with a single UPDATE.
+
+        message_count is incremented in the database (F expression) and the last
+        message fields only move forward, so concurrent writers can't lose counts
+        or roll the preview back to an older message. Call inside the same
+        transaction as the message INSERT.
+        '''
+        if not messages:
+            return 0
+        newest = max(messages, key=lambda message: (message.sent_at, message.message_id))
+        is_newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=newest.sent_at)
+
+        def if_newer(value, field):
+            return Case(When(is_newer, then=Value(value)), default=F(field))
+
+        return self.update(
+            updated_at=timezone.now(),
+            message_count=F('message_count') + len(messages),
+            last_message_at=if_newer(newest.sent_at, 'last_message_at'),
+            last_message_preview=if_newer(
+                message_preview(newest.message_body), 'last_message_preview'
+            ),
+            last_message_sender=if_newer(newest.sender_id, 'last_message_sender'),
+        )
+
+    def refresh_summary(self):
+        '''
+        Recomputes the activity summary from the messages table (and the archive,
+        for conversations whose older messages were archived) in one UPDATE.
+        Used after edits/deletes and by the rebuild_conversation_summaries command
+        to repair drift.
+        '''
+        from .models import ArchivedMessage, Message
+
+        def message_count(model):
+            return Coalesce(
+                Subquery(
+                    model.objects.filter(chat=OuterRef('pk'))
+                    .order_by()
+                    .values('chat')
+                    .annotate(total=Count('*'))
+                    .values('total'),
+                    output_field=IntegerField(),
+                ),
+                0,
+            )
+
+        def last_message(model):
+            return model.objects.filter(chat=OuterRef('pk')).order_by('-sent_at', '-message_id')
+
+        def preview(model):
+            return Subquery(
+                last_message(model).annotate(
+                    preview=Substr('message_body', 1, LAST_MESSAGE_PREVIEW_LENGTH)
+                ).values('preview')[:1]
+            )
+
+        # Archived messages are all older than hot ones: the archive only supplies
+        # the last message when the hot table has none
+        return self.update(
+            updated_at=timezone.now(),
+            message_count=message_count(Message) + message_count(ArchivedMessage),
+            last_message_at=Coalesce(
+                Subquery(last_message(Message).values('sent_at')[:1]),
+                Subquery(last_message(ArchivedMessage).values('sent_at')[:1]),
+            ),
+            last_message_preview=Coalesce(
+                preview(Message), preview(ArchivedMessage), Value('')
+            ),
+            last_message_sender=Coalesce(
+                Subquery(last_message(Message).values('sender')[:1]),
+                Subquery(last_message(ArchivedMessage).values('sender')[:1]),
+            ),
+        )
@@ -0,0 +1,110 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Conversation
+
+# How long a membership answer may be served from the shared cache.
+# Entries are deleted on participant changes (see signals.py), the timeout
+# only bounds how long a missed invalidation could live.
+MEMBERSHIP_CACHE_TIMEOUT = 60
+
+# Attribute used to memoize answers on the current HttpRequest
+REQUEST_CACHE_ATTR = '_chats_membership'
+
+
+def membership_cache_key(conversation_id, user_id):
+    return f'chats:membership:{conversation_id}:{user_id}'
+
+
+def membership_changed_key(user_id):
+    return f'chats:membership:changed:{user_id}'
+
+
+def _normalize_id(value):
+    '''Returns a UUID, or None when the value is not a valid UUID (e.g. a bad URL kwarg)'''
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def is_participant(user, conversation_id, request=None):
+    '''
+    Answers "is user in conversation" without loading the participant list.
+
+    Lookup order:
+    1. the current request (so permission checks and views share one answer)
+    2. the shared cache
+    3. a single indexed EXISTS on the participants through table
+    '''
+    if user is None or not user.is_authenticated:
+        return False
+    conversation_id = _normalize_id(conversation_id)
+    if conversation_id is None:
+        return False
+
+    request_cache = None
+    if request is not None:
+        # DRF's Request proxies reads to the HttpRequest, so store on the latter
+        http_request = getattr(request, '_request', request)
+        request_cache = http_request.__dict__.setdefault(REQUEST_CACHE_ATTR, {})
+        if conversation_id in request_cache:
+            return request_cache[conversation_id]
+
+    key = membership_cache_key(conversation_id, user.pk)
+    answer = cache.get(key)
+    if answer is None:
+        answer = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id, user_id=user.pk
+        ).exists()
+        cache.set(key, answer, MEMBERSHIP_CACHE_TIMEOUT)
+
+    if request_cache is not None:
+        request_cache[conversation_id] = answer
+    return answer
+
+
+def invalidate_membership(conversation_id, user_ids):
+    '''
+    Drops cached answers after participants were added to or removed from a
+    conversation: right away for the current transaction, and again once it
+    commits, since a concurrent request may have cached the old answer from the
+    not yet committed state meanwhile.
+    '''
+    keys = [membership_cache_key(conversation_id, user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+        touch_membership(user_ids)
+
+
+def _set_membership_changed(user_ids):
+    now = timezone.now()
+    cache.set_many({membership_changed_key(user_id): now for user_id in user_ids}, timeout=None)
+
+
+def touch_membership(user_ids):
+    '''Records that the users joined or left a conversation (now and on commit)'''
+    user_ids = list(user_ids)
+    _set_membership_changed(user_ids)
+    transaction.on_commit(lambda: _set_membership_changed(user_ids))
+
+
+def membership_changed_at(user_id):
+    '''
+    When the user last joined or left a conversation. Leaving removes a
+    conversation from the user's Max(updated_at), so conversation list
+    validators take this into account as well. A timestamp lost to eviction or a
+    restart comes back as "now": validators may move forward, never backwards.
+    '''
+    key = membership_changed_key(user_id)
+    changed_at = cache.get(key)
+    if changed_at is None:
+        cache.add(key, timezone.now(), timeout=None)
+        changed_at = cache.get(key)
+    return changed_at
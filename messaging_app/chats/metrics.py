@@ -0,0 +1,349 @@
+import bisect
+import glob
+import json
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import Resolver404, resolve
+
+# --- Request metrics ---
+# MetricsMiddleware records, per route pattern (e.g. "api/chats/<chat_pk>/messages/")
+# and method: a latency histogram, response counts by status, and the number and
+# time of database queries; plus the number of requests in flight.
+#
+# Each worker process aggregates in memory (a few counters per route) and a
+# background thread writes a snapshot to settings.METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds (one JSON file per pid, replaced atomically).
+# The /metrics/ endpoint merges every worker's snapshot into the Prometheus
+# text format. Counters of workers that exited stay in the total (Prometheus
+# counters never go down); empty METRICS_DIR when the server is restarted.
+#
+# Label values are bounded: routes are URL patterns (not paths) and methods
+# outside STANDARD_METHODS are recorded as "other".
+
+# Upper bounds (seconds) of the request latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the queries-per-request buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+# Methods recorded as they are; anything else (any string a client sends) is
+# recorded as "other", so clients can't create new label values
+STANDARD_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+OTHER_METHOD = 'other'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # Not cumulative; +Inf is `count`
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, total, count):
+        for index, value in enumerate(counts):
+            self.counts[index] += value
+        self.sum += total
+        self.count += count
+
+    def dump(self):
+        return [self.counts, self.sum, self.count]
+
+
+class Registry:
+    '''Metrics of one process, or the merge of several snapshots'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.responses = {}       # (route, method, status) -> count
+        self.latency = {}         # (route, method) -> Histogram
+        self.query_counts = {}    # (route, method) -> Histogram of queries per request
+        self.query_seconds = {}   # (route, method) -> total query time
+
+    def observe(self, route, method, status, seconds, queries, query_seconds):
+        key = (route, method)
+        with self.lock:
+            status_key = (route, method, status)
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.query_counts[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.query_seconds[key] = 0.0
+            self.latency[key].observe(seconds)
+            self.query_counts[key].observe(queries)
+            self.query_seconds[key] += query_seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'in_flight': self.in_flight,
+                'responses': [[*key, value] for key, value in self.responses.items()],
+                'routes': [
+                    [*key, self.latency[key].dump(), self.query_counts[key].dump(),
+                     self.query_seconds[key]]
+                    for key in self.latency
+                ],
+            }
+
+    def merge(self, snapshot, include_in_flight=True):
+        if include_in_flight:
+            self.in_flight += snapshot['in_flight']
+        for route, method, status, value in snapshot['responses']:
+            key = (route, method, status)
+            self.responses[key] = self.responses.get(key, 0) + value
+        for route, method, latency, query_counts, query_seconds in snapshot['routes']:
+            key = (route, method)
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.query_counts[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.query_seconds[key] = 0.0
+            self.latency[key].merge(*latency)
+            self.query_counts[key].merge(*query_counts)
+            self.query_seconds[key] += query_seconds
+
+
+registry = Registry()
+
+
+# --- Sharing between workers ---
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def write_snapshot():
+    directory = metrics_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(temporary, path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    '''Registry merging this process and every worker snapshot in METRICS_DIR'''
+    merged = Registry()
+    directory = metrics_dir()
+    if not directory:
+        merged.merge(registry.snapshot())
+        return merged
+    write_snapshot()
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue  # Removed or being replaced
+        merged.merge(snapshot, include_in_flight=_pid_alive(snapshot['pid']))
+    return merged
+
+
+class _Flusher:
+    '''Writes this worker's snapshot periodically, from a thread started after fork'''
+
+    def __init__(self):
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self):
+        if self.pid == os.getpid() or not metrics_dir():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                threading.Thread(target=self.run, name='metrics-flusher', daemon=True).start()
+                self.pid = os.getpid()
+
+    def run(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+
+
+_flusher = _Flusher()
+
+
+# --- Recording ---
+
+class QueryTimer:
+    '''Number and time of the database queries of one request'''
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Timer of the request being handled. A context variable rather than a wrapper
+# installed per request: the query wrapper is installed once per connection.
+_query_timer = ContextVar('metrics_query_timer', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.seconds += time.perf_counter() - started
+        timer.count += 1
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# On every connection, as it is opened (in whichever thread)
+connection_created.connect(install_query_recorder, dispatch_uid='chats.metrics')
+
+
+def method_of(request):
+    return request.method if request.method in STANDARD_METHODS else OTHER_METHOD
+
+
+# Named groups of regex routes (DRF routers): "(?P<chat_pk>[^/.]+)" -> "<chat_pk>"
+_NAMED_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # Answered by a middleware before URL resolution (e.g. 429, 403)
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return UNMATCHED_ROUTE
+    if not match.route:
+        return UNMATCHED_ROUTE
+    return _NAMED_GROUP.sub(r'<\1>', match.route).replace('^', '').replace('$', '')
+
+
+class MetricsMiddleware:
+    '''
+    Records latency, status and database queries of every request (see
+    chats/metrics.py). First in MIDDLEWARE, so other middleware is included.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        _flusher.ensure_started()
+        timer = QueryTimer()
+        token = _query_timer.set(timer)
+        with registry.lock:
+            registry.in_flight += 1
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            _query_timer.reset(token)
+            with registry.lock:
+                registry.in_flight -= 1
+            registry.observe(
+                route_of(request), method_of(request), status, elapsed, timer.count, timer.seconds
+            )
+
+
+# --- Prometheus text format ---
+
+def _labels(**labels):
+    escaped = (
+        '{}="{}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        )
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _histogram_lines(name, histogram, **labels):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}'
+    yield f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}'
+    yield f'{name}_sum{_labels(**labels)} {histogram.sum}'
+    yield f'{name}_count{_labels(**labels)} {histogram.count}'
+
+
+def render(merged):
+    lines = [
+        '# HELP http_requests_in_flight Requests being processed.',
+        '# TYPE http_requests_in_flight gauge',
+        f'http_requests_in_flight {merged.in_flight}',
+        '# HELP http_responses_total Responses by route, method and status.',
+        '# TYPE http_responses_total counter',
+    ]
+    for (route, method, status), value in sorted(merged.responses.items()):
+        lines.append(
+            f'http_responses_total{_labels(route=route, method=method, status=status)} {value}'
+        )
+
+    lines += [
+        '# HELP http_request_duration_seconds Request latency by route and method.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (route, method), histogram in sorted(merged.latency.items()):
+        lines += _histogram_lines(
+            'http_request_duration_seconds', histogram, route=route, method=method
+        )
+
+    lines += [
+        '# HELP db_queries_per_request Database queries per request by route and method.',
+        '# TYPE db_queries_per_request histogram',
+    ]
+    for (route, method), histogram in sorted(merged.query_counts.items()):
+        lines += _histogram_lines('db_queries_per_request', histogram, route=route, method=method)
+
+    lines += [
+        '# HELP db_query_seconds_total Time spent in database queries by route and method.',
+        '# TYPE db_query_seconds_total counter',
+    ]
+    for (route, method), seconds in sorted(merged.query_seconds.items()):
+        lines.append(f'db_query_seconds_total{_labels(route=route, method=method)} {seconds}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,20 @@
+from . import routers
+
+
+class ReadYourWritesMiddleware:
+    '''
+    Scopes database routing to the request (see chats/routers.py): once the
+    request writes, its reads go to the primary, and so do the user's next
+    requests for a short while.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routers.request_scope() as state:
+            response = self.get_response(request)
+            if state.wrote:
+                # DRF sets request.user on the underlying request once it authenticates
+                routers.remember_write(getattr(request, 'user', None))
+        return response
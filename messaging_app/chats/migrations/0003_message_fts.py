@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    from chats.search import rebuild_index
+
+    # Creates the FTS5 table + triggers and indexes messages that already exist
+    rebuild_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    from chats.search import drop_index
+
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_conversation_activity_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
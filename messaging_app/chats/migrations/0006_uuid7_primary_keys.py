@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+import chats.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_message_archive'),
+    ]
+
+    # The new default is generated in Python, nothing changes in the database.
+    # State-only: on SQLite a real AlterField of a primary key rebuilds the table,
+    # which would copy every row and drop the full-text search triggers on
+    # chats_message. Existing rows keep their UUIDv4 ids.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='conversation_id',
+                    field=models.UUIDField(default=chats.ids.new_id, editable=False, primary_key=True, serialize=False, verbose_name='Conversation ID'),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='message_id',
+                    field=models.UUIDField(default=chats.ids.new_id, editable=False, primary_key=True, serialize=False, verbose_name='Message ID'),
+                ),
+                migrations.AlterField(
+                    model_name='user',
+                    name='user_id',
+                    field=models.UUIDField(default=chats.ids.new_id, editable=False, primary_key=True, serialize=False, verbose_name='User ID'),
+                ),
+            ],
+        ),
+    ]
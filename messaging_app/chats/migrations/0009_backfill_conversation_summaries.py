@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def backfill_summaries(apps, schema_editor):
+    from chats.models import Conversation
+
+    # 0002 added the activity summary columns empty: conversations created before
+    # it had no message_count or last message until they got a new message
+    Conversation.objects.using(schema_editor.connection.alias).refresh_summary()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_message_sent_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,3 @@
-import uuid
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -8,6 +7,9 @@ from django.core.validators import RegexValidator
 from django.db import models
 from django.utils import timezone
 
+from .ids import new_id
+from .managers import LAST_MESSAGE_PREVIEW_LENGTH, ConversationQuerySet
+
 # --- Custom User Manager (Required for AbstractBaseUSer)
 
 
@@ -51,7 +53,7 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     # user_id (Primary Keys, UUID, Indexed)
     user_id = models.UUIDField(
-        primary_key=True, default=uuid.uuid4, editable=False, verbose_name="User ID"
+        primary_key=True, default=new_id, editable=False, verbose_name="User ID"
     )
 
     # email (VARCHAR, UNIQUE, NOT NULL)
@@ -106,7 +108,7 @@ class Conversation(models.Model):
     '''Rep a chat conversation between multiple user'''
     conversation_id = models.UUIDField(
         primary_key=True,
-        default=uuid.uuid4,
+        default=new_id,
         editable=False,
         verbose_name='Conversation ID'
     )
@@ -115,14 +117,41 @@ class Conversation(models.Model):
         related_name='conversations',
         verbose_name='Participants'
     )
-    created_at = models.CharField(
+    created_at = models.DateTimeField(
         default=timezone.now,
         editable=False
     )
+    # Bumped on any change visible in the conversation list: edits, new or edited
+    # messages, participant changes. Drives ETag/Last-Modified and delta sync.
+    updated_at = models.DateTimeField(auto_now=True)
     title = models.CharField(
         max_length=255, blank=True, null=True
     )
 
+    # Activity summary, denormalized from Message and maintained on write
+    # (ConversationQuerySet.record_messages) so the inbox can be ordered by
+    # recent activity without aggregating over the messages table.
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    last_message_preview = models.CharField(
+        max_length=LAST_MESSAGE_PREVIEW_LENGTH, blank=True, default='', editable=False
+    )
+    last_message_sender = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        editable=False,
+        verbose_name='Last message sender'
+    )
+
+    # sent_at of the newest message moved to ArchivedMessage (None: nothing archived).
+    # Message lists only read the archive when a page reaches back past it.
+    archived_until = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ConversationQuerySet.as_manager()
+
     def __str__(self):
         if self.title:
             return self.title
@@ -133,13 +162,17 @@ class Conversation(models.Model):
         verbose_name_plural = 'Conversations'
         # Ensure that the most recent chats are listed first
         ordering = ['-created_at']
+        indexes = [
+            # Inbox ordering by recent activity
+            models.Index(fields=['-last_message_at']),
+        ]
 
 # 3. --- Message Model ---
 class Message(models.Model):
     '''Rep a single message sent within a conversation'''
     message_id = models.UUIDField(
         primary_key=True,
-        default= uuid.uuid4,
+        default= new_id,
         editable=False,
         verbose_name='Message ID'
     )
@@ -168,9 +201,86 @@ class Message(models.Model):
         ordering = ['sent_at']
         # Add index for fast lookup by conversation and sender
         indexes = [
-            models.Index(fields=['chat', 'sent_At']),
-            models.Index(fields=['sender'])
+            models.Index(fields=['chat', 'sent_at']),
+            models.Index(fields=['sender']),
+            # archive_messages() takes the oldest messages first, across conversations
+            models.Index(fields=['sent_at', 'message_id']),
+        ]
+
+    def __str__(self):
+        return f'Message from {self.sender.email} in Chat {self.chat.conversation_id}'
+
+
+# 4. --- Archived Message Model ---
+class ArchivedMessage(models.Model):
+    '''
+    A message moved out of the hot Message table by the archive_messages command
+    (see chats/archive.py). Same columns as Message, so both tables can be read
+    with the same serializers.
+    '''
+    message_id = models.UUIDField(
+        primary_key=True,
+        editable=False,
+        verbose_name='Message ID'
+    )
+    sender = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+        verbose_name='Sender'
+    )
+    chat = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+        verbose_name='Conversation'
+    )
+    message_body = models.TextField()
+    sent_at = models.DateTimeField(editable=False)
+
+    class Meta:
+        verbose_name = 'Archived message'
+        verbose_name_plural = 'Archived messages'
+        ordering = ['sent_at']
+        indexes = [
+            models.Index(fields=['chat', 'sent_at']),
+        ]
+
+    def __str__(self):
+        return f'Archived message {self.message_id} in Chat {self.chat_id}'
+
+
+# 5. --- Read State Model ---
+class ConversationReadState(models.Model):
+    '''
+    How far a participant has read a conversation: every message sent at or
+    before last_read_at counts as read. Marking a backlog read moves this
+    watermark (one row) instead of flagging messages. No row means nothing read.
+    '''
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='read_states',
+        verbose_name='Conversation'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='read_states',
+        verbose_name='User'
+    )
+    last_read_at = models.DateTimeField()
+    # Set when the watermark moves, feeds delta sync for the user's other devices
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Read state'
+        verbose_name_plural = 'Read states'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['conversation', 'user'], name='unique_conversation_read_state'
+            ),
         ]
 
     def __str__(self):
-        return f'Message from {self.sender.email} in Chat {self.chat.conversation_id}'
\ No newline at end of file
+        return f'{self.user_id} read {self.conversation_id} up to {self.last_read_at}'
@@ -0,0 +1,269 @@
+import uuid
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from urllib import parse
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# A position in the (sent_at, message_id) ordering of a conversation.
+# - reverse: True when paging towards older messages ("previous" links)
+# - sent_at: timestamp of the last message seen on the page we came from
+# - message_id: tie-breaker for messages sharing the same sent_at. None makes the
+#   bound inclusive of sent_at, which is what a jump-to-timestamp cursor uses.
+# - conversation_id: the same tie-breaker for the conversations of a delta sync
+#   (see sync.changes_since), whose cursor is a position in both lists
+Cursor = namedtuple('Cursor', ['reverse', 'sent_at', 'message_id', 'conversation_id'], defaults=[None])
+
+
+def parse_timestamp(value):
+    '''
+    Parses an ISO 8601 timestamp from a client, raises ValueError when it is
+    malformed or out of range. Naive values are taken in the current time zone.
+    '''
+    sent_at = parse_datetime(value)
+    if sent_at is None:
+        raise ValueError(f'Invalid timestamp: {value}')
+    if timezone.is_naive(sent_at):
+        sent_at = timezone.make_aware(sent_at)
+    return sent_at
+
+
+def encode_cursor_token(cursor):
+    '''Serializes a Cursor into the opaque token handed to clients'''
+    tokens = {'t': cursor.sent_at.isoformat()}
+    if cursor.reverse:
+        tokens['r'] = '1'
+    if cursor.message_id is not None:
+        tokens['id'] = cursor.message_id.hex
+    if cursor.conversation_id is not None:
+        tokens['c'] = cursor.conversation_id.hex
+    querystring = parse.urlencode(tokens, doseq=True)
+    return b64encode(querystring.encode('ascii')).decode('ascii')
+
+
+def decode_cursor_token(encoded):
+    '''Parses a token from encode_cursor_token, raises ValueError when it is invalid'''
+    try:
+        querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+        tokens = parse.parse_qs(querystring, keep_blank_values=True)
+        reverse = bool(int(tokens.get('r', ['0'])[0]))
+        sent_at = parse_datetime(tokens['t'][0])
+        message_id = tokens.get('id', [''])[0]
+        message_id = uuid.UUID(message_id) if message_id else None
+        conversation_id = tokens.get('c', [''])[0]
+        conversation_id = uuid.UUID(conversation_id) if conversation_id else None
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+    if sent_at is None:
+        raise ValueError('Invalid cursor')
+    return Cursor(
+        reverse=reverse, sent_at=sent_at, message_id=message_id, conversation_id=conversation_id
+    )
+
+
+def filter_by_cursor(queryset, cursor, ordering=('sent_at', 'message_id')):
+    '''Applies the keyset condition of a cursor and the matching ordering'''
+    if cursor is None:
+        return queryset.order_by(*ordering)
+
+    if cursor.reverse:
+        ordering = ['-' + field for field in ordering]
+        if cursor.message_id is None:
+            condition = Q(sent_at__lte=cursor.sent_at)
+        else:
+            condition = Q(sent_at__lt=cursor.sent_at) | Q(
+                sent_at=cursor.sent_at, message_id__lt=cursor.message_id
+            )
+    else:
+        if cursor.message_id is None:
+            condition = Q(sent_at__gte=cursor.sent_at)
+        else:
+            condition = Q(sent_at__gt=cursor.sent_at) | Q(
+                sent_at=cursor.sent_at, message_id__gt=cursor.message_id
+            )
+
+    return queryset.filter(condition).order_by(*ordering)
+
+
+class MessageCursorPagination(BasePagination):
+    '''
+    Keyset (cursor) pagination over (sent_at, message_id).
+
+    Every page is a single range scan on the Index(chat, sent_at): there is no
+    COUNT(*) and no OFFSET, so page 10,000 of a busy chat costs the same as page 1.
+
+    Query params:
+    - cursor: opaque token taken from the "next"/"previous" links
+    - at: ISO 8601 timestamp, jumps to the first message sent at or after it
+    - page_size: optional override, capped by max_page_size
+    '''
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    timestamp_query_param = 'at'
+    ordering = ('sent_at', 'message_id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            self.cursor = self.get_timestamp_cursor(request)
+
+        queryset = self.filter_queryset_by_cursor(queryset, self.cursor)
+
+        # Fetch one extra row to know if there is a following page without COUNT(*)
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        if reverse:
+            self.page.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_next = has_more
+            # A source may start mid-conversation (see chats.archive.ArchiveReadThrough)
+            self.has_previous = self.cursor is not None or getattr(queryset, 'has_previous', False)
+
+        return self.page
+
+    def filter_queryset_by_cursor(self, queryset, cursor):
+        # Sources spanning several tables (chats.archive.ArchiveReadThrough) page themselves
+        if hasattr(queryset, 'filter_by_cursor'):
+            return queryset.filter_by_cursor(cursor, self.ordering)
+        return filter_by_cursor(queryset, cursor, self.ordering)
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_timestamp_cursor(self, request):
+        '''Builds a cursor from the "at" param so clients can jump to a point in time'''
+        value = request.query_params.get(self.timestamp_query_param)
+        if not value:
+            return None
+        try:
+            sent_at = parse_timestamp(value)
+        except ValueError:
+            raise NotFound(f'Invalid timestamp: {value}')
+        return Cursor(reverse=False, sent_at=sent_at, message_id=None)
+
+    def get_position(self, item):
+        '''(sent_at, message_id) of a page item: a Message or a .values() row'''
+        if isinstance(item, dict):
+            return item['sent_at'], item['message_id']
+        return item.sent_at, item.message_id
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            sent_at, message_id = self.get_position(self.page[-1])
+            cursor = Cursor(reverse=False, sent_at=sent_at, message_id=message_id)
+        else:
+            # Empty page reached through a "previous" link: go back to where we were
+            cursor = Cursor(reverse=False, sent_at=self.cursor.sent_at, message_id=None)
+        return self.encode_cursor(cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            sent_at, message_id = self.get_position(self.page[0])
+            cursor = Cursor(reverse=True, sent_at=sent_at, message_id=message_id)
+        else:
+            cursor = Cursor(reverse=True, sent_at=self.cursor.sent_at, message_id=None)
+        return self.encode_cursor(cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            return decode_cursor_token(encoded)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        # The cursor replaces any jump timestamp the client started from
+        url = remove_query_param(self.base_url, self.timestamp_query_param)
+        return replace_query_param(url, self.cursor_query_param, encode_cursor_token(cursor))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SearchResultsPagination(LimitOffsetPagination):
+    '''
+    Limit/offset over relevance-ranked search hits. Ranked results can't be keyset
+    paginated on time, but they don't need a COUNT(*) either: one extra hit is
+    fetched to know whether there is a next page.
+    '''
+
+    max_limit = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return MessageCursorPagination.get_paginated_response_schema(self, schema)
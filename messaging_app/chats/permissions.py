@@ -1,13 +1,12 @@
 from rest_framework import permissions
 
+from .membership import is_participant
+
 class IsConversationParticipant(permissions.BasePermission):
     '''Custom permission to only allow participants of a conversation to view, update, or delete it'''
 
     def has_object_permission(self, request, view, obj):
-        # Allow read permissions (GET, HEAD, OPTIONS) for participants
-        if request.method in permissions.SAFE_METHODS:
-            return request.user in obj.participants.all()
-        
-        # Write permissions (PUT, PATCH, DELETE) are only allowed
-        #  if the user is a participant
-        return request.user in obj.participants.all()
\ No newline at end of file
+        # Read (GET, HEAD, OPTIONS) and write (PUT, PATCH, DELETE) permissions are
+        # both limited to participants. The check is a single EXISTS (or a cache hit)
+        # instead of loading every participant of the conversation.
+        return is_participant(request.user, obj.pk, request)
\ No newline at end of file
@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .managers import NEVER_READ
+from .models import ConversationReadState, Message
+
+
+def mark_read(conversation_id, user, up_to):
+    '''
+    Moves the user's read watermark of a conversation forward to `up_to`.
+    Never moves it back (a stale device can't mark messages unread again).
+    One UPDATE in the common case, plus one INSERT the first time.
+    Returns the effective watermark.
+    '''
+    now = timezone.now()
+    states = ConversationReadState.objects.filter(conversation_id=conversation_id, user=user)
+    with transaction.atomic():
+        updated = states.filter(last_read_at__lt=up_to).update(last_read_at=up_to, updated_at=now)
+        if not updated:
+            # No row yet, or it's already ahead: the conflict is then ignored
+            ConversationReadState.objects.bulk_create(
+                [ConversationReadState(
+                    conversation_id=conversation_id, user=user, last_read_at=up_to, updated_at=now
+                )],
+                ignore_conflicts=True,
+            )
+    return states.values_list('last_read_at', flat=True).first()
+
+
+def unread_count(conversation_id, user, last_read_at=None):
+    '''Messages from others after the watermark, counted on Index(chat, sent_at)'''
+    return (
+        Message.objects.filter(chat_id=conversation_id, sent_at__gt=last_read_at or NEVER_READ)
+        .exclude(sender=user)
+        .count()
+    )
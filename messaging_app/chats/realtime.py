@@ -0,0 +1,259 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .membership import _normalize_id
+from .models import Message
+from .pagination import Cursor, decode_cursor_token, encode_cursor_token, filter_by_cursor
+from .serializers import MessageSerializer, MessageValuesSerializer
+
+# Server-Sent Events push of new messages to connected participants.
+#
+# A connection costs one membership check and, when resuming with Last-Event-ID,
+# one replay query. After that it only waits on an in-memory queue: messages are
+# serialized once when they are published and the same bytes are handed to every
+# subscriber of the conversation.
+#
+# The broker is in-process, so a client only hears about messages posted through
+# the same worker process. Anything exposing subscribe/unsubscribe/publish/
+# disconnect (e.g. a Redis pub/sub bridge) can replace `broker` for multi-process
+# deployments.
+
+# Events buffered per connection. A client that falls this far behind is sent a
+# `resync` event and disconnected instead of buffering without bound; it catches
+# up with GET /api/chats/changes/ and reconnects.
+STREAM_QUEUE_SIZE = 100
+
+# Seconds between keep-alive comments on an idle stream (keeps proxies from
+# closing the connection)
+STREAM_HEARTBEAT = 15
+
+# Most messages replayed to a client reconnecting with Last-Event-ID
+STREAM_REPLAY_LIMIT = 100
+
+# Reconnection delay suggested to EventSource clients, in milliseconds
+STREAM_RETRY_MS = 3000
+
+# Queue markers telling a stream to end
+RESYNC = 'resync'
+REVOKED = 'revoked'
+
+
+def format_event(data, event=None, event_id=None):
+    '''Encodes one Server-Sent Event'''
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, cls=DjangoJSONEncoder))
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def message_event_id(sent_at, message_id):
+    '''Event ids are cursor tokens, so Last-Event-ID tells us where to resume'''
+    return encode_cursor_token(Cursor(reverse=False, sent_at=sent_at, message_id=message_id))
+
+
+class Subscription:
+    '''
+    One connected client. Created and consumed on the event loop serving the
+    stream; deliver() may be called from any thread.
+    '''
+
+    def __init__(self, broker, conversation_id, user_id, max_queue=STREAM_QUEUE_SIZE):
+        self.broker = broker
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def deliver(self, frame):
+        try:
+            self.loop.call_soon_threadsafe(self._offer, frame)
+        except RuntimeError:
+            # The serving loop is gone, the stream can't be consumed anymore
+            self.broker.unsubscribe(self)
+
+    def _offer(self, frame):
+        if self.closed:
+            return
+        if frame in (RESYNC, REVOKED):
+            self._close(frame)
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self._close(RESYNC)
+
+    def _close(self, reason):
+        # Pending events are useless once the client has to resync: drop them so
+        # the reason is delivered right away
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(reason)
+
+    async def get(self, timeout):
+        '''Next frame or end marker, None when nothing arrived within `timeout`'''
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBroker:
+    '''In-process conversation -> subscribers fan-out'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, conversation_id, user_id, max_queue=STREAM_QUEUE_SIZE):
+        subscription = Subscription(
+            self, _normalize_id(conversation_id), _normalize_id(user_id), max_queue
+        )
+        with self._lock:
+            self._subscribers[subscription.conversation_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.conversation_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.conversation_id]
+
+    def _snapshot(self, conversation_id):
+        with self._lock:
+            return list(self._subscribers.get(_normalize_id(conversation_id), ()))
+
+    def publish(self, conversation_id, frames):
+        '''Hands already encoded frames to every subscriber of the conversation'''
+        subscribers = self._snapshot(conversation_id)
+        for subscription in subscribers:
+            for frame in frames:
+                subscription.deliver(frame)
+        return len(subscribers)
+
+    def disconnect(self, conversation_id, user_ids):
+        '''Ends the streams of users who are no longer participants'''
+        user_ids = {_normalize_id(user_id) for user_id in user_ids}
+        for subscription in self._snapshot(conversation_id):
+            if subscription.user_id in user_ids:
+                subscription.deliver(REVOKED)
+
+    def subscriber_count(self, conversation_id):
+        return len(self._snapshot(conversation_id))
+
+
+broker = LocalBroker()
+
+
+def publish_messages(conversation_id, messages):
+    '''
+    Pushes newly created messages to the conversation's subscribers.
+    Call after the transaction commits (transaction.on_commit) so clients never
+    see a message that could still be rolled back.
+    '''
+    if not messages or not broker.subscriber_count(conversation_id):
+        return 0
+    data = MessageSerializer(messages, many=True).data
+    frames = [
+        format_event(
+            item, event='message', event_id=message_event_id(message.sent_at, message.message_id)
+        )
+        for message, item in zip(messages, data)
+    ]
+    return broker.publish(conversation_id, frames)
+
+
+# --- Stream helpers used by views.message_stream ---
+
+def authenticate(request):
+    '''Runs the API's authentication classes on a plain Django request'''
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+
+def missed_frames(conversation_id, last_event_id):
+    '''
+    Frames for messages created after `last_event_id`, and whether the backlog
+    was too long to replay (the client then gets a resync).
+    '''
+    try:
+        cursor = decode_cursor_token(last_event_id)
+    except ValueError:
+        return [], False
+    serializer = MessageValuesSerializer()
+    rows = list(
+        serializer.values(
+            filter_by_cursor(Message.objects.filter(chat_id=conversation_id), cursor)
+        )[:STREAM_REPLAY_LIMIT + 1]
+    )
+    too_many = len(rows) > STREAM_REPLAY_LIMIT
+    rows = rows[:STREAM_REPLAY_LIMIT]
+    frames = [
+        format_event(
+            item, event='message', event_id=message_event_id(row['sent_at'], row['message_id'])
+        )
+        for row, item in zip(rows, serializer.serialize(rows))
+    ]
+    return frames, too_many
+
+
+async def event_stream(subscription, replay=(), resync=False, heartbeat=STREAM_HEARTBEAT):
+    '''Async iterator of SSE bytes for one connection; unsubscribes when it ends'''
+    try:
+        yield f'retry: {STREAM_RETRY_MS}\n\n'.encode()
+        if resync:
+            yield format_event({'reason': 'backlog'}, event=RESYNC)
+            return
+        for frame in replay:
+            yield frame
+        while True:
+            frame = await subscription.get(heartbeat)
+            if frame is None:
+                yield b': keep-alive\n\n'
+            elif frame in (RESYNC, REVOKED):
+                yield format_event({'reason': frame}, event=frame)
+                return
+            else:
+                yield frame
+    finally:
+        subscription.broker.unsubscribe(subscription)
+
+
+async def open_stream(request, user, chat_pk):
+    '''
+    Subscribes a participant and prepares the replay for a new connection.
+    Returns (subscription, replay frames, resync).
+    '''
+    # Subscribe before reading the backlog so nothing published in between is
+    # lost; a message may then arrive twice, clients de-duplicate by event id.
+    subscription = broker.subscribe(chat_pk, user.pk)
+    last_event_id = request.headers.get('Last-Event-ID')
+    if not last_event_id:
+        return subscription, [], False
+    try:
+        replay, resync = await sync_to_async(missed_frames)(chat_pk, last_event_id)
+    except BaseException:
+        broker.unsubscribe(subscription)
+        raise
+    return subscription, replay, resync
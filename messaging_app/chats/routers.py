@@ -0,0 +1,103 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Read/write splitting.
+#
+# Writes always go to the primary ("default"). Reads go to one of the aliases in
+# settings.DATABASE_REPLICAS, picked once per request so a request sees a single
+# replica, unless the request is pinned to the primary:
+# - a request that wrote reads from the primary for the rest of the request,
+# - and the user's requests keep reading from the primary for
+#   CHATS_REPLICA_PIN_SECONDS afterwards, so a client reads its own writes
+#   despite replication lag (the pin is kept in the shared cache, so it holds
+#   across workers).
+#
+# Reads outside a request (management commands, background jobs) and reads
+# inside a transaction go to the primary: a transaction must see its own writes,
+# and code such as archive_messages() takes the alias of a read queryset to write.
+#
+# With no replicas configured every query goes to the primary.
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+_request_state = ContextVar('chats_db_request_state', default=None)
+
+
+class RequestState:
+    __slots__ = ('pinned', 'wrote', 'replica')
+
+    def __init__(self):
+        self.pinned = False
+        self.wrote = False
+        self.replica = None
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def pin_key(user_pk):
+    return f'chats:db:pinned:{user_pk}'
+
+
+@contextmanager
+def request_scope():
+    '''Routing state of one request (see ReadYourWritesMiddleware)'''
+    state = RequestState()
+    token = _request_state.set(state)
+    try:
+        yield state
+    finally:
+        _request_state.reset(token)
+
+
+def pin_to_primary():
+    '''Sends the remaining reads of the current request to the primary'''
+    state = _request_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def remember_write(user):
+    '''Pins the user's next requests to the primary for CHATS_REPLICA_PIN_SECONDS'''
+    if user is None or not user.is_authenticated or not replica_aliases():
+        return
+    cache.set(pin_key(user.pk), True, getattr(settings, 'CHATS_REPLICA_PIN_SECONDS', 5))
+
+
+def pin_if_recent_write(user):
+    '''Pins the current request when the user wrote within the pin window'''
+    if user is None or not user.is_authenticated or not replica_aliases():
+        return
+    if cache.get(pin_key(user.pk)):
+        pin_to_primary()
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        state = _request_state.get()
+        if not replicas or state is None or state.pinned or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        if state.replica not in replicas:
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = state.pinned = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        pool = {PRIMARY, *replica_aliases()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
@@ -0,0 +1,261 @@
+import operator
+import re
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Conversation, Message, User
+
+# Full-text index over chats_message.message_body (SQLite FTS5).
+#
+# It is an external-content table: the text lives only in chats_message and the
+# index refers to rows by their SQLite rowid. Triggers keep it in sync on every
+# INSERT, UPDATE of message_body and DELETE. VACUUM may renumber the rowids of
+# tables without an INTEGER PRIMARY KEY, so run `manage.py rebuild_message_search`
+# after a VACUUM (or to index an existing database).
+FTS_TABLE = 'chats_message_fts'
+
+CREATE_FTS_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        message_body,
+        content='chats_message',
+        content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON chats_message BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, message_body) VALUES (new.rowid, new.message_body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON chats_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_body)
+        VALUES ('delete', old.rowid, old.message_body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF message_body ON chats_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_body)
+        VALUES ('delete', old.rowid, old.message_body);
+        INSERT INTO {FTS_TABLE}(rowid, message_body) VALUES (new.rowid, new.message_body);
+    END
+    """,
+]
+
+DROP_FTS_SQL = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+# Words (letters/digits, including non-ASCII) pulled out of the user's query
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def create_index(connection):
+    '''Creates the FTS5 table and sync triggers (no-op on other databases)'''
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in CREATE_FTS_SQL:
+            cursor.execute(statement)
+
+
+def drop_index(connection):
+    if connection.vendor != 'sqlite':
+        return
+    _indexed_databases.discard(connection.settings_dict['NAME'])
+    with connection.cursor() as cursor:
+        for statement in DROP_FTS_SQL:
+            cursor.execute(statement)
+
+
+def rebuild_index(connection):
+    '''Re-reads every message body from chats_message into the index'''
+    create_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+# Databases (by NAME) where the index was found, so we only introspect until it exists
+_indexed_databases = set()
+
+
+def fts_available(connection):
+    '''True when the FTS5 index exists on this database'''
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _indexed_databases:
+        if FTS_TABLE not in connection.introspection.table_names(include_views=True):
+            return False
+        _indexed_databases.add(name)
+    return True
+
+
+def build_match_query(text):
+    '''
+    Turns free text into a safe FTS5 MATCH expression.
+
+    Every word is quoted so FTS operators typed by users (AND, NEAR, *, :, ...)
+    can't produce syntax errors. Words are ANDed; the last one is a prefix match
+    so search-as-you-type works. Returns None when there is nothing to search for.
+    '''
+    terms = TERM_RE.findall(text or '')
+    if not terms:
+        return None
+    quoted = ['"{}"'.format(term.replace('"', '""')) for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+class RankedMessageSearch:
+    '''
+    Lazily evaluated, relevance-ranked message search limited to the conversations
+    a user participates in. Slicing runs one indexed FTS query with LIMIT/OFFSET
+    (no COUNT) and returns Message instances in rank order, each with `.rank`
+    set (lower BM25 is more relevant).
+    '''
+
+    def __init__(self, user, text, conversation_id=None, using='default'):
+        self.user = user
+        self.match = build_match_query(text)
+        self.text = text
+        self.conversation_id = conversation_id
+        self.using = using
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError('RankedMessageSearch only supports slicing')
+        start = item.start or 0
+        if item.stop is None:
+            raise TypeError('RankedMessageSearch needs an upper bound')
+        limit = max(item.stop - start, 0)
+        if self.match is None or limit == 0:
+            return []
+
+        connection = connections[self.using]
+        if fts_available(connection):
+            hits = self._fts_hits(connection, limit, start)
+        else:
+            hits = self._fallback_hits(limit, start)
+
+        messages = Message.objects.using(self.using).select_related('sender', 'chat').in_bulk(
+            [message_id for message_id, _ in hits]
+        )
+        results = []
+        for message_id, rank in hits:
+            message = messages.get(message_id)
+            if message is not None:
+                message.rank = rank
+                results.append(message)
+        return results
+
+    def _fts_hits(self, connection, limit, offset):
+        through = Conversation.participants.through
+        # UUIDs are bound in the database's representation (hex strings on SQLite)
+        params = [self.match, User._meta.pk.get_db_prep_value(self.user.pk, connection)]
+        conversation_filter = ''
+        if self.conversation_id is not None:
+            conversation_filter = 'AND m.chat_id = %s'
+            params.append(
+                Conversation._meta.pk.get_db_prep_value(self.conversation_id, connection)
+            )
+        params += [limit, offset]
+
+        sql = f"""
+            SELECT m.message_id, bm25({FTS_TABLE}) AS rank
+            FROM {FTS_TABLE}
+            JOIN chats_message m ON m.rowid = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s
+              AND m.chat_id IN (
+                  SELECT conversation_id FROM {through._meta.db_table} WHERE user_id = %s
+              )
+              {conversation_filter}
+            ORDER BY rank
+            LIMIT %s OFFSET %s
+        """
+        field = Message._meta.pk
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [
+                (field.to_python(message_id), rank) for message_id, rank in cursor.fetchall()
+            ]
+
+    def _fallback_hits(self, limit, offset):
+        '''Databases without FTS5: unranked icontains, newest first'''
+        queryset = Message.objects.using(self.using).filter(chat__participants=self.user)
+        if self.conversation_id is not None:
+            queryset = queryset.filter(chat_id=self.conversation_id)
+        for term in TERM_RE.findall(self.text):
+            queryset = queryset.filter(message_body__icontains=term)
+        ids = queryset.order_by('-sent_at').values_list('message_id', flat=True)
+        return [(message_id, None) for message_id in ids[offset:offset + limit]]
+
+
+class MessageSearchFilter(filters.SearchFilter):
+    '''
+    SearchFilter replacement for MessageViewSet: ?search= is answered by the FTS5
+    index instead of LIKE '%term%' scans. Results keep the view's ordering
+    (chronological, cursor paginated). Falls back to the regular SearchFilter on
+    databases without the index.
+
+    Terms combine as in SearchFilter: a message is returned when every term
+    matches, either its body (through the index) or one of the other
+    search_fields (e.g. sender__email). The index lookups are limited to the
+    view's conversation (the `chat_pk` URL kwarg) when there is one.
+    '''
+
+    # Searched through the index rather than with icontains
+    indexed_field = 'message_body'
+    conversation_kwarg = 'chat_pk'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        connection = connections[queryset.db]
+        if not fts_available(connection):
+            return super().filter_queryset(request, queryset, view)
+
+        conversation_filter, conversation_params = '', []
+        conversation_id = getattr(view, 'kwargs', {}).get(self.conversation_kwarg)
+        if conversation_id is not None:
+            try:
+                conversation_id = Conversation._meta.pk.get_db_prep_value(conversation_id, connection)
+            except ValidationError:
+                return queryset.none()
+            conversation_filter, conversation_params = 'AND m.chat_id = %s', [conversation_id]
+
+        other_fields = [
+            field for field in (self.get_search_fields(view, request) or ())
+            if field != self.indexed_field
+        ]
+        lookups = [self.construct_search(str(field), queryset) for field in other_fields]
+
+        condition = Q()
+        for term in terms:
+            alternatives = [Q(**{lookup: term}) for lookup in lookups]
+            match = build_match_query(term)
+            if match is not None:
+                alternatives.append(Q(message_id__in=RawSQL(
+                    f'SELECT m.message_id FROM {FTS_TABLE} '
+                    f'JOIN chats_message m ON m.rowid = {FTS_TABLE}.rowid '
+                    f'WHERE {FTS_TABLE} MATCH %s {conversation_filter}',
+                    [match, *conversation_params],
+                )))
+            if alternatives:  # Otherwise only punctuation, which the index ignores
+                condition &= reduce(operator.or_, alternatives)
+
+        queryset = queryset.filter(condition)
+        if other_fields and self.must_call_distinct(queryset, other_fields):
+            queryset = queryset.distinct()
+        return queryset
@@ -1,4 +1,9 @@
+import operator
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from .models import Conversation, Message
@@ -14,9 +19,12 @@ class ReadUserSerializer(serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
     class Meta:
         model = User
-        fields = ('user_id', 'email', 'first_name', 'last_name', 'role')
+        fields = ('user_id', 'email', 'first_name', 'last_name', 'full_name', 'role')
         read_only_fields = fields
 
+    def get_full_name(self, obj):
+        return obj.get_full_name()
+
 
 
 # ---2. MessageSerializer ---
@@ -50,6 +58,88 @@ class MessageSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError('Conversation not found')
             return chat_id
         
+class MessageSearchResultSerializer(MessageSerializer):
+    '''A message returned by full-text search, with its relevance (lower BM25 is better)'''
+    rank = serializers.FloatField(read_only=True, allow_null=True)
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ('rank',)
+        read_only_fields = MessageSerializer.Meta.fields + ('rank',)
+
+
+def missing_user_ids(user_ids):
+    '''Returns the ids that don't match any user, using a single query'''
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    found = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    return user_ids - found
+
+
+def _missing_users_errors(user_ids, missing):
+    return [f'User {user_id} does not exist.' for user_id in user_ids if user_id in missing]
+
+
+def create_conversations(items, creator=None):
+    '''
+    Creates conversations with their participants using bulk INSERTs: one for the
+    conversations and one for every participant row (creator included), split
+    only when a batch exceeds the database's parameter limit.
+
+    items: dicts of Conversation fields plus 'participant_ids'.
+    '''
+    conversations, participants = [], []
+    for item in items:
+        item = dict(item)
+        participant_ids = set(item.pop('participant_ids', ()))
+        item.pop('creator', None)
+        if creator is not None:
+            participant_ids.add(creator.pk)
+        conversations.append(Conversation(**item))
+        participants.append(participant_ids)
+
+    through = Conversation.participants.through
+    with transaction.atomic():
+        Conversation.objects.bulk_create(conversations)
+        # Brand-new conversations have no cached membership answers to invalidate,
+        # so skipping the m2m_changed signal here is safe.
+        through.objects.bulk_create(
+            [
+                through(conversation_id=conversation.pk, user_id=user_id)
+                for conversation, user_ids in zip(conversations, participants)
+                for user_id in user_ids
+            ],
+            batch_size=500,
+        )
+    return conversations
+
+
+class BulkConversationSerializer(serializers.ListSerializer):
+    '''
+    many=True counterpart of ConversationSerializer for onboarding imports:
+    participant ids of the whole batch are checked with one query and everything
+    is inserted with create_conversations().
+    '''
+
+    def to_internal_value(self, data):
+        # Checked here rather than in validate() so errors stay aligned with the items
+        attrs = super().to_internal_value(data)
+        missing = missing_user_ids(
+            user_id for item in attrs for user_id in item['participant_ids']
+        )
+        if missing:
+            raise serializers.ValidationError([
+                {'participant_ids': _missing_users_errors(item['participant_ids'], missing)}
+                if missing.intersection(item['participant_ids']) else {}
+                for item in attrs
+            ])
+        return attrs
+
+    def create(self, validated_data):
+        creator = validated_data[0].get('creator') if validated_data else None
+        return create_conversations(validated_data, creator=creator)
+
+
 # --- 3. ConversationSerializer ---
 class ConversationSerializer(serializers.ModelSerializer):
     """
@@ -87,23 +177,198 @@ class ConversationSerializer(serializers.ModelSerializer):
             'messages'         # Nested list of messages (Read only)
         )
         read_only_fields = ('conversation_id', 'created_at')
+        list_serializer_class = BulkConversationSerializer
 
     def get_num_participants(self, obj):
         """Returns the total number of participants in the conversation."""
         return obj.participants.count()
 
+    def validate_participant_ids(self, value):
+        """
+        Drops duplicates and checks that every user exists with a single query.
+        In a bulk create the check runs once for the whole batch instead
+        (BulkConversationSerializer.to_internal_value).
+        """
+        value = list(dict.fromkeys(value))
+        if not isinstance(self.parent, serializers.ListSerializer):
+            missing = missing_user_ids(value)
+            if missing:
+                raise serializers.ValidationError(_missing_users_errors(value, missing))
+        return value
+
     def create(self, validated_data):
         """
         Custom create method to handle the many-to-many participants relationship.
+        The conversation and all participant rows (the creator passed to save() included)
+        are inserted in bulk instead of going through participants.set().
         """
-        participant_ids = validated_data.pop('participant_ids', [])
-        
-        # 1. Create the Conversation instance without the participants
-        conversation = Conversation.objects.create(**validated_data)
-        
-        # 2. Add participants using the IDs
-        if participant_ids:
-            # We use .set() to add the list of participants (User IDs) to the many-to-many field.
-            conversation.participants.set(participant_ids)
-            
-        return conversation
\ No newline at end of file
+        creator = validated_data.pop('creator', None)
+        [conversation] = create_conversations([validated_data], creator=creator)
+        return conversation
+
+# --- 4. ConversationListSerializer ---
+class ConversationListSerializer(serializers.ModelSerializer):
+    """
+    Read-only, inbox-style representation used by the conversation list.
+    Every value comes from the denormalized activity summary, the
+    ConversationQuerySet.with_list_summary() annotation or the prefetched
+    participants, so the list runs a constant number of queries.
+    """
+    participants = ReadUserSerializer(many=True, read_only=True)
+    num_participants = serializers.IntegerField(read_only=True)
+    # ConversationQuerySet.with_unread_count() annotation
+    unread_count = serializers.IntegerField(read_only=True)
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = (
+            'conversation_id',
+            'title',
+            'participants',
+            'num_participants',
+            'message_count',
+            'unread_count',
+            'last_message',
+            'last_message_at',
+            'created_at',
+            'updated_at',
+        )
+        read_only_fields = fields
+
+    def get_last_message(self, obj):
+        """Preview of the newest message, or None for an empty conversation."""
+        if obj.last_message_at is None:
+            return None
+        sender = obj.last_message_sender
+        return {
+            'preview': obj.last_message_preview,
+            'sender': sender.email if sender else None,
+            'sent_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
+
+
+class MarkReadSerializer(serializers.Serializer):
+    '''
+    Body of POST /api/chats/{id}/read/: mark everything read up to a message or a
+    point in time. Empty means up to the latest message.
+    '''
+    message_id = serializers.UUIDField(required=False)
+    up_to = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if 'message_id' in attrs and 'up_to' in attrs:
+            raise serializers.ValidationError('Pass either message_id or up_to, not both.')
+        return attrs
+
+
+# --- 5. Fast read path ---
+# ModelSerializer walks a tree of Field objects for every instance, which dominates
+# CPU on large message lists. The classes below serialize rows fetched with
+# QuerySet.values() through per-field converters compiled once per batch, with no
+# model instances and no validation machinery. Their output is identical to the
+# ModelSerializer they mirror (ReadUserSerializer / MessageSerializer).
+
+
+def _uuid_to_representation(value):
+    return None if value is None else str(value)
+
+
+class ValuesReadSerializer:
+    """
+    Read-only serializer for QuerySet.values() rows.
+
+    Subclasses declare `fields` as (output key, source, converter) tuples:
+    - source is a column name, a tuple of column names (converter gets one argument
+      per column) or (ValuesReadSerializer subclass, relation name) for nesting
+    - converter is a function, a DRF field class whose to_representation is used
+      (same output as the ModelSerializer field), or None to pass the value through
+
+    Row getters are compiled once per batch, so per-batch state such as the active
+    timezone is resolved once instead of once per value.
+    """
+
+    fields = ()
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.columns = []
+        for name, source, converter in self.fields:
+            if self._is_nested(source):
+                nested_class, relation = source
+                self.columns.extend(nested_class(prefix=f'{prefix}{relation}__').columns)
+            elif isinstance(source, tuple):
+                self.columns.extend(prefix + column for column in source)
+            else:
+                self.columns.append(prefix + source)
+
+    @staticmethod
+    def _is_nested(source):
+        return isinstance(source, tuple) and isinstance(source[0], type)
+
+    def values(self, queryset):
+        """Fetches only the columns this serializer needs"""
+        return queryset.values(*self.columns)
+
+    def compile(self, field_timezone=None):
+        """Returns a function turning one row into the output dict"""
+        if field_timezone is None and settings.USE_TZ:
+            field_timezone = timezone.get_current_timezone()
+
+        getters = []
+        for name, source, converter in self.fields:
+            if self._is_nested(source):
+                nested_class, relation = source
+                nested = nested_class(prefix=f'{self.prefix}{relation}__')
+                getters.append((name, nested.compile(field_timezone)))
+                continue
+
+            if isinstance(converter, type) and issubclass(converter, serializers.Field):
+                kwargs = {}
+                if issubclass(converter, serializers.DateTimeField):
+                    kwargs['default_timezone'] = field_timezone
+                converter = converter(**kwargs).to_representation
+
+            if isinstance(source, tuple):
+                keys = [self.prefix + column for column in source]
+                getters.append((name, lambda row, c=converter, k=keys: c(*[row[key] for key in k])))
+            elif converter is None:
+                getters.append((name, operator.itemgetter(self.prefix + source)))
+            else:
+                getters.append((name, lambda row, c=converter, k=self.prefix + source: c(row[k])))
+
+        def to_representation(row):
+            return {name: getter(row) for name, getter in getters}
+
+        return to_representation
+
+    def to_representation(self, row):
+        return self.compile()(row)
+
+    def serialize(self, rows):
+        to_representation = self.compile()
+        return [to_representation(row) for row in rows]
+
+
+class UserValuesSerializer(ValuesReadSerializer):
+    """values() counterpart of ReadUserSerializer"""
+    fields = (
+        ('user_id', 'user_id', _uuid_to_representation),
+        ('email', 'email', None),
+        ('first_name', 'first_name', None),
+        ('last_name', 'last_name', None),
+        ('full_name', ('first_name', 'last_name'), lambda first, last: f'{first} {last}'.strip()),
+        ('role', 'role', None),
+    )
+
+
+class MessageValuesSerializer(ValuesReadSerializer):
+    """values() counterpart of MessageSerializer, used by the message list/retrieve actions"""
+    fields = (
+        ('message_id', 'message_id', _uuid_to_representation),
+        # PrimaryKeyRelatedField returns the raw pk, the JSON renderer formats it
+        ('chat', 'chat_id', None),
+        ('sender', (UserValuesSerializer, 'sender'), None),
+        ('message_body', 'message_body', None),
+        ('sent_at', 'sent_at', serializers.DateTimeField),
+    )
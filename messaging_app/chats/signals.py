@@ -0,0 +1,55 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_message_version
+from .membership import invalidate_membership
+from .realtime import broker
+from .models import Conversation, Message
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_membership_on_participant_change(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    Keeps the membership cache and Conversation.updated_at in sync with
+    Conversation.participants, and ends the message streams of removed users.
+
+    Fires for both sides of the relation:
+    - conversation.participants.add(user): instance is the Conversation, pk_set holds user ids
+    - user.conversations.add(conversation): instance is the User, pk_set holds conversation ids
+    clear() does not provide pk_set, so the current rows are read in pre_clear.
+    '''
+    if action == 'pre_clear':
+        if reverse:
+            pk_set = set(instance.conversations.values_list('pk', flat=True))
+        else:
+            pk_set = set(instance.participants.values_list('pk', flat=True))
+        # Remember the affected ids until post_clear, when the rows are gone
+        instance._cleared_participant_pks = pk_set
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_participant_pks', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    if reverse:
+        conversation_ids = pk_set or ()
+        for conversation_id in conversation_ids:
+            invalidate_membership(conversation_id, [instance.pk])
+            if action != 'post_add':
+                broker.disconnect(conversation_id, [instance.pk])
+    else:
+        conversation_ids = [instance.pk]
+        invalidate_membership(instance.pk, pk_set or ())
+        if action != 'post_add':
+            broker.disconnect(instance.pk, pk_set or ())
+
+    # Participant lists are part of the conversation representation
+    if conversation_ids:
+        Conversation.objects.filter(pk__in=conversation_ids).touch()
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_message_lists(sender, instance, **kwargs):
+    '''Makes cached message lists of the conversation stale (bulk writes bump it themselves)'''
+    bump_message_version(instance.chat_id)
@@ -0,0 +1,186 @@
+import hashlib
+from datetime import timedelta
+
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .caching import get_message_version
+from .membership import is_participant, membership_changed_at
+from .models import Conversation, ConversationReadState, Message
+from .pagination import Cursor, decode_cursor_token, encode_cursor_token, filter_by_cursor
+from .serializers import MessageValuesSerializer
+
+# Messages are stamped with sent_at before their transaction commits, so a message
+# can become visible slightly after a newer one. The sync cursor trails "now" by
+# this much and the next poll repeats that window; clients de-duplicate by id.
+SYNC_SETTLE_WINDOW = timedelta(seconds=2)
+
+# Most messages (and conversations) returned by one delta sync call
+SYNC_PAGE_SIZE = 500
+
+# Attribute used to memoize validators on the current HttpRequest
+REQUEST_CACHE_ATTR = '_chats_validators'
+
+
+# --- 1. Conditional GET validators ---
+# Used with django.views.decorators.http.condition: the view only serializes
+# anything when the client's ETag / If-Modified-Since no longer match.
+
+def _memoized(request, key, compute):
+    http_request = getattr(request, '_request', request)
+    validators = http_request.__dict__.setdefault(REQUEST_CACHE_ATTR, {})
+    if key not in validators:
+        validators[key] = compute()
+    return validators[key]
+
+
+def _etag(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def conversation_list_validators(request):
+    '''
+    (etag, last_modified) of the user's conversation list, from one aggregate over
+    their conversations: any message, edit or participant change bumps updated_at
+    and the newest read state catches unread counts changed by the user.
+
+    A conversation the user left drops out of the aggregate, which can move
+    Max(updated_at) backwards: the count and the user's membership timestamp
+    (see membership.py) are part of the validators too.
+    '''
+    def compute():
+        user = request.user
+        # The user's read watermarks change their unread counts, not updated_at
+        summary = Conversation.objects.filter(participants=user).aggregate(
+            total=Count('pk', distinct=True),
+            last_modified=Max('updated_at'),
+            last_read=Max('read_states__updated_at', filter=Q(read_states__user=user)),
+        )
+        membership_changed = membership_changed_at(user.pk)
+        last_modified = max(
+            filter(None, (summary['last_modified'], summary['last_read'], membership_changed)),
+            default=None,
+        )
+        etag = _etag(
+            user.pk, summary['total'], summary['last_modified'], summary['last_read'],
+            membership_changed,
+        )
+        return etag, last_modified
+
+    return _memoized(request, 'conversations', compute)
+
+
+def message_list_etag(request, *args, chat_pk=None, **kwargs):
+    '''
+    ETag of a conversation's messages: the version bumped on every message write
+    (see caching.py), so revalidation needs no database query.
+    '''
+    def compute():
+        if not is_participant(request.user, chat_pk, request):
+            return None
+        return _etag(chat_pk, get_message_version(chat_pk))
+
+    return _memoized(request, f'messages:{chat_pk}', compute)
+
+
+def conversation_list_etag(request, *args, **kwargs):
+    return conversation_list_validators(request)[0]
+
+
+def conversation_list_last_modified(request, *args, **kwargs):
+    return conversation_list_validators(request)[1]
+
+
+# --- 2. Delta sync ---
+
+def parse_sync_cursor(value):
+    '''Accepts a token returned by a previous sync, raises ValueError otherwise'''
+    cursor = decode_cursor_token(value)
+    if cursor.reverse:
+        raise ValueError('Invalid cursor')
+    return cursor
+
+
+def changes_since(user, cursor, limit=SYNC_PAGE_SIZE):
+    '''
+    Returns what changed in the user's conversations after `cursor`:
+    - messages: .values() rows created after the cursor, oldest first, at most `limit`
+    - conversations: created or updated (new message, edit, participants, read
+      watermark) since then, in the order they changed, at most `limit`
+    - cursor: token for the next call; has_more tells the client to call again now
+
+    When either list is cut, the cursor stops at the earlier of the two last
+    items, so the next call returns what was left out of both (and repeats some
+    of the other list). The cursor keeps a tie-breaker per list (message_id,
+    conversation_id), so a page of items sharing one timestamp still advances.
+
+    Both queries are range scans: messages on Index(chat, sent_at) for the user's
+    conversations, conversations on updated_at.
+    '''
+    started = timezone.now()
+    user_conversations = Conversation.objects.filter(participants=user)
+
+    messages = filter_by_cursor(
+        Message.objects.filter(chat__in=user_conversations.values('pk')), cursor
+    )
+    messages = list(MessageValuesSerializer().values(messages)[:limit + 1])
+    more_messages = len(messages) > limit
+    messages = messages[:limit]
+
+    # When the conversation last changed for this user (read watermarks included)
+    last_read = ConversationReadState.objects.filter(
+        conversation=OuterRef('pk'), user=user
+    ).values('updated_at')[:1]
+    if cursor.conversation_id is None:
+        after_cursor = Q(changed_at__gte=cursor.sent_at)
+    else:
+        after_cursor = Q(changed_at__gt=cursor.sent_at) | Q(
+            changed_at=cursor.sent_at, pk__gt=cursor.conversation_id
+        )
+    conversations = list(
+        user_conversations.annotate(
+            changed_at=Greatest(
+                'updated_at', 'created_at', Coalesce(Subquery(last_read), F('updated_at'))
+            )
+        )
+        .filter(after_cursor)
+        .with_list_summary()
+        .with_unread_count(user)
+        .order_by('changed_at', 'pk')[:limit + 1]
+    )
+    more_conversations = len(conversations) > limit
+    conversations = conversations[:limit]
+
+    # Last (timestamp, id) of each list that was cut
+    ends = []
+    if more_messages:
+        ends.append((messages[-1]['sent_at'], 'message_id', messages[-1]['message_id']))
+    if more_conversations:
+        ends.append((conversations[-1].changed_at, 'conversation_id', conversations[-1].pk))
+    has_more = bool(ends)
+    if ends:
+        sent_at = min(end[0] for end in ends)
+        # A list keeps its tie-breaker when it ends (or already was) at that
+        # instant; otherwise it repeats the items of that instant
+        tie_breakers = {'message_id': None, 'conversation_id': None}
+        if sent_at == cursor.sent_at:
+            tie_breakers.update(message_id=cursor.message_id, conversation_id=cursor.conversation_id)
+        tie_breakers.update({field: pk for at, field, pk in ends if at == sent_at})
+        next_cursor = Cursor(reverse=False, sent_at=sent_at, **tie_breakers)
+    else:
+        # Never move backwards, trail "now" by the settle window
+        settled = max(cursor.sent_at, started - SYNC_SETTLE_WINDOW)
+        next_cursor = Cursor(reverse=False, sent_at=settled, message_id=None)
+
+    return {
+        'messages': messages,
+        'conversations': conversations,
+        'cursor': encode_cursor_token(next_cursor),
+        'has_more': has_more,
+    }
+
+
+def initial_sync_cursor():
+    '''Cursor for a client that just did a full load: changes from now on'''
+    return Cursor(reverse=False, sent_at=timezone.now() - SYNC_SETTLE_WINDOW, message_id=None)
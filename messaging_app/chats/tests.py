@@ -1,3 +1,1008 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import metrics, realtime, routers, sync
+from .archive import archive_messages
+from .cache_backends import TieredCache
+from .ids import new_id, uuid7, uuid7_timestamp_ms
+from .membership import is_participant, membership_cache_key, membership_changed_key
+from .models import ArchivedMessage, Conversation, Message, User
+from .serializers import MessageSerializer, MessageValuesSerializer
+
+
+# The default cache on a scratch file, so tests never clear or fill the
+# developer's cache (settings.CACHES); removed after the run
+_test_cache_dir = tempfile.TemporaryDirectory(prefix='chats_test_cache_')
+TEST_CACHES = {
+    'default': {
+        **settings.CACHES['default'],
+        'LOCATION': os.path.join(_test_cache_dir.name, 'cache.sqlite3'),
+    },
+}
+
+
+def tearDownModule():
+    _test_cache_dir.cleanup()
+
+
+class ChatsFixtures:
+    '''Shared fixtures: two participants in one conversation and an outsider'''
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(
+            email='alice@example.com', first_name='Alice', last_name='A'
+        )
+        self.bob = User.objects.create_user(
+            email='bob@example.com', first_name='Bob', last_name='B'
+        )
+        self.eve = User.objects.create_user(
+            email='eve@example.com', first_name='Eve', last_name='E'
+        )
+        self.conversation = Conversation.objects.create(title='General')
+        self.conversation.participants.set([self.alice, self.bob])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def messages_url(self, conversation=None):
+        conversation = conversation or self.conversation
+        return f'/api/chats/{conversation.conversation_id}/messages/'
+
+    def create_messages(self, count, start=None):
+        start = start or timezone.now() - timedelta(days=1)
+        return Message.objects.bulk_create(
+            Message(
+                sender=self.alice if i % 2 else self.bob,
+                chat=self.conversation,
+                message_body=f'message {i}',
+                sent_at=start + timedelta(seconds=i),
+            )
+            for i in range(count)
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ChatsTestCase(ChatsFixtures, TestCase):
+    pass
+
+
+class MessageCursorPaginationTests(ChatsTestCase):
+
+    def walk(self, url, link):
+        bodies = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            bodies.extend(m['message_body'] for m in response.data['results'])
+            url = response.data[link]
+        return bodies
+
+    def test_forward_pages_cover_every_message_once(self):
+        self.create_messages(25)
+        bodies = self.walk(self.messages_url(), 'next')
+        self.assertEqual(bodies, [f'message {i}' for i in range(25)])
+
+    def test_previous_link_walks_back(self):
+        self.create_messages(25)
+        first = self.client.get(self.messages_url())
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(back.data['previous'])
+
+    def test_ties_on_sent_at_are_broken_by_message_id(self):
+        same_time = timezone.now()
+        Message.objects.bulk_create(
+            Message(sender=self.alice, chat=self.conversation, message_body=str(i), sent_at=same_time)
+            for i in range(15)
+        )
+        ids = self.walk(self.messages_url(), 'next')
+        self.assertEqual(len(ids), 15)
+        self.assertEqual(len(set(ids)), 15)
+
+    def test_jump_to_timestamp(self):
+        messages = self.create_messages(25)
+        at = messages[12].sent_at.isoformat()
+        response = self.client.get(self.messages_url(), {'at': at})
+        self.assertEqual(response.data['results'][0]['message_body'], 'message 12')
+        previous = self.client.get(response.data['previous'])
+        self.assertEqual(previous.data['results'][-1]['message_body'], 'message 11')
+
+    def test_invalid_timestamp_is_404(self):
+        for at in ('yesterday', '2024-13-45T00:00:00'):
+            with self.subTest(at=at):
+                response = self.client.get(self.messages_url(), {'at': at})
+                self.assertEqual(response.status_code, 404)
+
+    def test_naive_timestamp_is_in_the_current_time_zone(self):
+        messages = self.create_messages(5)
+        at = timezone.localtime(messages[2].sent_at).replace(tzinfo=None).isoformat()
+        response = self.client.get(self.messages_url(), {'at': at})
+        self.assertEqual(response.data['results'][0]['message_body'], 'message 2')
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get(self.messages_url(), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ConversationListTests(ChatsTestCase):
+
+    def test_list_query_count_does_not_grow_with_conversations(self):
+        for i in range(8):
+            conversation = Conversation.objects.create(title=f'Room {i}')
+            conversation.participants.set([self.alice, self.bob, self.eve])
+            Message.objects.create(sender=self.bob, chat=conversation, message_body=f'hello {i}')
+        Conversation.objects.refresh_summary()
+
+        # ETag aggregate + pagination COUNT + page + participants prefetch
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/chats/')
+        self.assertEqual(response.status_code, 200)
+
+        rooms = {c['title']: c for c in response.data['results']}
+        self.assertEqual(rooms['Room 3']['num_participants'], 3)
+        self.assertEqual(rooms['Room 3']['message_count'], 1)
+        self.assertEqual(len(rooms['Room 3']['participants']), 3)
+        self.assertEqual(rooms['Room 3']['last_message']['preview'], 'hello 3')
+        self.assertEqual(rooms['Room 3']['last_message']['sender'], 'bob@example.com')
+        self.assertIsNone(rooms['General']['last_message'])
+
+
+class MembershipTests(ChatsTestCase):
+
+    def test_membership_is_answered_once_per_request(self):
+        request = APIClient().get('/').wsgi_request
+        with self.assertNumQueries(1):
+            self.assertTrue(is_participant(self.alice, self.conversation.pk))
+        cache.clear()
+        with self.assertNumQueries(1):
+            is_participant(self.alice, self.conversation.pk, request)
+            cache.clear()
+            is_participant(self.alice, self.conversation.pk, request)
+
+    def test_cache_is_invalidated_on_participant_changes(self):
+        self.assertFalse(is_participant(self.eve, self.conversation.pk))
+        self.conversation.participants.add(self.eve)
+        self.assertTrue(is_participant(self.eve, self.conversation.pk))
+        self.eve.conversations.remove(self.conversation)
+        self.assertFalse(is_participant(self.eve, self.conversation.pk))
+        self.conversation.participants.add(self.eve)
+        self.assertTrue(is_participant(self.eve, self.conversation.pk))
+        self.conversation.participants.clear()
+        self.assertFalse(is_participant(self.eve, self.conversation.pk))
+        self.assertFalse(is_participant(self.alice, self.conversation.pk))
+
+    def test_answer_cached_before_commit_is_dropped_on_commit(self):
+        key = membership_cache_key(self.conversation.pk, self.bob.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation.participants.remove(self.bob)
+            # A concurrent request still seeing the committed state caches it
+            cache.set(key, True)
+        self.assertIsNone(cache.get(key))
+        self.assertFalse(is_participant(self.bob, self.conversation.pk))
+
+    def test_membership_is_not_kept_in_the_process_cache(self):
+        self.assertTrue(is_participant(self.alice, self.conversation.pk))
+        key = cache.make_key(membership_cache_key(self.conversation.pk, self.alice.pk))
+        self.assertNotIn(key, cache._l1)
+
+    def test_outsider_cannot_read_or_post(self):
+        Message.objects.create(sender=self.alice, chat=self.conversation, message_body='secret')
+        self.client.force_authenticate(self.eve)
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.data['results'], [])
+        response = self.client.post(
+            self.messages_url(), {'chat': self.conversation.pk, 'message_body': 'hi'}
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/api/chats/{self.conversation.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_participant_can_post(self):
+        response = self.client.post(
+            self.messages_url(), {'chat': self.conversation.pk, 'message_body': 'hi'}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sender']['email'], 'alice@example.com')
+
+
+class ConversationSummaryTests(ChatsTestCase):
+
+    def post(self, body):
+        return self.client.post(
+            self.messages_url(), {'chat': self.conversation.pk, 'message_body': body}
+        )
+
+    def test_summary_is_updated_on_create_and_delete(self):
+        self.post('first')
+        response = self.post('second ' + 'x' * 200)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.last_message_sender, self.alice)
+        self.assertEqual(self.conversation.last_message_preview, ('second ' + 'x' * 200)[:100])
+
+        self.client.delete(f"{self.messages_url()}{response.data['message_id']}/")
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(self.conversation.last_message_preview, 'first')
+
+    def test_list_is_ordered_by_activity(self):
+        quiet = Conversation.objects.create(title='Quiet')
+        quiet.participants.set([self.alice])
+        self.post('ping')
+        titles = [c['title'] for c in self.client.get('/api/chats/').data['results']]
+        self.assertEqual(titles, ['General', 'Quiet'])
+
+    def test_conversations_without_messages_come_last(self):
+        now = timezone.now()
+        for title, age in (('Old quiet', 3), ('New quiet', 1)):
+            conversation = Conversation.objects.create(title=title)
+            conversation.participants.set([self.alice])
+            Conversation.objects.filter(pk=conversation.pk).update(created_at=now - timedelta(days=age))
+        self.create_messages(1, start=now - timedelta(days=10))
+        Conversation.objects.refresh_summary()
+        titles = list(
+            Conversation.objects.filter(participants=self.alice)
+            .order_by_activity().values_list('title', flat=True)
+        )
+        self.assertEqual(titles, ['General', 'New quiet', 'Old quiet'])
+
+    def test_migration_backfills_existing_conversations(self):
+        backfill = import_module('chats.migrations.0009_backfill_conversation_summaries')
+        self.create_messages(3)
+        Conversation.objects.update(message_count=0, last_message_at=None, last_message_preview='')
+        backfill.backfill_summaries(None, mock.Mock(connection=connection))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 3)
+        self.assertEqual(self.conversation.last_message_preview, 'message 2')
+
+    def test_rebuild_command_repairs_drift(self):
+        self.create_messages(3)
+        Conversation.objects.update(message_count=42)
+        call_command('rebuild_conversation_summaries', stdout=StringIO())
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 3)
+        self.assertEqual(self.conversation.last_message_preview, 'message 2')
+        self.assertEqual(self.conversation.last_message_sender, self.bob)
+
+
+class MessageSearchTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Conversation.objects.create(title='Private')
+        self.other.participants.set([self.bob, self.eve])
+        Message.objects.create(sender=self.alice, chat=self.conversation, message_body='Lunch at noon?')
+        Message.objects.create(sender=self.bob, chat=self.conversation, message_body='lunch lunch lunch')
+        Message.objects.create(sender=self.bob, chat=self.conversation, message_body='Dinner later')
+        Message.objects.create(sender=self.eve, chat=self.other, message_body='secret lunch plans')
+
+    def search(self, text, **params):
+        return self.client.get('/api/search/messages/', {'search': text, **params})
+
+    def test_ranked_results_are_limited_to_own_conversations(self):
+        response = self.search('lunch')
+        self.assertEqual(response.status_code, 200)
+        bodies = [m['message_body'] for m in response.data['results']]
+        self.assertEqual(bodies, ['lunch lunch lunch', 'Lunch at noon?'])
+
+    def test_index_follows_updates_and_deletes(self):
+        message = Message.objects.get(message_body='Dinner later')
+        message.message_body = 'Breakfast later'
+        message.save()
+        self.assertEqual(len(self.search('dinner').data['results']), 0)
+        self.assertEqual(len(self.search('breakfast').data['results']), 1)
+        message.delete()
+        self.assertEqual(len(self.search('breakfast').data['results']), 0)
+
+    def test_prefix_and_operator_input_is_safe(self):
+        self.assertEqual(len(self.search('lun').data['results']), 2)
+        self.assertEqual(self.search('"lunch" AND NEAR(').status_code, 200)
+
+    def test_paginates_without_count(self):
+        first = self.search('lunch', limit=1)
+        self.assertEqual(len(first.data['results']), 1)
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 1)
+        self.assertIsNone(second.data['next'])
+
+    def test_message_list_search_uses_index(self):
+        response = self.client.get(self.messages_url(), {'search': 'lunch'})
+        bodies = [m['message_body'] for m in response.data['results']]
+        self.assertEqual(bodies, ['Lunch at noon?', 'lunch lunch lunch'])
+
+    def test_message_list_search_still_matches_sender_email(self):
+        response = self.client.get(self.messages_url(), {'search': 'bob@example'})
+        bodies = [m['message_body'] for m in response.data['results']]
+        self.assertEqual(bodies, ['lunch lunch lunch', 'Dinner later'])
+
+        # Body matches are unchanged
+        response = self.client.get(self.messages_url(), {'search': 'noon'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_message_list_search_terms_match_body_or_sender(self):
+        # One term in the body, the other in the sender's email
+        response = self.client.get(self.messages_url(), {'search': 'dinner bob@example'})
+        bodies = [m['message_body'] for m in response.data['results']]
+        self.assertEqual(bodies, ['Dinner later'])
+        response = self.client.get(self.messages_url(), {'search': 'dinner alice@example'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_message_list_search_is_limited_to_the_conversation(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.messages_url(), {'search': 'lunch'})
+        self.assertEqual(len(response.data['results']), 2)
+        [search] = [q['sql'] for q in queries if 'MATCH' in q['sql']]
+        self.assertIn('m.chat_id =', search)
+
+    def test_rebuild_command(self):
+        call_command('rebuild_message_search', stdout=StringIO())
+        self.assertEqual(len(self.search('dinner').data['results']), 1)
+
+
+class BulkMessageTests(ChatsTestCase):
+
+    def bulk_url(self):
+        return f'{self.messages_url()}bulk/'
+
+    def test_bulk_create_in_constant_queries(self):
+        payload = [{'message_body': f'bulk {i}'} for i in range(50)]
+        # membership EXISTS + conversation + savepoints/INSERT + summary UPDATE
+        with self.assertNumQueries(6):
+            response = self.client.post(self.bulk_url(), payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 50)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 50)
+        self.assertEqual(self.conversation.last_message_preview, 'bulk 49')
+        bodies = list(
+            Message.objects.filter(chat=self.conversation)
+            .order_by('sent_at', 'message_id')
+            .values_list('message_body', flat=True)
+        )
+        self.assertEqual(bodies, [f'bulk {i}' for i in range(50)])
+
+    def test_invalid_items_are_reported_per_index(self):
+        payload = {'messages': [{'message_body': 'ok'}, {'message_body': ''}, {}]}
+        response = self.client.post(self.bulk_url(), payload, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(response.data['created']), 1)
+        self.assertEqual([e['index'] for e in response.data['errors']], [1, 2])
+
+    def test_outsider_cannot_bulk_post(self):
+        self.client.force_authenticate(self.eve)
+        response = self.client.post(self.bulk_url(), [{'message_body': 'x'}], format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Message.objects.exists())
+
+
+class ConversationCreateTests(ChatsTestCase):
+
+    def test_create_adds_creator_and_participants_in_bulk(self):
+        # participant check + savepoint + conversation INSERT + participants INSERT + release
+        # + response (participants, count, messages)
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                '/api/chats/',
+                {'title': 'Trio', 'participant_ids': [str(self.bob.pk), str(self.bob.pk), str(self.eve.pk)]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['num_participants'], 3)
+        conversation = Conversation.objects.get(pk=response.data['conversation_id'])
+        self.assertEqual(
+            set(conversation.participants.all()), {self.alice, self.bob, self.eve}
+        )
+        self.assertTrue(is_participant(self.alice, conversation.pk))
+
+    def test_unknown_participants_are_rejected(self):
+        response = self.client.post(
+            '/api/chats/',
+            {'title': 'Ghost', 'participant_ids': [str(self.bob.pk), '00000000-0000-0000-0000-000000000000']},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('participant_ids', response.data)
+        self.assertFalse(Conversation.objects.filter(title='Ghost').exists())
+
+    def test_bulk_create_many_conversations(self):
+        payload = [
+            {'title': f'Onboarding {i}', 'participant_ids': [str(self.bob.pk), str(self.eve.pk)]}
+            for i in range(20)
+        ]
+        response = self.client.post('/api/chats/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 20)
+        self.assertTrue(all(c['num_participants'] == 3 for c in response.data))
+
+    def test_bulk_create_reports_unknown_users_per_item(self):
+        payload = [
+            {'title': 'Fine', 'participant_ids': [str(self.bob.pk)]},
+            {'title': 'Broken', 'participant_ids': ['00000000-0000-0000-0000-000000000000']},
+        ]
+        response = self.client.post('/api/chats/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('participant_ids', response.data[1])
+        self.assertEqual(Conversation.objects.count(), 1)
+
+
+class FastReadSerializerTests(ChatsTestCase):
+
+    def test_values_serializer_matches_model_serializer(self):
+        self.create_messages(5)
+        queryset = Message.objects.filter(chat=self.conversation).order_by('sent_at')
+        expected = JSONRenderer().render(MessageSerializer(queryset, many=True).data)
+        fast = MessageValuesSerializer()
+        self.assertEqual(JSONRenderer().render(fast.serialize(fast.values(queryset))), expected)
+
+    def test_retrieve_uses_same_representation(self):
+        [message] = self.create_messages(1)
+        response = self.client.get(f'{self.messages_url()}{message.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            JSONRenderer().render(response.data),
+            JSONRenderer().render(MessageSerializer(message).data),
+        )
+        self.assertEqual(self.client.get(f'{self.messages_url()}not-a-uuid/').status_code, 404)
+
+
+class ConditionalGetAndSyncTests(ChatsTestCase):
+
+    def test_unchanged_conversation_list_is_304(self):
+        response = self.client.get('/api/chats/')
+        etag = response['ETag']
+        # Only the validator aggregate runs
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/chats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post(self.messages_url(), {'chat': self.conversation.pk, 'message_body': 'hi'})
+        response = self.client.get('/api/chats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_message_list_etag_changes_with_new_messages(self):
+        self.create_messages(3)
+        Conversation.objects.refresh_summary()
+        etag = self.client.get(self.messages_url())['ETag']
+        response = self.client.get(self.messages_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post(self.messages_url(), {'chat': self.conversation.pk, 'message_body': 'new'})
+        response = self.client.get(self.messages_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes_returns_only_new_messages(self):
+        self.create_messages(3)
+        response = self.client.get('/api/chats/changes/')
+        self.assertEqual(response.data['messages'], [])
+        cursor = response.data['cursor']
+
+        other = Conversation.objects.create(title='Private')
+        other.participants.set([self.bob, self.eve])
+        Message.objects.create(sender=self.bob, chat=other, message_body='not for alice')
+        self.client.post(self.messages_url(), {'chat': self.conversation.pk, 'message_body': 'fresh'})
+
+        response = self.client.get('/api/chats/changes/', {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['message_body'] for m in response.data['messages']], ['fresh'])
+        self.assertEqual(
+            [c['title'] for c in response.data['conversations']], ['General']
+        )
+        self.assertFalse(response.data['has_more'])
+
+    def test_changes_pages_through_backlog(self):
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        self.create_messages(5)
+        response = self.client.get('/api/chats/changes/', {'since': since})
+        self.assertEqual(len(response.data['messages']), 5)
+        self.assertEqual(self.client.get('/api/chats/changes/', {'cursor': 'garbage'}).status_code, 400)
+
+    def test_changes_pages_through_conversations(self):
+        for index in range(4):
+            conversation = Conversation.objects.create(title=f'Extra {index}')
+            conversation.participants.set([self.alice, self.bob])
+        cursor = sync.Cursor(
+            reverse=False, sent_at=timezone.now() - timedelta(days=1), message_id=None
+        )
+
+        first = sync.changes_since(self.alice, cursor, limit=3)
+        self.assertEqual(len(first['conversations']), 3)
+        self.assertTrue(first['has_more'])
+        second = sync.changes_since(self.alice, sync.parse_sync_cursor(first['cursor']), limit=3)
+        self.assertFalse(second['has_more'])
+
+        titles = {c.title for c in first['conversations']} | {c.title for c in second['conversations']}
+        self.assertEqual(titles, {'General', 'Extra 0', 'Extra 1', 'Extra 2', 'Extra 3'})
+
+    def test_changes_page_through_conversations_changed_at_once(self):
+        for index in range(6):
+            conversation = Conversation.objects.create(title=f'Extra {index}')
+            conversation.participants.set([self.alice, self.bob])
+        # e.g. a bulk touch(): every conversation changed at the same instant
+        changed_at = timezone.now() - timedelta(hours=1)
+        Conversation.objects.update(created_at=changed_at, updated_at=changed_at)
+        cursor = sync.Cursor(reverse=False, sent_at=changed_at, message_id=None)
+
+        titles = []
+        for _ in range(4):
+            changes = sync.changes_since(self.alice, cursor, limit=3)
+            titles.extend(c.title for c in changes['conversations'])
+            cursor = sync.parse_sync_cursor(changes['cursor'])
+            if not changes['has_more']:
+                break
+        self.assertFalse(changes['has_more'])
+        self.assertEqual(len(titles), 7)
+        self.assertEqual(set(titles), {'General', *(f'Extra {index}' for index in range(6))})
+
+    def test_leaving_a_conversation_moves_last_modified_forward(self):
+        newer = Conversation.objects.create(title='Newer')
+        newer.participants.set([self.alice, self.bob])
+        now = timezone.now()
+        Conversation.objects.filter(pk=self.conversation.pk).update(updated_at=now - timedelta(days=2))
+        Conversation.objects.filter(pk=newer.pk).update(updated_at=now - timedelta(days=1))
+        cache.set(membership_changed_key(self.alice.pk), now - timedelta(days=3), timeout=None)
+        response = self.client.get('/api/chats/')
+        last_modified = response['Last-Modified']
+
+        newer.participants.remove(self.alice)
+        response = self.client.get('/api/chats/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['title'] for c in response.data['results']], ['General'])
+
+
+class MessageListCacheTests(ChatsTestCase):
+
+    def test_repeated_reads_skip_the_database(self):
+        self.create_messages(3)
+        first = self.client.get(self.messages_url())
+        with self.assertNumQueries(0):
+            second = self.client.get(self.messages_url())
+        self.assertEqual(second.data, first.data)
+
+    def test_writes_are_visible_immediately(self):
+        self.client.get(self.messages_url())
+        self.client.post(self.messages_url(), {'chat': self.conversation.pk, 'message_body': 'new'})
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.data['results'][-1]['message_body'], 'new')
+
+        self.client.post(f'{self.messages_url()}bulk/', [{'message_body': 'bulk'}], format='json')
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.data['results'][-1]['message_body'], 'bulk')
+
+    def test_cached_page_is_not_served_to_other_users(self):
+        self.create_messages(2)
+        self.assertEqual(len(self.client.get(self.messages_url()).data['results']), 2)
+        self.client.force_authenticate(self.eve)
+        self.assertEqual(self.client.get(self.messages_url()).data['results'], [])
+
+
+class TieredCacheTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+
+    def make_cache(self, **options):
+        # Separate instances share only the SQLite file, like two worker processes
+        return TieredCache(self.path, {'OPTIONS': {'L1_MAX_ENTRIES': 2, **options}})
+
+    def test_l2_is_shared_between_workers(self):
+        first, second = self.make_cache(), self.make_cache()
+        first.set('greeting', {'hello': 'world'})
+        self.assertEqual(second.get('greeting'), {'hello': 'world'})
+        self.assertTrue(second.add('fresh', 1))
+        self.assertFalse(first.add('fresh', 2))
+
+    def test_l1_is_a_bounded_lru(self):
+        cache = self.make_cache()
+        for key in 'abc':
+            cache.set(key, key)
+        self.assertEqual(list(cache._l1), [cache.make_key('b'), cache.make_key('c')])
+        self.assertEqual(cache.get('a'), 'a')  # still in L2
+
+    def test_excluded_keys_are_never_stale(self):
+        first = self.make_cache(L1_EXCLUDE_PREFIXES=['counter:'])
+        second = self.make_cache(L1_EXCLUDE_PREFIXES=['counter:'])
+        first.set('counter:x', 1)
+        self.assertEqual(second.get('counter:x'), 1)
+        first.incr('counter:x')
+        self.assertEqual(second.get('counter:x'), 2)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        workers = [self.make_cache() for _ in range(2)]
+        results = []
+        threads = [
+            threading.Thread(target=lambda c=c: results.append(c.get_or_set('hot', compute, 60)))
+            for c in workers * 3
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 6)
+        self.assertEqual(len(calls), 1)
+
+    def test_slow_values_are_refreshed_before_expiry(self):
+        cache = self.make_cache(EARLY_REFRESH_BETA=1e6)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.01)
+            return len(calls)
+
+        self.assertEqual(cache.get_or_set('report', compute, 60), 1)
+        self.assertEqual(cache.get_or_set('report', compute, 60), 2)
+        self.assertEqual(self.make_cache(EARLY_REFRESH_BETA=0).get_or_set('report', compute, 60), 2)
+
+
+class SQLiteProfileTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connection_profile_is_applied(self):
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        # FULL: WAL (with which NORMAL is safe) is opt-in, see SQLITE_JOURNAL_MODE
+        self.assertEqual(self.pragma('synchronous'), 2)
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+
+    def test_benchmark_runs(self):
+        out = StringIO()
+        call_command(
+            'bench_sqlite_profile', '--seconds', '0.2', '--messages', '100',
+            '--readers', '2', '--writers', '2', stdout=out,
+        )
+        self.assertIn('tuned:', out.getvalue())
+
+
+class MessageArchiveTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        old = self.create_messages(6, start=timezone.now() - timedelta(days=400))
+        recent = self.create_messages(4, start=timezone.now() - timedelta(hours=1))
+        self.bodies = [m.message_body for m in old + recent]
+        self.old, self.recent = old, recent
+        out = StringIO()
+        call_command('archive_messages', '--batch-size', '4', stdout=out)
+        self.assertIn('Archived 6 messages', out.getvalue())
+
+    def walk(self, url, link):
+        bodies = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = [m['message_body'] for m in response.data['results']]
+            bodies = bodies + page if link == 'next' else page + bodies
+            url = response.data[link]
+        return bodies
+
+    def test_old_messages_are_moved_in_order(self):
+        self.assertEqual(Message.objects.count(), 4)
+        self.assertEqual(ArchivedMessage.objects.count(), 6)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.archived_until, self.old[-1].sent_at)
+
+    def test_list_reads_through_the_archive(self):
+        # The first page starts at the seam, older messages are "previous" pages
+        response = self.client.get(self.messages_url(), {'page_size': 4})
+        self.assertEqual([m['message_body'] for m in response.data['results']], self.bodies[6:])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.walk(response.data['previous'], 'previous'), self.bodies[:6])
+
+        at = self.recent[2].sent_at.isoformat()
+        response = self.client.get(self.messages_url(), {'at': at, 'page_size': 4})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(self.walk(response.data['previous'], 'previous'), self.bodies[:8])
+
+    def test_short_first_page_is_filled_from_the_archive(self):
+        response = self.client.get(self.messages_url(), {'page_size': 6})
+        self.assertEqual([m['message_body'] for m in response.data['results']], self.bodies[4:])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.walk(response.data['previous'], 'previous'), self.bodies[:4])
+
+        response = self.client.get(self.messages_url(), {'page_size': 20})
+        self.assertEqual([m['message_body'] for m in response.data['results']], self.bodies)
+        self.assertIsNone(response.data['previous'])
+
+    def test_first_page_does_not_touch_the_archive(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.messages_url(), {'page_size': 3})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+        self.assertFalse(any('chats_archivedmessage' in q['sql'] for q in queries))
+
+    def test_recent_pages_do_not_touch_the_archive(self):
+        at = (timezone.now() - timedelta(hours=2)).isoformat()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.messages_url(), {'at': at})
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertFalse(any('chats_archivedmessage' in q['sql'] for q in queries))
+
+    def test_archived_messages_stay_reachable(self):
+        response = self.client.get(f'{self.messages_url()}{self.old[0].pk}/')
+        self.assertEqual(response.data['message_body'], 'message 0')
+        Conversation.objects.refresh_summary()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 10)
+
+
+class PrimaryKeyTests(ChatsTestCase):
+
+    def test_uuid7_ids_are_time_ordered(self):
+        ids = [uuid7() for _ in range(5000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual({value.version for value in ids}, {7})
+        self.assertEqual({value.variant for value in ids}, {uuid.RFC_4122})
+        self.assertAlmostEqual(uuid7_timestamp_ms(ids[0]) / 1000, time.time(), delta=5)
+
+    def test_generator_is_configurable(self):
+        self.assertEqual(Message.objects.create(
+            sender=self.alice, chat=self.conversation, message_body='new'
+        ).pk.version, 7)
+        with override_settings(CHATS_UUID_VERSION=4):
+            self.assertEqual(new_id().version, 4)
+
+    def test_rekey_gives_existing_messages_time_ordered_ids(self):
+        with override_settings(CHATS_UUID_VERSION=4):
+            messages = self.create_messages(5)
+        call_command('rekey_messages', '--batch-size', '2', stdout=StringIO())
+        rekeyed = list(Message.objects.order_by('sent_at'))
+        self.assertEqual([m.message_body for m in rekeyed], [m.message_body for m in messages])
+        self.assertTrue(all(m.pk.version == 7 for m in rekeyed))
+        self.assertEqual([m.pk for m in rekeyed], sorted(m.pk for m in rekeyed))
+
+
+class ReadStateTests(ChatsTestCase):
+
+    def read_url(self):
+        return f'/api/chats/{self.conversation.pk}/read/'
+
+    def inbox_unread(self):
+        rooms = {c['title']: c for c in self.client.get('/api/chats/').data['results']}
+        return rooms['General']['unread_count']
+
+    def test_unread_counts_messages_from_others_after_the_watermark(self):
+        messages = self.create_messages(6)  # bob sends the even ones
+        Conversation.objects.refresh_summary()
+        self.assertEqual(self.inbox_unread(), 3)
+
+        response = self.client.post(self.read_url(), {'message_id': str(messages[2].pk)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unread_count'], 1)
+        self.assertEqual(self.inbox_unread(), 1)
+
+    def test_marking_a_backlog_read_is_one_row(self):
+        self.create_messages(200)
+        Conversation.objects.refresh_summary()
+        response = self.client.post(self.read_url())
+        self.assertEqual(response.data['unread_count'], 0)
+        self.assertEqual(self.alice.read_states.count(), 1)
+
+        # Watermarks never move back
+        earlier = (timezone.now() - timedelta(days=2)).isoformat()
+        response = self.client.post(self.read_url(), {'up_to': earlier})
+        self.assertEqual(response.data['unread_count'], 0)
+
+    def test_inbox_etag_changes_when_marked_read(self):
+        self.create_messages(2)
+        Conversation.objects.refresh_summary()
+        etag = self.client.get('/api/chats/')['ETag']
+        self.client.post(self.read_url())
+        response = self.client.get('/api/chats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_participants_can_mark_read(self):
+        self.client.force_authenticate(self.eve)
+        self.assertEqual(self.client.post(self.read_url()).status_code, 404)
+
+
+class MessageStreamTests(ChatsTestCase):
+
+    def stream_url(self):
+        return f'{self.messages_url()}stream/'
+
+    async def open_stream(self, user=None, **headers):
+        if user is not None:
+            headers['Authorization'] = f'Bearer {AccessToken.for_user(user)}'
+        response = await self.async_client.get(self.stream_url(), headers=headers)
+        if not response.streaming:
+            return response, None
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+        return response, stream
+
+    def post_message(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.messages_url(), {'chat': self.conversation.pk, 'message_body': body})
+
+    async def next_frame(self, stream):
+        return await asyncio.wait_for(anext(stream), timeout=1)
+
+    async def test_posted_messages_are_pushed(self):
+        response, stream = await self.open_stream(self.alice)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(realtime.broker.subscriber_count(self.conversation.pk), 1)
+
+        await sync_to_async(self.post_message)('live')
+        frame = await self.next_frame(stream)
+        self.assertIn(b'event: message', frame)
+        self.assertIn(b'"message_body": "live"', frame)
+        await stream.aclose()
+
+    async def test_reconnect_replays_missed_messages(self):
+        first, *missed = await sync_to_async(self.create_messages)(3)
+        event_id = realtime.message_event_id(first.sent_at, first.message_id)
+        _, stream = await self.open_stream(self.alice, **{'Last-Event-ID': event_id})
+        replayed = [await self.next_frame(stream), await self.next_frame(stream)]
+        self.assertIn(b'message 1', replayed[0])
+        self.assertIn(b'message 2', replayed[1])
+        await stream.aclose()
+
+    async def test_slow_client_is_told_to_resync(self):
+        subscription = realtime.broker.subscribe(self.conversation.pk, self.alice.pk, max_queue=2)
+        frames = [realtime.format_event({'n': n}, event='message') for n in range(3)]
+        realtime.broker.publish(self.conversation.pk, frames)
+
+        stream = realtime.event_stream(subscription)
+        await anext(stream)  # retry
+        self.assertIn(b'event: resync', await self.next_frame(stream))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertEqual(realtime.broker.subscriber_count(self.conversation.pk), 0)
+
+    async def test_removed_participant_is_disconnected(self):
+        _, stream = await self.open_stream(self.bob)
+        await sync_to_async(self.conversation.participants.remove)(self.bob)
+        self.assertIn(b'event: revoked', await self.next_frame(stream))
+
+    async def test_only_participants_can_subscribe(self):
+        response, _ = await self.open_stream(self.eve)
+        self.assertEqual(response.status_code, 404)
+        response, _ = await self.open_stream()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(realtime.broker.subscriber_count(self.conversation.pk), 0)
+
+
+# Read replica for ReadReplicaRoutingTests, configured in messaging_app/test_settings.py
+REPLICA_TEST_ALIAS = 'replica_test'
+HAS_REPLICA_TEST_DATABASE = REPLICA_TEST_ALIAS in settings.DATABASES
+
+
+@skipUnless(HAS_REPLICA_TEST_DATABASE, 'needs the databases of messaging_app.test_settings')
+@override_settings(CACHES=TEST_CACHES, DATABASE_REPLICAS=[REPLICA_TEST_ALIAS])
+class ReadReplicaRoutingTests(ChatsFixtures, TransactionTestCase):
+    '''
+    Primary (the default test database) and a replica that never catches up.
+    Not a TestCase: its transaction would send every read to the primary.
+    '''
+    replica = REPLICA_TEST_ALIAS
+    databases = {'default', REPLICA_TEST_ALIAS} if HAS_REPLICA_TEST_DATABASE else {'default'}
+
+    def setUp(self):
+        super().setUp()
+        # Replicate the fixtures
+        through = Conversation.participants.through
+        for model in (User, Conversation, through):
+            model.objects.using(self.replica).bulk_create(model.objects.using('default'))
+
+    def post_message(self, body):
+        response = self.client.post(
+            self.messages_url(), {'chat': self.conversation.pk, 'message_body': body}
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def bodies(self, client):
+        response = client.get(self.messages_url())
+        return [message['message_body'] for message in response.json()['results']]
+
+    def test_reads_go_to_the_replica(self):
+        with self.assertNumQueries(0, using='default'):
+            response = self.client.get('/api/chats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_writer_reads_its_own_writes(self):
+        self.post_message('hello')
+        self.assertEqual(self.bodies(self.client), ['hello'])
+
+        # Other users read the replica, which hasn't seen the message yet
+        bob = APIClient()
+        bob.force_authenticate(self.bob)
+        self.assertEqual(self.bodies(bob), [])
+
+    def test_pin_expires(self):
+        self.post_message('hello')
+        cache.delete(routers.pin_key(self.alice.pk))
+        self.assertEqual(self.bodies(self.client), [])
+
+    def test_writes_go_to_the_primary(self):
+        self.post_message('hello')
+        self.assertTrue(Message.objects.using('default').filter(message_body='hello').exists())
+        self.assertFalse(Message.objects.using(self.replica).exists())
+
+    def test_reads_in_a_transaction_go_to_the_primary(self):
+        with routers.request_scope():
+            self.assertEqual(routers.PrimaryReplicaRouter().db_for_read(Message), self.replica)
+            with transaction.atomic():
+                self.assertEqual(Message.objects.all().db, 'default')
+
+    def test_archive_runs_on_the_primary(self):
+        self.create_messages(5, start=timezone.now() - timedelta(days=365))
+        Message.objects.using(self.replica).bulk_create(Message.objects.using('default'))
+
+        self.assertEqual(archive_messages(), 5)
+        self.assertFalse(Message.objects.using('default').exists())
+        self.assertEqual(ArchivedMessage.objects.using('default').count(), 5)
+        # The replica is left to replication
+        self.assertEqual(Message.objects.using(self.replica).count(), 5)
+
+
+class MetricsTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_are_recorded_by_route_pattern(self):
+        self.create_messages(3)
+        self.client.get(self.messages_url())
+        self.client.get(self.messages_url(Conversation.objects.create(title='Other')))
+        self.client.post('/api/chats/', {}, format='json')
+
+        route = 'api/chats/<chat_pk>/messages/'
+        self.assertEqual(self.registry.responses[(route, 'GET', 200)], 2)
+        self.assertEqual(self.registry.responses[('api/chats/', 'POST', 400)], 1)
+        self.assertEqual(self.registry.latency[(route, 'GET')].count, 2)
+        self.assertGreater(self.registry.query_counts[(route, 'GET')].sum, 0)
+        self.assertEqual(self.registry.in_flight, 0)
+
+    def test_endpoint_is_limited_to_staff_and_admins(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics/').status_code, 401)
+
+        self.alice.is_staff = True
+        self.alice.save()
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('http_responses_total{route="metrics/",method="GET",status="403"} 1',
+                      response.content.decode())
@@ -1,7 +1,7 @@
 from django.urls import path, include
 # You must import the router from the installed nested routers package
 from rest_framework_nested import routers 
-from .views import ConversationViewSet, MessageViewSet
+from .views import ConversationViewSet, MessageSearchView, MessageViewSet, message_stream
 
 # 1. Use DefaultRouter for the primary resource
 router = routers.DefaultRouter()
@@ -16,9 +16,14 @@ chats_router.register(r'messages', MessageViewSet, basename='chat-messages')
 
 # Combine all URLs
 urlpatterns = [
+    # Server-Sent Events push of new messages (ASGI only). Listed before the routers,
+    # whose message detail route would otherwise take 'stream' as a message id.
+    path('chats/<uuid:chat_pk>/messages/stream/', message_stream, name='chat-messages-stream'),
     # Include the router URLs
     path('', include(router.urls)), 
     # Include the nested router URLs
     path('', include(chats_router.urls)),
+    # Ranked full-text search across the user's conversations
+    path('search/messages/', MessageSearchView.as_view(), name='message-search'),
 ]
 
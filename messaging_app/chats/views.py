@@ -1,16 +1,61 @@
-from django.db.models import Q
+from datetime import timedelta
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from rest_framework import filters, permissions, viewsets
+from django.views.decorators.http import condition, require_GET
+from rest_framework import filters, generics, permissions, serializers, status, viewsets
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.response import Response
 
-from .models import Conversation, Message
+from .caching import MESSAGE_LIST_CACHE_TIMEOUT, bump_message_version, message_list_cache_key
+from .membership import is_participant
+from .archive import with_archive
+from .models import ArchivedMessage, Conversation, Message, User
+from .pagination import MessageCursorPagination, SearchResultsPagination, parse_timestamp
 from .permissions import IsConversationParticipant
-from .serializers import ConversationSerializer, MessageSerializer
+from .read_state import mark_read, unread_count
+from .search import MessageSearchFilter, RankedMessageSearch
+from . import metrics, realtime, routers, sync
+from .serializers import (
+    ConversationListSerializer,
+    ConversationSerializer,
+    MarkReadSerializer,
+    MessageSearchResultSerializer,
+    MessageSerializer,
+    MessageValuesSerializer,
+)
+
+
+class ReadYourWritesMixin:
+    """
+    Reads of a user who wrote in the last few seconds go to the primary database,
+    not a possibly lagging replica (see chats/routers.py). Checked once the
+    request is authenticated.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        routers.pin_if_recent_write(request.user)
 
 
 # --- 1. Conversation ViewSet (Top-level resource: /api/chats/) ---
-class ConversationViewSet(viewsets.ModelViewSet):
+# Conditional GET: polls of an unchanged inbox get a 304 before any serialization.
+@method_decorator(
+    condition(
+        etag_func=sync.conversation_list_etag,
+        last_modified_func=sync.conversation_list_last_modified,
+    ),
+    name="list",
+)
+class ConversationViewSet(ReadYourWritesMixin, viewsets.ModelViewSet):
     """
     Provides endpoints for listing, creating, retrieving, updating, and deleting Conversations.
     """
@@ -20,9 +65,14 @@ class ConversationViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsConversationParticipant]
 
     # ADDED: Includes SearchFilter to satisfy the 'filters' check.
+    # The LIKE scan only covers the user's own conversations (see get_queryset);
+    # message bodies are searched through the full-text index instead.
     filter_backends = [filters.SearchFilter]
     search_fields = ["title", "participants__email"]
 
+    # Most conversations accepted by the bulk create action
+    bulk_max_size = 500
+
     def get_queryset(self):
         """
         CRITICAL SECURITY: Filters conversations to only include those
@@ -30,35 +80,156 @@ class ConversationViewSet(viewsets.ModelViewSet):
         """
         user = self.request.user
         # Filter where the 'participants' ManyToMany field contains the user object.
-        return Conversation.objects.filter(participants=user).order_by("-created_at")
+        queryset = Conversation.objects.filter(participants=user).order_by("-created_at")
+
+        if self.action == "list":
+            # Inbox: most recently active first, summary columns instead of aggregates,
+            # participants prefetched in bulk
+            queryset = (
+                queryset.with_list_summary().with_unread_count(user).order_by_activity()
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        """
+        Uses the lightweight inbox representation for the list endpoint instead of
+        nesting every message of every conversation.
+        """
+        if self.action == "list":
+            return ConversationListSerializer
+        return super().get_serializer_class()
 
     def perform_create(self, serializer):
         """
         Ensures the creating user is automatically added as a participant
         when a new conversation is initialized.
         """
-        instance = serializer.save()
+        # The serializer inserts the creator together with the other participants
+        serializer.save(creator=self.request.user)
+
+    @action(detail=True, methods=["post"])
+    def read(self, request, pk=None):
+        """
+        Marks the conversation read: POST /api/chats/{id}/read/ with an optional
+        {"message_id": ...} or {"up_to": <ISO 8601>}, default up to the latest message.
+        Only the user's watermark row is written, whatever the size of the backlog.
+        Returns the watermark and what is still unread.
+        """
+        conversation = self.get_object()
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        # Explicitly add the creating user to the participants set.
-        if self.request.user not in instance.participants.all():
-            instance.participants.add(self.request.user)
-            instance.save()
+        now = timezone.now()
+        if "message_id" in serializer.validated_data:
+            message_id = serializer.validated_data["message_id"]
+            up_to = None
+            for model in (Message, ArchivedMessage):
+                up_to = (
+                    model.objects.filter(chat=conversation, pk=message_id)
+                    .values_list("sent_at", flat=True)
+                    .first()
+                )
+                if up_to is not None:
+                    break
+            if up_to is None:
+                raise ValidationError({"message_id": ["Message not found in this conversation."]})
+        else:
+            up_to = serializer.validated_data.get("up_to", conversation.last_message_at or now)
+        # Future watermarks would silently mark messages read before they are sent
+        up_to = min(up_to, now)
+
+        last_read_at = mark_read(conversation.pk, request.user, up_to)
+        return Response({
+            "conversation_id": conversation.pk,
+            "last_read_at": serializers.DateTimeField().to_representation(last_read_at),
+            "unread_count": unread_count(conversation.pk, request.user, last_read_at),
+        })
+
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        """
+        Delta sync: GET /api/chats/changes/?cursor=<token> returns only the messages and
+        conversations that changed since the token was issued, plus the next token.
+        Without a token (after a full load) it just issues one; ?since=<ISO 8601>
+        starts from a point in time instead. Items may repeat across calls, clients
+        de-duplicate them by id.
+        """
+        token = request.query_params.get("cursor")
+        since = request.query_params.get("since")
+        try:
+            if token:
+                cursor = sync.parse_sync_cursor(token)
+            elif since:
+                cursor = sync.Cursor(reverse=False, sent_at=parse_timestamp(since), message_id=None)
+            else:
+                cursor = None
+        except ValueError:
+            raise ValidationError({"cursor": ["Invalid cursor or timestamp."]})
+
+        if cursor is None:
+            return Response({
+                "conversations": [],
+                "messages": [],
+                "cursor": sync.encode_cursor_token(sync.initial_sync_cursor()),
+                "has_more": False,
+            })
+
+        changes = sync.changes_since(request.user, cursor)
+        context = self.get_serializer_context()
+        return Response({
+            "conversations": ConversationListSerializer(
+                changes["conversations"], many=True, context=context
+            ).data,
+            "messages": MessageValuesSerializer().serialize(changes["messages"]),
+            "cursor": changes["cursor"],
+            "has_more": changes["has_more"],
+        })
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request):
+        """
+        Creates many conversations in one call (e.g. onboarding imports):
+        POST /api/chats/bulk/ with a JSON list of {"title", "participant_ids"}.
+        The creator joins every conversation. All participant ids are validated
+        with one query and the whole batch is written in one transaction.
+        """
+        serializer = self.get_serializer(
+            data=request.data, many=True, max_length=self.bulk_max_size
+        )
+        serializer.is_valid(raise_exception=True)
+        conversations = serializer.save(creator=request.user)
+
+        created = Conversation.objects.filter(
+            pk__in=[conversation.pk for conversation in conversations]
+        ).with_list_summary().with_unread_count(request.user)
+        return Response(
+            ConversationListSerializer(created, many=True, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED,
+        )
 
 
 # --- 2. Message ViewSet (Nested resource: /api/chats/{chat_pk}/messages/) ---
-# Apply cache_page(60) only to the 'list' action (GET request for the message list).
-# The cache will hold the list of messages for 60 seconds for each unique URL path (e.g., /chats/{uuid}/messages/).
-@method_decorator(cache_page(60), name="list")
-class MessageViewSet(viewsets.ModelViewSet):
+# Conditional GET on the message list, validated from the conversation's message
+# version: an unchanged conversation answers 304 without any database query.
+@method_decorator(condition(etag_func=sync.message_list_etag), name="list")
+class MessageViewSet(ReadYourWritesMixin, viewsets.ModelViewSet):
     """
     Provides endpoints for listing and creating Messages within a specific Conversation.
     """
 
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Keyset pagination on (sent_at, message_id) instead of the global PageNumberPagination,
+    # so deep pages in long conversations don't pay for COUNT(*) and OFFSET scans.
+    pagination_class = MessageCursorPagination
 
-    # ADDED: Includes SearchFilter to satisfy the 'filters' check.
-    filter_backends = [filters.SearchFilter]
+    # Limits for the bulk ingest action
+    bulk_max_size = 1000
+    bulk_write_batch_size = 250
+
+    # ?search= is answered by the FTS5 index on message bodies (see chats/search.py);
+    # the other search_fields are matched as usual.
+    filter_backends = [MessageSearchFilter]
     search_fields = ["message_body", "sender__email"]
 
     def get_queryset(self):
@@ -67,34 +238,245 @@ class MessageViewSet(viewsets.ModelViewSet):
         1. The message belongs to the Conversation ID (`chat_pk`) from the URL.
         2. The current user must be a participant in that specific Conversation.
         """
-        user = self.request.user
         # Retrieve the 'chat_pk' from the URL keywords (defined in urls.py).
         chat_pk = self.kwargs.get("chat_pk")
 
-        if not chat_pk:
+        # The membership check is answered once per request (EXISTS or cache hit),
+        # so the message query itself doesn't need to join the participants table.
+        if not chat_pk or not is_participant(self.request.user, chat_pk, self.request):
             return Message.objects.none()
 
-        # Filter messages by the chat ID AND check if the user is a participant
-        # of the chat using double underscore lookups.
         return (
-            Message.objects.filter(
-                Q(chat__conversation_id=chat_pk) & Q(chat__participants=user)
-            )
+            Message.objects.filter(chat_id=chat_pk)
             .select_related("sender", "chat")
             .order_by("sent_at")
         )
 
+    # Read path for list/retrieve: .values() rows + precompiled converters,
+    # same JSON as MessageSerializer without per-instance field machinery.
+    read_serializer = MessageValuesSerializer()
+
+    def list(self, request, *args, **kwargs):
+        """
+        Pages are cached per user and per conversation version (see chats/caching.py):
+        repeated reads skip the database, and any message write makes them stale at once.
+        """
+        chat_pk = self.kwargs.get("chat_pk")
+        if not is_participant(request.user, chat_pk, request):
+            return Response(self.list_data())
+        # get_or_set: concurrent misses on a hot page (e.g. right after a new message)
+        # are computed once, see chats/cache_backends.py
+        return Response(
+            cache.get_or_set(
+                message_list_cache_key(request, chat_pk),
+                self.list_data,
+                MESSAGE_LIST_CACHE_TIMEOUT,
+            )
+        )
+
+    def get_archive_queryset(self):
+        """Archived messages of the conversation, same access rule as get_queryset"""
+        chat_pk = self.kwargs.get("chat_pk")
+        if not is_participant(self.request.user, chat_pk, self.request):
+            return ArchivedMessage.objects.none()
+        return ArchivedMessage.objects.filter(chat_id=chat_pk)
+
+    def list_data(self):
+        chat_pk = self.kwargs.get("chat_pk")
+        rows = self.read_serializer.values(self.filter_queryset(self.get_queryset()))
+        # Search is answered from the hot table (archived messages are not indexed);
+        # plain listing reads through into the archive once a page reaches it.
+        search = self.request.query_params.get("search")
+        if not search and is_participant(self.request.user, chat_pk, self.request):
+            rows = with_archive(
+                rows, self.read_serializer.values(self.get_archive_queryset()), chat_pk
+            )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.read_serializer.serialize(page)).data
+        return self.read_serializer.serialize(rows)
+
+    def retrieve(self, request, *args, **kwargs):
+        # MessageViewSet has no object-level permissions: access is decided by
+        # get_queryset (membership), so the row can be fetched directly.
+        rows = self.read_serializer.values(self.filter_queryset(self.get_queryset()))
+        try:
+            row = generics.get_object_or_404(rows, pk=self.kwargs[self.lookup_field])
+        except Http404:
+            # Not in the hot table, the message may have been archived
+            archived = self.read_serializer.values(self.get_archive_queryset())
+            row = generics.get_object_or_404(archived, pk=self.kwargs[self.lookup_field])
+        return Response(self.read_serializer.to_representation(row))
+
     def perform_create(self, serializer):
         """
         Automatically sets the sender and links the message to the parent Conversation.
         """
         chat_pk = self.kwargs.get("chat_pk")
 
-        # 1. Retrieve the parent conversation instance based on URL and user participation.
-        # This acts as a security check: if the user isn't a participant, they cannot post a message.
-        conversation = get_object_or_404(
-            Conversation.objects.filter(participants=self.request.user), pk=chat_pk
+        # 1. Security check: if the user isn't a participant, they cannot post a message.
+        if not is_participant(self.request.user, chat_pk, self.request):
+            raise NotFound()
+
+        # Retrieve the parent conversation instance based on the URL.
+        conversation = get_object_or_404(Conversation, pk=chat_pk)
+
+        # 2. Save the message, using the current user as the sender and the found conversation,
+        # and fold it into the conversation's activity summary in the same transaction.
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user, chat=conversation)
+            Conversation.objects.filter(pk=conversation.pk).record_messages([message])
+            transaction.on_commit(partial(realtime.publish_messages, conversation.pk, [message]))
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request, chat_pk=None):
+        """
+        Creates a batch of messages in one call: POST /api/chats/{chat_pk}/messages/bulk/
+        with a JSON list of messages (or {"messages": [...]}).
+
+        Membership is checked once, the batch is validated with MessageSerializer(many=True)
+        and every valid message is written with a single bulk_create in one transaction.
+        Invalid items are reported by index without failing the rest of the batch.
+        """
+        if not is_participant(request.user, chat_pk, request):
+            raise NotFound()
+        conversation = get_object_or_404(Conversation, pk=chat_pk)
+
+        items = request.data.get("messages") if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({"messages": ["Expected a non-empty list of messages."]})
+        if len(items) > self.bulk_max_size:
+            raise ValidationError(
+                {"messages": [f"At most {self.bulk_max_size} messages per batch."]}
+            )
+
+        batch = self.get_serializer(data=items, many=True)
+        # The conversation comes from the URL: drop the per-item chat field (and its
+        # per-item lookup query) from validation
+        batch.child.fields.pop("chat")
+
+        # Validate item by item so one bad message doesn't reject the whole batch
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                valid.append(batch.child.run_validation(item))
+            except ValidationError as exc:
+                errors.append({"index": index, "errors": exc.detail})
+
+        if not valid:
+            return Response({"created": [], "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Keep the batch order: consecutive timestamps, one microsecond apart
+        sent_at = timezone.now()
+        messages = [
+            Message(
+                sender=request.user,
+                chat=conversation,
+                message_body=data["message_body"],
+                sent_at=sent_at + timedelta(microseconds=offset),
+            )
+            for offset, data in enumerate(valid)
+        ]
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=self.bulk_write_batch_size)
+            Conversation.objects.filter(pk=conversation.pk).record_messages(messages)
+            # bulk_create sends no post_save signal, invalidate the cached lists here
+            bump_message_version(conversation.pk)
+            transaction.on_commit(partial(realtime.publish_messages, conversation.pk, messages))
+
+        return Response(
+            {"created": self.get_serializer(messages, many=True).data, "errors": errors},
+            status=status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED,
+        )
+
+    def perform_update(self, serializer):
+        """
+        Edits may change the last message preview, so the summary is recomputed.
+        """
+        with transaction.atomic():
+            message = serializer.save()
+            Conversation.objects.filter(pk=message.chat_id).refresh_summary()
+
+    def perform_destroy(self, instance):
+        """
+        Deleting a message changes the count and possibly the last message.
+        """
+        with transaction.atomic():
+            instance.delete()
+            Conversation.objects.filter(pk=instance.chat_id).refresh_summary()
+
+
+# --- 3. Message search (/api/search/messages/?search=...) ---
+class MessageSearchView(ReadYourWritesMixin, generics.ListAPIView):
+    """
+    Full-text search over messages in every conversation the user participates in,
+    ordered by relevance. Pass ?chat=<conversation_id> to search a single conversation.
+    """
+
+    serializer_class = MessageSearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SearchResultsPagination
+    # Ranking, matching and the membership restriction all happen in the search backend
+    filter_backends = []
+
+    def get_queryset(self):
+        conversation_id = self.request.query_params.get("chat")
+        if conversation_id:
+            conversation_id = serializers.UUIDField().run_validation(conversation_id)
+        return RankedMessageSearch(
+            self.request.user,
+            self.request.query_params.get("search", ""),
+            conversation_id=conversation_id,
         )
 
-        # 2. Save the message, using the current user as the sender and the found conversation.
-        serializer.save(sender=self.request.user, chat=conversation)
+
+# --- 4. Real-time push (/api/chats/{chat_pk}/messages/stream/) ---
+@require_GET
+async def message_stream(request, chat_pk):
+    """
+    Server-Sent Events stream of the messages posted to a conversation, for clients
+    that would otherwise poll the message list. Authenticates like the API (JWT or
+    session) and only participants may subscribe. Reconnecting EventSource clients
+    send Last-Event-ID and get the messages they missed replayed first.
+
+    Events: `message` (same JSON as the message list), `resync` (the client fell
+    behind: catch up with /api/chats/changes/, then reconnect) and `revoked` (the
+    user was removed from the conversation).
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI an endless stream would pin a worker thread per client
+        return JsonResponse({"detail": "Streaming requires an ASGI server."}, status=501)
+
+    user = await sync_to_async(realtime.authenticate)(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+    if not await sync_to_async(is_participant)(user, chat_pk, request):
+        return JsonResponse({"detail": "Not found."}, status=404)
+
+    subscription, replay, resync = await realtime.open_stream(request, user, chat_pk)
+    response = StreamingHttpResponse(
+        realtime.event_stream(subscription, replay, resync),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Disable response buffering in nginx so events go out immediately
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# --- 5. Metrics (/metrics/) ---
+@api_view(["GET"])
+def metrics_view(request):
+    """
+    Request metrics of every worker (see chats/metrics.py), in the Prometheus
+    text format. Staff and admin-role users only.
+    """
+    user = request.user
+    if not (user.is_staff or user.role == User.Role.ADMIN):
+        raise PermissionDenied("Metrics are restricted to administrators.")
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -1,3 +1,5 @@
+import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -30,11 +32,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the time spent in the other middleware is measured (chats/metrics.py)
+    "chats.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "chats.middleware.ReadYourWritesMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -63,13 +68,64 @@ WSGI_APPLICATION = "messaging_app.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# SQLite connection profile, applied to every new connection. Each value can be
+# overridden from the environment (e.g. SQLITE_MMAP_SIZE=0 to turn mmap off).
+# journal_mode is the exception: it is written into the database file (and
+# leaves -wal/-shm files next to it), so it is opt-in, for the deployed
+# database only: SQLITE_JOURNAL_MODE=WAL lets readers and the writer run
+# without blocking each other.
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE")
+SQLITE_PRAGMAS = {
+    **({"journal_mode": SQLITE_JOURNAL_MODE} if SQLITE_JOURNAL_MODE else {}),
+    # Wait (ms) for a lock instead of failing with "database is locked"
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+    # With WAL, NORMAL only fsyncs at checkpoints and is still safe against
+    # corruption; the rollback journal needs FULL for that
+    "synchronous": os.environ.get(
+        "SQLITE_SYNCHRONOUS", "NORMAL" if (SQLITE_JOURNAL_MODE or "").upper() == "WAL" else "FULL"
+    ),
+    # Bytes of the file read through mmap instead of read() calls
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 2**20)),
+    # Page cache per connection; negative values are KiB
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64 * 1024)),
+    # Sorts and temporary indexes in memory
+    "temp_store": os.environ.get("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            "init_command": ";".join(
+                f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+            ),
+            # Take the write lock when a transaction starts: a deferred
+            # transaction that reads and then writes can't wait for the lock
+            # (busy_timeout doesn't apply) and fails with "database is locked".
+            "transaction_mode": "IMMEDIATE",
+        },
+        # Persistent connections, checked before reuse
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 600)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Read replicas (see chats/routers.py), e.g. CHATS_DB_REPLICAS="/srv/replica1.sqlite3"
+# (comma separated). Reads go to a replica unless the request or, for
+# CHATS_REPLICA_PIN_SECONDS after a write, the user is pinned to the primary.
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.environ.get("CHATS_DB_REPLICAS", "").split(","))):
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "NAME": path,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica_{index}")
+
+DATABASE_ROUTERS = ["chats.routers.PrimaryReplicaRouter"]
+CHATS_REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -138,12 +194,39 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),  # Refresh tokens are valid for 7 days
     "ROTATE_REFRESH_TOKENS": True,  # Enhances security
     "AUTH_HEADER_TYPES": ("Bearer",),  # Standard header type for API tokens
+    "USER_ID_FIELD": "user_id",  # The custom User model's primary key
 }
 
+# Primary keys of users, conversations and messages: 7 for time-ordered UUIDv7
+# (appends to the end of the index), 4 for random UUIDv4. UUIDv7 reveals when a
+# row was created, to the millisecond. See chats/ids.py.
+CHATS_UUID_VERSION = 7
+
 # CACHES
+# Two-tier cache (see chats/cache_backends.py): a per-process LRU in front of a
+# SQLite file shared by every worker on the node, so workers don't each start cold.
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "unique-snowflake",
+        "BACKEND": "chats.cache_backends.TieredCache",
+        "LOCATION": os.environ.get("CHATS_CACHE_PATH", str(BASE_DIR / "cache.sqlite3")),
+        "OPTIONS": {
+            "MAX_ENTRIES": 100_000,
+            "L1_MAX_ENTRIES": 1000,
+            # Upper bound on how long one worker may miss another worker's write
+            "L1_TIMEOUT": 2,
+            # Invalidation counters and authorization answers (membership) must
+            # be seen by every worker right away
+            "L1_EXCLUDE_PREFIXES": ("chats:messages:version:", "chats:membership:"),
+        },
     }
 }
+
+# --- Metrics (chats/metrics.py, served at /metrics/) ---
+# Each worker writes its counters here every METRICS_FLUSH_INTERVAL seconds; the
+# endpoint merges them. Runtime state, not part of the project: point it at the
+# server's runtime directory (e.g. /run/messaging_app/metrics) and empty it when
+# the server restarts.
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "messaging_app_metrics")
+)
+METRICS_FLUSH_INTERVAL = 5
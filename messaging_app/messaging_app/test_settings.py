@@ -0,0 +1,23 @@
+"""
+Settings for the test suite (`python manage.py test` picks them up): the
+project settings plus the databases only tests use.
+"""
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+# Read replica for ReadReplicaRoutingTests: a second SQLite file, created and
+# migrated by the test runner like the default test database (only when a
+# selected test uses it). Not in DATABASE_REPLICAS: the tests enable it.
+REPLICA_TEST_ALIAS = "replica_test"
+_replica_path = os.path.join(tempfile.gettempdir(), f"chats_test_replica_{os.getpid()}.sqlite3")
+DATABASES[REPLICA_TEST_ALIAS] = {
+    **DATABASES["default"],
+    "NAME": _replica_path,
+    "TEST": {"NAME": _replica_path},
+}
+
+# Metrics stay in the test process (see chats/metrics.py)
+METRICS_DIR = None
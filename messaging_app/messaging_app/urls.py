@@ -5,6 +5,8 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView
 )
 
+from chats.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -19,4 +21,7 @@ urlpatterns = [
     # This path is what creates the required '/api/' prefix.
     # The include() function delegates all the routes defined in chats/urls.py
     path('api/', include('chats.urls')),
+
+    # Prometheus scrape endpoint (staff and admins), see chats/metrics.py
+    path('metrics/', metrics_view, name='metrics'),
 ]